@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+'''Seeded generators of synthetic, realistically-shaped input data.
+
+Every generator takes a random.Random instance, so the same seed always
+yields the same data.
+'''
+import csv
+import lzma
+from unidecode import unidecode
+
+FIRST_NAMES = ['João', 'José', 'Maria', 'Ana', 'Antônio', 'Francisco',
+               'Carlos', 'Paulo', 'Pedro', 'Lucas', 'Luiz', 'Marcos',
+               'Luís', 'Gabriel', 'Rafael', 'Daniel', 'Marcelo', 'Bruno',
+               'Eduardo', 'Felipe', 'Raimundo', 'Rodrigo', 'Fernanda',
+               'Patrícia', 'Aline', 'Sandra', 'Camila', 'Amanda', 'Bruna',
+               'Jéssica', 'Letícia', 'Júlia', 'Luciana', 'Vanessa', 'Mariana',
+               'Gabriela', 'Vera', 'Vitória', 'Larissa', 'Cláudia', 'Beatriz',
+               'Juliana', 'Márcio', 'Fábio', 'Sérgio', 'Ricardo', 'Thiago',
+               'Vinícius', 'Leonardo', 'Gustavo', 'Henrique', 'Matheus']
+LAST_NAMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira',
+              'Alves', 'Pereira', 'Lima', 'Gomes', 'Costa', 'Ribeiro',
+              'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes',
+              'Vieira', 'Barbosa', 'Rocha', 'Dias', 'Nascimento', 'Andrade',
+              'Moreira', 'Nunes', 'Marques', 'Machado', 'Mendes', 'Freitas',
+              'Cardoso', 'Ramos', 'Gonçalves', 'Santana', 'Teixeira',
+              'Wangenheim', 'Siqueira', 'Dorneles', 'Knochenhauer', 'Plentz',
+              'Guntzel', 'Dantas', 'Nassar', 'Castro', 'Borin', 'Westphall',
+              'Fröhlich', 'Schneider', 'Becker', 'Zimmermann', 'Schmitt',
+              'Cavalcanti', 'Albuquerque', 'Bittencourt', 'Magalhães']
+PARTICLES = ['da', 'de', 'do', 'dos', 'das', 'e']
+
+TITLE_WORDS = ['approach', 'semantic', 'distributed', 'learning', 'network',
+               'model', 'efficient', 'analysis', 'web', 'data', 'graph',
+               'optimization', 'framework', 'evaluation', 'system', 'deep',
+               'energy', 'software', 'query', 'ontology', 'secure', 'cloud']
+VENUES = ['IEEE Access', 'Information Sciences', 'SBBD', 'SBES', 'WWW',
+          'Expert Systems with Applications', 'Journal of Web Semantics',
+          'ICSE', 'Future Generation Computer Systems', 'SBRC']
+SICLAP = ['A1', 'A2', 'B1', 'B2', 'B3', 'B4', 'B5', 'C', '']
+
+def person(rng):
+    '''A full name: first name, up to 3 middle names and a last name'''
+    parts = [rng.choice(FIRST_NAMES)]
+    for i in range(rng.choice([0, 1, 1, 2, 2, 3])):
+        if rng.random() < 0.3:
+            parts.append(rng.choice(PARTICLES))
+        parts.append(rng.choice(LAST_NAMES if i else FIRST_NAMES + LAST_NAMES))
+    parts.append(rng.choice(LAST_NAMES))
+    return ' '.join(parts)
+
+def people(rng, n):
+    result, seen = [], set()
+    while len(result) < n:
+        p = person(rng)
+        if p not in seen:
+            seen.add(p)
+            result.append(p)
+    return result
+
+def _typo(rng, word):
+    i = rng.randrange(1, len(word))
+    op = rng.choice(['swap', 'drop', 'replace'])
+    if op == 'swap' and i < len(word) - 1:
+        return word[:i] + word[i+1] + word[i] + word[i+2:]
+    if op == 'drop':
+        return word[:i] + word[i+1:]
+    return word[:i] + rng.choice('aeiou') + word[i+1:]
+
+def variant(rng, name, first_initial=True):
+    '''A name as it could be written by another source: dropped or
+    abbreviated middle names, no accents, other case, last-name typos and,
+    if first_initial, an abbreviated first name'''
+    parts = name.split()
+    first, middle, last = parts[0], parts[1:-1], parts[-1] if len(parts) > 1 else ''
+    middle = [m for m in middle if m.lower() not in PARTICLES or rng.random() < 0.5]
+    r = rng.random()
+    if r < 0.3:
+        middle = [m[0] + '.' for m in middle if m.lower() not in PARTICLES]
+    elif r < 0.5 and middle:
+        del middle[rng.randrange(len(middle))]
+    if first_initial and rng.random() < 0.2:
+        first = first[0] + '.'
+    if len(last) >= 7 and rng.random() < 0.1:
+        last = _typo(rng, last)
+    result = ' '.join([first] + middle + ([last] if last else []))
+    if rng.random() < 0.5:
+        result = unidecode(result)
+    return result.upper() if rng.random() < 0.5 else result
+
+def _split(name):
+    parts = name.split()
+    return parts[:-1], parts[-1]
+
+def author(rng, name, order):
+    '''Format name for an author list in a parse_authors() order'''
+    given, last = _split(name)
+    given = [g for g in given if g.lower() not in PARTICLES]
+    if order == ',':
+        if rng.random() < 0.5:
+            given = [g[0] + '.' for g in given]
+        return f'{last.upper()}, {" ".join(given)}'
+    if order == 'LAST_FIRST':
+        return f'{last} {"".join(g[0] + "." for g in given)}'
+    if order == 'FIRST_FIRST':
+        return f'{"".join(g[0] for g in given).upper()} {last}'
+    raise ValueError(f'Unexpected order: {order}')
+
+AUTHOR_SEPS = {',': '; ', 'LAST_FIRST': ', ', 'FIRST_FIRST': '; '}
+
+def author_list(rng, names, order, max_authors=6):
+    k = rng.randint(1, min(max_authors, len(names)))
+    return AUTHOR_SEPS[order].join(author(rng, n, order) \
+                                   for n in rng.sample(names, k))
+
+def title(rng):
+    return ' '.join(rng.choice(TITLE_WORDS) for i in range(rng.randint(3, 9)))\
+              .capitalize()
+
+SUCUPIRA_FIELDS = [
+    'AN_BASE', 'NM_GRANDE_AREA_CONHECIMENTO', 'NM_AREA_CONHECIMENTO',
+    'NM_AREA_AVALIACAO', 'CD_ENTIDADE_CAPES', 'SG_ENTIDADE_ENSINO',
+    'NM_ENTIDADE_ENSINO', 'CS_STATUS_JURIDICO', 'DS_DEPENDENCIA_ADMINISTRATIVA',
+    'NM_REGIAO', 'SG_UF_PROGRAMA', 'NM_MUNICIPIO_PROGRAMA_IES',
+    'NM_MODALIDADE_PROGRAMA', 'CD_PROGRAMA_IES', 'NM_PROGRAMA_IES',
+    'NM_GRAU_PROGRAMA', 'CD_CONCEITO_PROGRAMA', 'ID_PESSOA', 'NM_DISCENTE',
+    'NM_PAIS_NACIONALIDADE_DISCENTE', 'DS_TIPO_NACIONALIDADE_DISCENTE',
+    'TP_SEXO_DISCENTE', 'DS_FAIXA_ETARIA', 'DS_GRAU_ACADEMICO_DISCENTE',
+    'ST_INGRESSANTE', 'NM_SITUACAO_DISCENTE', 'DT_MATRICULA_DISCENTE',
+    'DT_SITUACAO_DISCENTE', 'QT_MES_TITULACAO', 'NM_TESE_DISSERTACAO',
+    'NM_ORIENTADOR', 'ID_ADD_FOTO_PROGRAMA', 'ID_ADD_FOTO_PROGRAMA_IES']
+def sucupira_fields(year):
+    '''Header of the yearly file. Files from 2018 on use the new name of
+    the advisor column (see datasets.SucupiraProgram.FIELD_UPGRADES)'''
+    if year < 2018:
+        return list(SUCUPIRA_FIELDS)
+    return [f+'_PRINCIPAL' if f == 'NM_ORIENTADOR' else f \
+            for f in SUCUPIRA_FIELDS]
+
+SITUACOES = ['MATRICULADO', 'MATRICULADO', 'TITULADO', 'DESLIGADO',
+             'ABANDONOU', 'MUDANCA DE NIVEL SEM DEFESA']
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+          'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+def suc_date(rng, year):
+    return f'{rng.randint(1, 28):02}{rng.choice(MONTHS)}{year}:00:00:00'
+
+def sucupira_rows(rng, n, year, program_codes, ids=None):
+    '''Rows (dicts over sucupira_fields(year)) of a yearly Sucupira discentes
+    file. ids is the population of ID_PESSOA values to draw from, so that
+    students reappear across years.'''
+    ids = ids if ids else range(1, n+1)
+    fields = sucupira_fields(year)
+    for i in range(n):
+        grau = rng.choice(['MESTRADO', 'DOUTORADO'])
+        d = {f: '' for f in fields}
+        d.update({
+            'AN_BASE': str(year), 'NM_GRANDE_AREA_CONHECIMENTO':
+            'CIÊNCIAS EXATAS E DA TERRA', 'NM_AREA_CONHECIMENTO':
+            'CIÊNCIA DA COMPUTAÇÃO', 'SG_UF_PROGRAMA': 'SC',
+            'CD_PROGRAMA_IES': rng.choice(program_codes),
+            'NM_PROGRAMA_IES': 'CIÊNCIA DA COMPUTAÇÃO',
+            'CD_CONCEITO_PROGRAMA': str(rng.randint(3, 7)),
+            'ID_PESSOA': str(rng.choice(ids)), 'NM_DISCENTE': person(rng),
+            'DS_GRAU_ACADEMICO_DISCENTE': grau,
+            'NM_SITUACAO_DISCENTE': rng.choice(SITUACOES),
+            'DT_MATRICULA_DISCENTE': suc_date(rng, year - rng.randint(0, 4)),
+            'DT_SITUACAO_DISCENTE': suc_date(rng, year),
+            'QT_MES_TITULACAO': str(rng.randint(12, 60)),
+            fields[SUCUPIRA_FIELDS.index('NM_ORIENTADOR')]:
+            person(rng).upper(), 'NM_TESE_DISSERTACAO': 'NA'})
+        yield d
+
+def write_sucupira(path, rows, fields):
+    '''Writes rows as a ;-separated, xz-compressed file like the ones
+    stored by datasets.SucupiraDataset'''
+    with lzma.open(path, 'wt', encoding='utf-8', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=fields, delimiter=';')
+        w.writeheader()
+        for r in rows:
+            w.writerow(r)
+
+def cpf(rng):
+    return ''.join(str(rng.randint(0, 9)) for i in range(11))
+
+def students(rng, n):
+    '''(cpf, name) pairs, as extracted from CAPG reports'''
+    return [(cpf(rng), p.upper()) for p in people(rng, n)]
+
+SOCIOS_FIELDS = ['cnpj', 'identificador_de_socio', 'nome_socio',
+                 'cnpj_cpf_do_socio', 'codigo_qualificacao_socio',
+                 'percentual_capital_social', 'data_entrada_sociedade',
+                 'cpf_representante_legal', 'nome_representante_legal',
+                 'codigo_qualificacao_representante_legal']
+
+def masked_cpf(c):
+    return '***' + c[3:9] + '**'
+
+def socios_rows(rng, n, student_pairs=(), hit_rate=0.001):
+    '''Rows of socios-brasil socio.csv with masked CPFs. About hit_rate of
+    the rows are partnerships of one of student_pairs.'''
+    for i in range(n):
+        if student_pairs and rng.random() < hit_rate:
+            c, name = rng.choice(student_pairs)
+        else:
+            c, name = cpf(rng), person(rng).upper()
+        yield {'cnpj': f'{rng.randrange(10**14):014d}',
+               'identificador_de_socio': '2', 'nome_socio': unidecode(name),
+               'cnpj_cpf_do_socio': masked_cpf(c),
+               'codigo_qualificacao_socio': '49',
+               'percentual_capital_social': '0',
+               'data_entrada_sociedade': f'{rng.randint(1990, 2019)}-0' + \
+                                         f'{rng.randint(1, 9)}-1{rng.randint(0, 9)}',
+               'cpf_representante_legal': '', 'nome_representante_legal': '',
+               'codigo_qualificacao_representante_legal': ''}
+
+CPC_HEADER = ['Prof 1 PPGCC', 'Prof 2 PPGCC', 'Prof 3 PPGCC', 'Prof 4 PPGCC',
+              'Tipo', 'SICLAP', 'Ano', 'Artigo (conforme Lattes)', 'ISSN',
+              'Sigla', 'Link (DOI)', 'Alunos M PPGCC', 'Alunos D PPGCC',
+              'Posdocs PPGCC', 'Estrangeiros', 'Candidato a Lista 4N?',
+              'Trabalho Premiado?', 'N Profs. (AUTO)', 'Pontos (AUTO)']
+
+def cpc_rows(rng, n, names):
+    '''Rows of the CPC Google Sheet, as returned by the Sheets API (lists of
+    strings, header first)'''
+    yield list(CPC_HEADER)
+    for i in range(n):
+        authors = author_list(rng, names, ',')
+        year = rng.randint(2013, 2020)
+        artigo = f'{authors} {title(rng)}. {rng.choice(VENUES)}, ' + \
+                 f'v. {rng.randint(1, 40)}, p. {rng.randint(1, 300)}, {year}.'
+        profs = [rng.choice(names).upper() for j in range(rng.randint(1, 4))]
+        yield profs + [''] * (4 - len(profs)) + [
+            rng.choice(['Periódico', 'Evento']), rng.choice(SICLAP),
+            str(year), artigo, '', '',
+            f'https://doi.org/10.{rng.randint(1000, 9999)}/x{i}', '', '', '',
+            '', '', '', str(len(profs)), '1']
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+'''Offline benchmarks of the pipeline stages over synthetic data.
+
+Usage: python -m benchmarks.run [stage ...] [--scale N] [--save NAME]
+                                [--compare NAME]
+'''
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from time import perf_counter
+from datetime import datetime
+from benchmarks import generators as gen
+from ppgcc_metrics import names, datasets, compression, query
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+PROGRAM = '41001010025P2'
+OTHER_PROGRAMS = ['41001010024P1', '42002010023P3', '33002010191P0']
+
+def bench_canon_maps(rng, scale, tmpdir):
+    base = gen.people(rng, 60 * scale)
+    a = base + gen.people(rng, 20 * scale)
+    b = [gen.variant(rng, x, first_initial=False) for x in base] + \
+        gen.people(rng, 20 * scale)
+    return (lambda: names.canon_maps(a, b)), len(a) * len(b)
+
+def bench_is_author(rng, scale, tmpdir):
+    docentes = gen.people(rng, 40)
+    pool = docentes + gen.people(rng, 200)
+    lists = []
+    for order, fmt in [(',', datasets.CPCWorks.AUTHORS_FMT),
+                       ('LAST_FIRST', datasets.ScopusWorks.AUTHORS_FMT),
+                       ('FIRST_FIRST', datasets.Scholar.AUTHORS_FMT)]:
+        lists += [(gen.author_list(rng, pool, order), fmt) \
+                  for i in range(200 * scale)]
+    def run():
+        for l, fmt in lists:
+            for d in docentes:
+                names.is_author(d, l, **fmt)
+    return run, len(lists) * len(docentes)
+
+def bench_sucupira_program(rng, scale, tmpdir):
+    y2ds, ids = dict(), range(1, 1500 * scale)
+    codes = [PROGRAM] + OTHER_PROGRAMS
+    for year in [2017, 2018]:
+        y2ds[year] = datasets.SucupiraDataset(f'suc-dis-{year}.csv.xz', None,
+                                              directory=tmpdir)
+        gen.write_sucupira(os.path.join(tmpdir, y2ds[year].filename),
+                           gen.sucupira_rows(rng, 1000 * scale, year, codes,
+                                             ids=ids),
+                           gen.sucupira_fields(year))
+    prgm = datasets.SucupiraProgram('suc-dis-ppgcc.csv', PROGRAM[:-2], y2ds,
+                                    directory=tmpdir)
+    def run():
+        path = os.path.join(tmpdir, prgm.filename)
+        if os.path.isfile(path):
+            os.remove(path)
+        prgm.download(directory=tmpdir)
+    return run, 2000 * scale
+
+def bench_capg_cnpj(rng, scale, tmpdir):
+    students = gen.students(rng, 150)
+    rows = list(gen.socios_rows(rng, 10000 * scale, students))
+    capg = datasets.DiscentesCAPGCNPJ('capg-cnpj.csv', 'capg_pdfs',
+                                      datasets.SOCIOS_BRASIL, directory=tmpdir)
+    def run():
+        for r in rows:
+            capg._match_student(r, students)
+    return run, len(rows)
+
+def bench_cpc_authors(rng, scale, tmpdir):
+    rows = list(gen.cpc_rows(rng, 1000 * scale, gen.people(rng, 300)))
+    idx = rows[0].index('Artigo (conforme Lattes)')
+    def run():
+        for r in rows[1:]:
+            datasets.CPC_CSV.get_authors(r[idx])
+    return run, len(rows) - 1
+
+def _bench_open(codec, threads, columns=None):
+    '''Reads a Sucupira file stored with codec to its last row, with
+    open_csv() or, if columns is given, scan(columns)'''
+    def bench(rng, scale, tmpdir):
+        rows = list(gen.sucupira_rows(rng, 20000 * scale, 2017,
+                                      [PROGRAM] + OTHER_PROGRAMS))
+        gen.write_sucupira(os.path.join(tmpdir, 'source.csv.xz'), rows,
+                           gen.sucupira_fields(2017))
+        ds = datasets.SucupiraDataset(f'suc.csv.{codec}', None,
+                                      directory=tmpdir)
+        compression.recompress(os.path.join(tmpdir, 'source.csv.xz'),
+                               os.path.join(tmpdir, ds.filename), codec,
+                               threads=0)
+        def run():
+            previous, compression.THREADS = compression.THREADS, threads
+            try:
+                with ds.open_csv() if columns == None else \
+                     ds.scan(columns) as reader:
+                    for row in reader:
+                        pass
+            finally:
+                compression.THREADS = previous
+        return run, len(rows)
+    return bench
+
+def bench_query(rng, scale, tmpdir):
+    '''Students per year of one program, with a pushed-down Dataset.query()'''
+    rows = list(gen.sucupira_rows(rng, 20000 * scale, 2017,
+                                  [PROGRAM] + OTHER_PROGRAMS))
+    gen.write_sucupira(os.path.join(tmpdir, 'source.csv.xz'), rows,
+                       gen.sucupira_fields(2017))
+    ds = datasets.SucupiraDataset('suc.csv', None, directory=tmpdir)
+    compression.recompress(os.path.join(tmpdir, 'source.csv.xz'),
+                           os.path.join(tmpdir, ds.filename), 'plain')
+    q = ds.query().where(CD_PROGRAMA_IES=PROGRAM) \
+          .group_by('AN_BASE', alunos=query.CountDistinct('NM_DISCENTE'))
+    def run():
+        q.to_list()
+    return run, len(rows)
+
+STAGES = {
+    'canon_maps': bench_canon_maps,
+    'is_author': bench_is_author,
+    'sucupira_program': bench_sucupira_program,
+    'capg_cnpj': bench_capg_cnpj,
+    'cpc_authors': bench_cpc_authors,
+    'open_xz': _bench_open('xz', 1),
+    'open_xz_mt': _bench_open('xz', 0),
+    'open_gz': _bench_open('gz', 1),
+    'open_gz_mt': _bench_open('gz', 0),
+    'open_plain': _bench_open('plain', 1),
+    'scan_plain': _bench_open('plain', 1, ['AN_BASE', 'NM_DISCENTE']),
+    'query_plain': bench_query,
+}
+
+def measure(stage, scale, seed, repeat, memory):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run, items = STAGES[stage](random.Random(seed), scale, tmpdir)
+        times = []
+        for i in range(repeat):
+            start = perf_counter()
+            run()
+            times.append(perf_counter() - start)
+        peak = None
+        if memory:
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return {'items': items, 'seconds': min(times), 'peak_bytes': peak}
+
+def load_baseline(name):
+    with open(os.path.join(BASELINES_DIR, name + '.json')) as f:
+        return json.load(f)
+
+def save_baseline(name, report):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    with open(os.path.join(BASELINES_DIR, name + '.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+def print_table(results, baseline=None):
+    print(f'{"stage":20} {"items":>10} {"seconds":>10} {"items/s":>12} ' +
+          f'{"peak MiB":>9}' + (f' {"vs base":>8}' if baseline else ''))
+    for stage, r in results.items():
+        peak = '-' if r['peak_bytes'] == None else \
+               f'{r["peak_bytes"] / 2**20:.1f}'
+        line = f'{stage:20} {r["items"]:10} {r["seconds"]:10.3f} ' + \
+               f'{r["items"] / r["seconds"]:12.0f} {peak:>9}'
+        if baseline:
+            b = baseline['results'].get(stage)
+            line += f' {r["seconds"] / b["seconds"]:7.2f}x' if b else '        -'
+        print(line)
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Benchmark ppgcc_metrics ' +
+                                'pipeline stages on synthetic data')
+    p.add_argument('stages', nargs='*', choices=[[]] + sorted(STAGES),
+                   help='Stages to run (default: all)')
+    p.add_argument('--scale', type=int, default=1,
+                   help='Multiplies the size of generated data')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--repeat', type=int, default=3,
+                   help='Timed runs per stage, the best one is reported')
+    p.add_argument('--no-memory', action='store_true',
+                   help='Skip the extra run that measures peak memory')
+    p.add_argument('--save', metavar='NAME',
+                   help=f'Save results as a baseline in {BASELINES_DIR}')
+    p.add_argument('--compare', metavar='NAME',
+                   help='Compare timings against a saved baseline')
+    p.add_argument('--threshold', type=float, default=1.5,
+                   help='Exit with status 1 if any stage is this many ' +
+                        'times slower than the --compare baseline')
+    args = p.parse_args(argv)
+    baseline = load_baseline(args.compare) if args.compare else None
+    results = dict()
+    for stage in args.stages if args.stages else list(STAGES):
+        results[stage] = measure(stage, args.scale, args.seed, args.repeat,
+                                 not args.no_memory)
+    print_table(results, baseline)
+    if args.save:
+        save_baseline(args.save, {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'scale': args.scale,
+            'seed': args.seed, 'results': results})
+    if baseline:
+        slow = [s for s, r in results.items() if s in baseline['results'] \
+                and r['seconds'] > args.threshold * \
+                    baseline['results'][s]['seconds']]
+        if slow:
+            print(f'Slower than {args.threshold}x the baseline: ' +
+                  ', '.join(slow))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
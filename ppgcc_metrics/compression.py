@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+'''Codecs for compressed datasets and a pipelined compressing writer.
+
+Compressed files are read according to their content (magic bytes), not
+their name, so that a dataset can be stored with a faster codec than its
+file extension suggests. Setting THREADS (or the threads argument) to 0
+(one per core) or more than 1 opts into (de)compressing xz and gzip files
+with the xz or pigz tools, when installed, in a separate process with that
+many threads. The default, 1, keeps everything in-process, so results do not
+depend on what is on PATH. xz files are written in blocks of XZ_BLOCK_SIZE
+bytes, in-process as well as by xz -T, so that they can be decompressed in
+parallel once threads are enabled (run.py --compress-threads 0); pigz
+parallelizes compression only, but still decompresses off the reading
+process. Plain files are read through mmap.
+'''
+import io
+import os
+import zlib
+import gzip
+import lzma
+import mmap
+import queue
+import signal
+import shutil
+import tempfile
+import threading
+import subprocess
+
+CODECS = ['xz', 'gz', 'plain']
+DEFAULT_LEVELS = {'xz': 6, 'gz': 6, 'plain': None}
+_MAGIC = [(b'\xfd7zXZ\x00', 'xz'), (b'\x1f\x8b', 'gz')]
+_EXTENSIONS = {'.xz': 'xz', '.gz': 'gz'}
+EXTENSION = {'xz': '.xz', 'gz': '.gz', 'plain': ''}
+THREADS = 1
+TOOLS = {'xz': 'xz', 'gz': 'pigz'}
+XZ_BLOCK_SIZE = 1 << 24 # uncompressed bytes per block written in-process
+
+def codec_for_name(filepath):
+    '''Codec suggested by the file extension'''
+    for ext, codec in _EXTENSIONS.items():
+        if filepath.endswith(ext):
+            return codec
+    return 'plain'
+
+def sniff(filepath):
+    '''Codec of an existing file, from its first bytes'''
+    with open(filepath, 'rb') as f:
+        head = f.read(6)
+    for magic, codec in _MAGIC:
+        if head.startswith(magic):
+            return codec
+    return 'plain'
+
+def _tool(codec, threads):
+    threads = THREADS if threads == None else threads
+    if threads == 1 or codec not in TOOLS:
+        return None
+    path = shutil.which(TOOLS[codec])
+    if path == None:
+        return None
+    if codec == 'xz':
+        return [path, f'-T{threads}']
+    return [path, f'-p{threads or os.cpu_count()}']
+
+# return codes of processes killed by close() before EOF or by Ctrl+C
+# (which the parent process handles as KeyboardInterrupt)
+_IGNORED_RC = {-signal.SIGKILL, -signal.SIGINT, -signal.SIGPIPE}
+
+class _ProcessFile(io.RawIOBase):
+    '''Raw file over the stdin or stdout pipe of a (de)compressor process.
+    close() waits for the process and raises OSError if it failed'''
+    def __init__(self, argv, filepath, writing):
+        super().__init__()
+        self.writing = writing
+        self.file = open(filepath, 'wb' if writing else 'rb')
+        # a file, not a pipe: the tool never blocks on a full stderr pipe
+        self.err = tempfile.TemporaryFile()
+        try:
+            self.proc = subprocess.Popen(
+                argv, stdin=subprocess.PIPE if writing else self.file,
+                stdout=self.file if writing else subprocess.PIPE,
+                stderr=self.err)
+        except BaseException:
+            self.file.close()
+            self.err.close()
+            raise
+        self.pipe = self.proc.stdin if writing else self.proc.stdout
+        self.argv = argv
+
+    def readable(self):
+        return not self.writing
+
+    def writable(self):
+        return self.writing
+
+    def readinto(self, b):
+        return self.pipe.readinto(b)
+
+    def write(self, b):
+        self.pipe.write(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if not self.writing and self.proc.poll() == None:
+                self.proc.kill() # closed before EOF
+            self.pipe.close()
+            rc = self.proc.wait()
+            if rc != 0 and rc not in _IGNORED_RC:
+                self.err.seek(0)
+                err = self.err.read(1 << 16)
+                raise OSError(f'{" ".join(self.argv)} exited with {rc}: ' + \
+                              err.decode(errors='replace').strip())
+        finally:
+            self.file.close()
+            self.err.close()
+            super().close()
+
+def _vli(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def _crc32(data):
+    return zlib.crc32(data).to_bytes(4, 'little')
+
+def _pad4(n):
+    return b'\0' * (-n % 4)
+
+class _XZBlockWriter(io.RawIOBase):
+    '''Writes an .xz file with one LZMA2 block (and a CRC32 check) every
+    XZ_BLOCK_SIZE bytes. Unlike lzma.open(), which writes a single block
+    without sizes in its header, the blocks can be decompressed in parallel
+    (xz -T, THREADS)'''
+    _FLAGS = b'\0\x01' # CRC32 check
+
+    def __init__(self, filepath, level, block_size=None):
+        super().__init__()
+        self.filters = [{'id': lzma.FILTER_LZMA2, 'preset': level}]
+        self.props = lzma._encode_filter_properties(self.filters[0])
+        self.block_size = block_size or XZ_BLOCK_SIZE
+        self.buf = bytearray()
+        self.index = [] # (unpadded size, uncompressed size) of each block
+        self.file = open(filepath, 'wb')
+        self.file.write(b'\xfd7zXZ\0' + self._FLAGS + _crc32(self._FLAGS))
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buf += b
+        while len(self.buf) >= self.block_size:
+            self._block(self.buf[:self.block_size])
+            del self.buf[:self.block_size]
+        return len(b)
+
+    def _block(self, data):
+        raw = lzma.compress(data, lzma.FORMAT_RAW, filters=self.filters)
+        header = b'\xc0' + _vli(len(raw)) + _vli(len(data)) + \
+                 b'\x21\x01' + self.props # LZMA2 and its properties
+        header = bytes([(len(header) + 1 + 4 + 3) // 4 - 1]) + header
+        header += _pad4(len(header) + 4)
+        header += _crc32(header)
+        self.file.write(header + raw + _pad4(len(raw)) + _crc32(data))
+        self.index.append((len(header) + len(raw) + 4, len(data)))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buf:
+                self._block(bytes(self.buf))
+            index = b'\0' + _vli(len(self.index)) + \
+                    b''.join(_vli(u) + _vli(n) for u, n in self.index)
+            index += _pad4(len(index))
+            index += _crc32(index)
+            footer = (len(index) // 4 - 1).to_bytes(4, 'little') + self._FLAGS
+            self.file.write(index + _crc32(footer) + footer + b'YZ')
+        finally:
+            self.file.close()
+            super().close()
+
+class _MmapFile(io.RawIOBase):
+    def __init__(self, filepath):
+        super().__init__()
+        with open(filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                      if size else None
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.mm == None:
+            return 0
+        n = min(len(b), len(self.mm) - self.pos)
+        b[:n] = self.mm[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed and self.mm != None:
+            self.mm.close()
+        super().close()
+
+def open_mmap(filepath):
+    '''Read-only mmap of a plain file, or None if it is compressed or
+    empty'''
+    if sniff(filepath) != 'plain' or os.path.getsize(filepath) == 0:
+        return None
+    with open(filepath, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def open_binary(filepath, mode='rb', codec=None, level=None, threads=None):
+    '''Opens filepath with the given codec. When reading, codec defaults to
+    the sniffed one; when writing, to the one of the file extension. level is
+    the xz preset or the gzip compresslevel. threads overrides THREADS'''
+    mode = mode if 'b' in mode else mode + 'b'
+    if codec == None:
+        codec = sniff(filepath) if 'r' in mode else codec_for_name(filepath)
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec {codec}. Expected one of {CODECS}')
+    level = DEFAULT_LEVELS[codec] if level == None else level
+    writing = 'r' not in mode
+    tool = _tool(codec, threads) if mode in ['rb', 'wb'] else None
+    if tool:
+        argv = tool + ([f'-{level}', '-c'] if writing else ['-d', '-c'])
+        f = _ProcessFile(argv, filepath, writing)
+        return io.BufferedWriter(f) if writing else io.BufferedReader(f)
+    if codec == 'xz':
+        if mode == 'wb':
+            return io.BufferedWriter(_XZBlockWriter(filepath, level), 1 << 20)
+        return lzma.open(filepath, mode, preset=level if writing else None)
+    elif codec == 'gz':
+        return gzip.open(filepath, mode, compresslevel=level) if writing \
+               else gzip.open(filepath, mode)
+    if mode == 'rb':
+        return io.BufferedReader(_MmapFile(filepath), 1 << 16)
+    return open(filepath, mode)
+
+def recompress(src, dst, codec, level=None, threads=None):
+    '''Writes the decompressed contents of src into dst using codec'''
+    if os.path.abspath(src) == os.path.abspath(dst):
+        raise ValueError(f'Cannot recompress {src} into itself')
+    with open_binary(src, 'rb', threads=threads) as i, \
+         open_binary(dst, 'wb', codec, level, threads) as o:
+        shutil.copyfileobj(i, o, 1 << 20)
+    return dst
+
+def open_text(filepath, mode='r', codec=None, level=None, threads=None,
+              encoding='utf-8', newline=None):
+    mode = mode.replace('t', '').replace('b', '')
+    return io.TextIOWrapper(open_binary(filepath, mode, codec, level, threads),
+                            encoding=encoding, newline=newline)
+
+class PipelinedWriter:
+    '''Writes chunks to fp from a worker thread, so that producing chunks
+    (e.g., reading the network) overlaps with transform(chunk) and with
+    compression (lzma and zlib release the GIL). transform must return
+    bytes. Errors in the worker are raised by write() or close().'''
+    _END = object()
+
+    def __init__(self, fp, transform=None, maxsize=16):
+        self.fp = fp
+        self.transform = transform
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.worker = threading.Thread(target=self._work, daemon=True,
+                                       name='ppgcc-pipelined-writer')
+        self.worker.start()
+
+    def _work(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is self._END:
+                return
+            if self.error != None:
+                continue # drain, so that write() does not block
+            try:
+                data = self.transform(chunk) if self.transform else chunk
+                if data:
+                    self.fp.write(data)
+            except BaseException as e:
+                self.error = e
+
+    def _check(self):
+        if self.error != None:
+            raise self.error
+
+    def write(self, chunk):
+        self._check()
+        self.queue.put(chunk)
+
+    def close(self):
+        if self.worker.is_alive():
+            self.queue.put(self._END)
+            self.worker.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,26 +1,31 @@
 # -*- coding: utf-8 -*-
 import requests
 import requests_html
+import asyncio
+import threading
 import os.path
 import os
 import errno
-import lzma
-import gzip
 import re
+import io
 import csv
 import json
+import hashlib
+import sqlite3
 import gdown
 import textract
-import googleapiclient.discovery
 import pyperclip
 from tqdm import tqdm
 from datetime import datetime, date
 from random import randint
 from itertools import chain, product
-from ppgcc_metrics import names
+from ppgcc_metrics import names, instrument, extsort, records, compression
+from ppgcc_metrics import mmapcsv, google_api, query
 from time import sleep
 from contextlib import contextmanager
-from google.oauth2 import service_account
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from urllib.parse import urlparse
 from unidecode import unidecode
 
 SERVICE_ACCOUNT_FILE = 'service-account-key.json'
@@ -34,15 +39,33 @@ def simplify_title(title):
     title = _SIMPLIFY_TITLE_RX   .sub(' ', title)
     return  _DEDUP_SPACES_RX     .sub(' ', title)
 
+HTTP_POOL_SIZE = 16
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def http_session():
+    '''requests.Session shared by all downloads, so that connections to
+    the same host are pooled and reused across datasets and threads'''
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION == None:
+            _SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            _SESSION.mount('http://', adapter)
+            _SESSION.mount('https://', adapter)
+        return _SESSION
+
 def download_url(url, to):
     if re.match(r'^https?://drive.google.com', url):
         gdown.download(url, to, False)
         return to
-    r = requests.get(url, stream=True)
+    r = http_session().get(url, stream=True)
     t_bytes = r.headers.get('content-length')
     if not t_bytes:
         m = re.search(r'/(\d+)', r.headers.get('content-range'))
-        t_bytes = int(m.group(1))
+        t_bytes = m.group(1)
+    t_bytes = int(t_bytes)
     name = to.split(os.sep)[-1]
     with open(to+'.tmp', 'wb') as out, \
          tqdm(total=t_bytes, unit='B', unit_scale=True, desc=name) as pbar:
@@ -55,19 +78,145 @@ def download_url(url, to):
 def _tol_getidx(a_list, idx, fallback=None):
     return a_list[idx] if len(a_list) >= idx + 1 else fallback
 
+class ParseCache:
+    '''Persistent map from keys to (version, value) pairs stored as JSON.
+
+    get() only returns a value if it was put() with the same version. On
+    save(), keys not touched since load are dropped, so the cache does not
+    outlive the data it was computed from.
+    '''
+    MISSING = object()
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.entries = dict()
+        self.touched = set()
+        self.dirty = False
+        if os.path.isfile(filepath):
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = dict()
+
+    def get(self, key, version=None):
+        e = self.entries.get(key)
+        if e == None or e[0] != version:
+            return self.MISSING
+        self.touched.add(key)
+        return e[1]
+
+    def put(self, key, version, value):
+        self.entries[key] = [version, value]
+        self.touched.add(key)
+        self.dirty = True
+
+    def save(self):
+        stale = [k for k in self.entries if k not in self.touched]
+        for k in stale:
+            del self.entries[k]
+        if not self.dirty and not stale:
+            return
+        with open(self.filepath+'.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(self.filepath+'.tmp', self.filepath)
+        self.dirty = False
+
+def content_key(*parts):
+    '''Hash of JSON-serializable parts, for use as a ParseCache key'''
+    data = json.dumps(parts, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+SQLITE_FILE = 'datasets.sqlite'
+SQL_INDEXES = ['ID_PESSOA', 'cnpj', 'CNPJ', 'year', 'Ano', 'AN_BASE',
+               'pub_year', 'base_year']
+SQL_YEAR_COLUMNS = ['year', 'Ano', 'AN_BASE', 'pub_year', 'base_year']
+SQL_NAME_COLUMNS = ['NM_DISCENTE', 'NM_ORIENTADOR_PRINCIPAL', 'NM_DOCENTE',
+                    'docente', 'discente', 'orientador', 'coorientador',
+                    'nome_socio']
+SQL_CLEAN_SUFFIX = '_CLEAN'
+
+def _sql_id(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _sqlite_connect(db):
+    conn = sqlite3.connect(db)
+    conn.execute('CREATE TABLE IF NOT EXISTS _datasets ' + \
+                 '(tbl TEXT PRIMARY KEY, version TEXT)')
+    return conn
+
+def sqlite_query(query, params=(), db=None, directory='data'):
+    '''Runs query against the SQLite database where datasets are
+    materialized (see Dataset.to_sqlite) and yields result rows as dicts'''
+    conn = _sqlite_connect(db if db else os.path.join(directory, SQLITE_FILE))
+    conn.row_factory = sqlite3.Row
+    try:
+        for row in conn.execute(query, params):
+            yield dict(row)
+    finally:
+        conn.close()
+
 class Dataset:
+    RECORD = None
+    HOST = None
+    WATCH_REFETCH = False # runner.Watcher re-fetches it if upstreams change
+
     def __init__(self, name, url, directory='data', non_trivial=False,
-                 csv_delim=',', encoding='utf-8'):
+                 csv_delim=',', encoding='utf-8', sql_indexes=None):
         self.filename = name
         self.url = url
         self.directory = directory
         self.csv_delim = csv_delim
         self.encoding = encoding
         self.non_trivial = non_trivial
+        self.sql_indexes = SQL_INDEXES if sql_indexes == None else sql_indexes
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'download' in cls.__dict__:
+            cls.download = instrument.timed_download(cls.download)
 
     def __str__(self):
         return self.filename
 
+    def upstreams(self):
+        '''Datasets read by this one: attributes holding a Dataset or a
+        dict, list, tuple or set of them'''
+        result = []
+        for v in vars(self).values():
+            if isinstance(v, Dataset):
+                v = [v]
+            elif isinstance(v, dict):
+                v = v.values()
+            elif not isinstance(v, (list, tuple, set)):
+                continue
+            for x in v:
+                if isinstance(x, Dataset) and all(x is not y for y in result):
+                    result.append(x)
+        return result
+
+    def host(self):
+        '''Network host contacted by download(): HOST or the host of url.
+        None for local datasets'''
+        if self.HOST != None:
+            return self.HOST
+        if isinstance(self.url, str) and '://' in self.url:
+            return urlparse(self.url).netloc
+        return None
+
+    def inputs(self, directory=None, **kwargs):
+        '''Local files edited by hand that download() reads. Watch mode
+        (runner.Watcher) rebuilds this dataset and its downstreams when they
+        change'''
+        return []
+
+    async def download_async(self, downloader=None, **kwargs):
+        '''Awaitable download(): downloads upstreams first, then calls
+        download(**kwargs) in an executor. Pass the same AsyncDownloader to
+        calls that should share upstream downloads and per-host limits'''
+        downloader = AsyncDownloader() if downloader == None else downloader
+        return await downloader.download(self, **kwargs)
+
     def _get_filepath(self, directory=None, create_dir=True, **kwargs):
         directory = self.directory if directory == None else directory
         if not os.path.isdir(directory):
@@ -78,6 +227,7 @@ class Dataset:
         directory = kwargs.get('directory', self.directory)
         return os.path.isfile(os.path.join(directory, self.filename))
      
+    @instrument.timed_download
     def download(self, directory=None, force=False, **kwargs):
         filepath = self._get_filepath(directory=directory)
         if force or not os.path.isfile(filepath):
@@ -95,39 +245,159 @@ class Dataset:
         if 'newline' in kwargs:
             del kwargs['newline']
         f = self.open(newline='', **kwargs)
-        r = csv.DictReader(f, delimiter=self.csv_delim)
+        r = instrument.CountingDictReader(f, delimiter=self.csv_delim)
+        try:
+            yield r
+        finally:
+            instrument.add(f'open_csv:{self}', calls=1, rows_in=r.rows,
+                           bytes_in=instrument.position(f))
+            f.close()
+
+    @contextmanager
+    def open_records(self, record_type=None, **kwargs):
+        '''Like open_csv(), but yields a records.RecordReader. record_type
+        defaults to self.RECORD or, if None, a type made from the header'''
+        if 'newline' in kwargs:
+            del kwargs['newline']
+        record_type = self.RECORD if record_type == None else record_type
+        f = self.open(newline='', **kwargs)
+        r = records.RecordReader(f, record_type, delimiter=self.csv_delim)
         try:
             yield r
         finally:
+            instrument.add(f'open_records:{self}', calls=1, rows_in=r.rows,
+                           bytes_in=instrument.position(f))
             f.close()
 
+    @contextmanager
+    def scan(self, columns=None, where=None, **kwargs):
+        '''Like open_csv(), but yields a mmapcsv.Scanner over a memory map
+        of the file, which decodes only the accessed fields. If columns is
+        given, rows are tuples of these columns. where filters rows inside
+        the scanner (see mmapcsv.Scanner). Compressed files are read
+        through open()'''
+        kwargs.pop('newline', None)
+        encoding = kwargs.get('encoding', self.encoding)
+        mm = compression.open_mmap(self.download(**kwargs))
+        f = self.open(newline='', **kwargs) if mm == None else None
+        try:
+            s = mmapcsv.Scanner(mm if f == None else f, self.csv_delim,
+                                encoding, columns, where)
+        except BaseException:
+            (mm if f == None else f).close()
+            raise
+        try:
+            yield s
+        finally:
+            size = s.pos if f == None else instrument.position(f)
+            instrument.add(f'scan:{self}', calls=1, rows_in=s.rows,
+                           bytes_in=min(size, len(mm)) if mm else size)
+            s.close()
+
+    def query(self, **kwargs):
+        '''Lazy query.Query over the rows of this dataset, read through
+        scan(**kwargs)'''
+        return query.Query(self, **kwargs)
+
     def _open(self, filepath, mode, **kwargs):
         return open(filepath, mode, **kwargs)
 
     @contextmanager
-    def replace_csv(self, **kwargs):
+    def replace_csv(self, fieldnames=None, **kwargs):
+        '''Yields a DictWriter whose rows replace the file contents on exit.
+        fieldnames defaults to the header of the current file'''
         if 'newline' in kwargs:
             del kwargs['newline']
-        fields = []
-        with self.open_csv(**kwargs) as r:
-            fields = r.fieldnames
+        fields = fieldnames
+        if fields == None:
+            with self.open_csv(**kwargs) as r:
+                fields = r.fieldnames
         directory = kwargs.get('directory')
         directory = self.directory if directory == None else directory
         filepath = os.path.join(directory, self.filename+'.tmp')
         f = self._open(filepath, 'w', newline='')
-        w = csv.DictWriter(f, fieldnames=fields, delimiter=self.csv_delim)
+        w = instrument.CountingDictWriter(f, fieldnames=fields,
+                                          delimiter=self.csv_delim)
         try:
             w.writeheader()
             yield w
         finally:
+            instrument.add(f'replace_csv:{self}', calls=1, rows_out=w.rows,
+                           bytes_out=instrument.position(f))
             f.close()
             os.replace(filepath, self._get_filepath(**kwargs))
+
+    def sql_table(self):
+        return re.sub(r'\W', '_', self.filename)
+
+    def to_sqlite(self, db=None, force=False, **kwargs):
+        '''Materializes this dataset as a table in a SQLite database and
+        returns the table name. The table is rebuilt only if the dataset
+        file changed since the last materialization (or if force=True).
+
+        Columns listed in sql_indexes get an index. Name columns (see
+        SQL_NAME_COLUMNS) get an extra indexed column with the
+        SQL_CLEAN_SUFFIX suffix holding names.clean_name() of the value.
+        Columns in SQL_YEAR_COLUMNS are stored as integers.
+        '''
+        directory = kwargs.get('directory')
+        directory = self.directory if directory == None else directory
+        db = db if db else os.path.join(directory, SQLITE_FILE)
+        src = self.download(**kwargs)
+        st = os.stat(src)
+        version = f'{st.st_mtime_ns}:{st.st_size}'
+        table = self.sql_table()
+        conn = _sqlite_connect(db)
+        try:
+            old = conn.execute('SELECT version FROM _datasets WHERE tbl=?',
+                               (table,)).fetchone()
+            if not force and old != None and old[0] == version:
+                return table
+            with self.open_csv(**kwargs) as reader:
+                fields = list(reader.fieldnames)
+                name_fs = [f for f in fields if f in SQL_NAME_COLUMNS]
+                cols = fields + [f+SQL_CLEAN_SUFFIX for f in name_fs]
+                decl = lambda c: _sql_id(c) + \
+                                 (' INTEGER' if c in SQL_YEAR_COLUMNS else '')
+                conn.execute(f'DROP TABLE IF EXISTS {_sql_id(table)}')
+                conn.execute(f'CREATE TABLE {_sql_id(table)} ' + \
+                             f'({", ".join(map(decl, cols))})')
+                insert = f'INSERT INTO {_sql_id(table)} VALUES ' + \
+                         f'({", ".join("?" for c in cols)})'
+                conn.executemany(insert, (
+                    [r[f] for f in fields] + \
+                    [names.clean_name(r[f]) for f in name_fs] \
+                    for r in reader))
+            for c in [c for c in cols if c in self.sql_indexes or \
+                      c.endswith(SQL_CLEAN_SUFFIX)]:
+                conn.execute(f'CREATE INDEX {_sql_id(table+"__"+c)} ' + \
+                             f'ON {_sql_id(table)} ({_sql_id(c)})')
+            conn.execute('INSERT OR REPLACE INTO _datasets VALUES (?, ?)',
+                         (table, version))
+            conn.commit()
+        finally:
+            conn.close()
+        return table
+
+    def sql(self, query, params=(), db=None, **kwargs):
+        '''Materializes this dataset into SQLite (see to_sqlite()) and yields
+        the rows of query as dicts. {table} in query is replaced by the
+        (quoted) table name of this dataset.'''
+        table = self.to_sqlite(db=db, **kwargs)
+        directory = kwargs.get('directory')
+        directory = self.directory if directory == None else directory
+        return sqlite_query(query.replace('{table}', _sql_id(table)), params,
+                            db=db, directory=directory)
         
 
 class InputDataset(Dataset):
     def __init__(self, filename, **kwargs):
         super().__init__(filename, None, **kwargs)
 
+    def inputs(self, directory=None, **kwargs):
+        directory = self.directory if directory == None else directory
+        return [os.path.join(directory, self.filename)]
+
     def download(self, directory=None, **kwargs):
         filepath = self._get_filepath(directory=directory)
         if not os.path.isfile(filepath):
@@ -135,23 +405,104 @@ class InputDataset(Dataset):
         return filepath
         
     
+SUC_DOWNLOAD_JOBS = 4
+
+def download_concurrently(dss, jobs=SUC_DOWNLOAD_JOBS, **kwargs):
+    '''Calls download(**kwargs) of the given datasets from up to jobs
+    threads. Returns their file paths'''
+    dss = list(dss)
+    if jobs <= 1 or len(dss) <= 1:
+        return [d.download(**kwargs) for d in dss]
+    with ThreadPoolExecutor(max_workers=min(jobs, len(dss))) as executor:
+        return list(executor.map(lambda d: d.download(**kwargs), dss))
+
+HOST_LIMIT = 2
+
+class AsyncDownloader:
+    '''Downloads datasets from an asyncio event loop. Each dataset is
+    downloaded once, after its upstreams. The blocking download() methods
+    (requests, Google API clients, gdown) run in executor (the loop default
+    if None), with at most host_limit of them contacting the same host at
+    once. HTTP downloads share the connections of http_session().'''
+    def __init__(self, executor=None, host_limit=HOST_LIMIT):
+        self.executor = executor
+        self.host_limit = host_limit
+        self.tasks = dict()
+        self.semaphores = dict()
+
+    def download(self, ds, **kwargs):
+        '''Future for the path of ds. force only applies to ds, not to its
+        upstreams'''
+        if id(ds) not in self.tasks:
+            self.tasks[id(ds)] = asyncio.ensure_future(
+                self._download(ds, **kwargs))
+        return self.tasks[id(ds)]
+
+    async def download_all(self, dss, **kwargs):
+        return await asyncio.gather(*[self.download(d, **kwargs) \
+                                      for d in dss])
+
+    async def _download(self, ds, force=False, **kwargs):
+        await asyncio.gather(*[self.download(u, **kwargs) \
+                               for u in ds.upstreams()])
+        loop = asyncio.get_running_loop()
+        call = partial(ds.download, force=force, **kwargs)
+        host = ds.host()
+        if host == None:
+            return await loop.run_in_executor(self.executor, call)
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.host_limit)
+        async with self.semaphores[host]:
+            return await loop.run_in_executor(self.executor, call)
+
 class SucupiraDataset(Dataset):
-    def __init__(self, name, url, **kwargs):
-        super().__init__(name, url, csv_delim=';', **kwargs)
+    NA_RX = re.compile(r'[^\S\r\n]*N[AÃ]O +SE +APLICA[^\S\r\n]*;')
+    CHUNK_SIZE = 1 << 20
 
-    def download(self, directory=None, force=False, **kwargs):
+    def __init__(self, name, url, codec=None, level=None, **kwargs):
+        '''codec and level (see compression.open_binary()) are used when
+        storing the file. The default is the codec of the file extension'''
+        super().__init__(name, url, csv_delim=';', **kwargs)
+        self.codec = codec
+        self.level = level
+
+    def _cleaner(self):
+        '''Chunk transform for PipelinedWriter: decodes ISO-8859-1, writes
+        CRLF line breaks and replaces NAO SE APLICA with NA. Feed None after
+        the last chunk'''
+        residue = ''
+        def clean(chunk):
+            nonlocal residue
+            text = residue
+            if chunk == None:
+                residue = ''
+            else:
+                text += chunk.decode('iso-8859-1')
+                cut = text.rfind('\n') + 1
+                text, residue = text[:cut], text[cut:]
+            lines = text.splitlines()
+            if not lines:
+                return b''
+            text = self.NA_RX.sub('NA;', '\r\n'.join(lines) + '\r\n')
+            return text.encode('utf-8')
+        return clean
+
+    def download(self, directory=None, force=False, codec=None, level=None,
+                 **kwargs):
         filepath = self._get_filepath(directory=directory)
         if not force and os.path.isfile(filepath):
             return filepath
+        codec = self._codec() if codec == None else codec
+        level = self.level if level == None else level
         print(f'Downloading {self.url}')
-        r = requests.get(self.url, stream=True)
-        r.encoding = 'iso-8859-1'
-        with lzma.open(filepath+'.tmp', 'wt',
-                       encoding='utf-8', newline='\r\n') as xz:
-            na_rx = re.compile('\s*N[AÃ]O +SE +APLICA\s*;')
-            for line in r.iter_lines(decode_unicode=True):
-                line = na_rx.sub('NA;', line)
-                xz.write(line + '\n')
+        with http_session().get(self.url, stream=True) as r:
+            r.raise_for_status()
+            with compression.open_binary(filepath+'.tmp', 'wb',
+                                         codec, level) as out, \
+                 compression.PipelinedWriter(out, self._cleaner()) as writer:
+                for chunk in r.iter_content(self.CHUNK_SIZE):
+                    writer.write(chunk)
+                writer.write(None)
         os.replace(filepath+'.tmp', filepath)
         print(f'Downloaded {self.url} into {filepath}')
         return filepath
@@ -161,30 +512,41 @@ class SucupiraDataset(Dataset):
 
     def _open(self, filepath, mode, **kwargs):
         newline = kwargs['newline'] if 'newline' in kwargs else None
-        return lzma.open(filepath, mode+'t',
-                         newline=newline, encoding='utf-8')
+        if 'r' in mode:
+            return compression.open_text(filepath, mode, newline=newline)
+        return compression.open_text(filepath, mode, self._codec(), self.level,
+                                     newline=newline)
 
-RX_SUC_DATE = re.compile(r'^(?i)\s*(\d?\d)[. -]?([a-z]+)[- .]?(\d+)(\D|$)')
+    def _codec(self):
+        return compression.codec_for_name(self.filename) \
+               if self.codec == None else self.codec
+
+RX_SUC_DATE = re.compile(r'(?i)^\s*(\d?\d)[. -]?([a-z]+)[- .]?(\d+)(\D|$)')
 SUC_MONTHS_PT = ['', 'JAN', 'FEV', 'MAR', 'ABR', 'MAI', 'JUN',
                      'JUL', 'AGO', 'SET', 'OUT', 'NOV', 'DEZ']
 SUC_MONTHS_EN = ['', 'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
                      'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+_SUC_MONTHS = {m: i for months in [SUC_MONTHS_EN, SUC_MONTHS_PT] \
+                    for i, m in enumerate(months) if m}
+
+@lru_cache(maxsize=1<<14)
 def suc_date2date(suc_date):
+    '''Parses dates such as 24JAN2017, 01-DEZ-18 or 24JAN2017:00:00:00 into a
+    date. Returns suc_date itself if it cannot be parsed. Results are
+    memoized: a dataset holds few distinct dates'''
     try:
         m = RX_SUC_DATE.search(suc_date)
         if m != None:
             year = int(m.group(3) if len(m.group(3)) == 4 else '20'+m.group(3))
             month = m.group(2).upper().strip()[:3]
-            if month in SUC_MONTHS_PT:
-                month = SUC_MONTHS_PT.index(month)
-            elif month in SUC_MONTHS_EN:
-                month = SUC_MONTHS_EN.index(month)
-            else:
-                month = datetime.strptime(month, '%b').month
+            month = _SUC_MONTHS.get(month) or \
+                    datetime.strptime(month, '%b').month
             return date(year, month, int(m.group(1)))
-    except:
+    except (TypeError, ValueError):
         pass
     return suc_date
+
+@lru_cache(maxsize=1<<14)
 def suc_date2iso(suc_date):
     d = suc_date2date(suc_date)
     return d.strftime('%Y-%m-%d') if isinstance(d, date) else d
@@ -211,6 +573,7 @@ class SucupiraProgram(Dataset):
     }
     ID = 'ID_PESSOA'
     GRAU = 'DS_GRAU_ACADEMICO_DISCENTE'
+    YEAR = 'AN_BASE'
     
     def __init__(self, filename, program_code, year2dataset, **kwargs):
         super().__init__(filename, None, csv_delim=';', **kwargs)
@@ -227,6 +590,8 @@ class SucupiraProgram(Dataset):
     def download(self, **kwargs):
         filepath = self._get_filepath(**kwargs)
         if not os.path.isfile(filepath):
+            download_concurrently(self.year2dataset.values(), **kwargs)
+            kwargs.pop('force', None) # years were just downloaded
             with open(filepath, 'w', encoding='utf-8', newline='') as out:
                 writer = None
                 fields = []
@@ -253,46 +618,186 @@ class SucupiraProgram(Dataset):
                 with open(filepath, 'r', encoding='utf-8', newline='') as in_f, \
                      open(filepath+'.tmp', 'w', encoding='utf-8', newline='') \
                          as out_f:
-                     reader = csv.DictReader(in_f, delimiter=';')
-                     raw = [x for x in reader]
-                     writer = csv.DictWriter(out_f, fieldnames=fields,
-                                             delimiter=';')
-                     writer.writeheader()
-                     for i in range(len(raw)):
-                         id_pessoa, grau = raw[i][self.ID], raw[i][self.GRAU]
-                         if not any(map(lambda x: x[self.ID]==id_pessoa and \
-                                        x[self.GRAU]==grau, raw[:i])):
-                             writer.writerow(raw[i])
+                    reader = csv.reader(in_f, delimiter=';')
+                    header = next(reader)
+                    writer = csv.writer(out_f, delimiter=';')
+                    writer.writerow(header)
+                    # keep the newest year of every (ID_PESSOA, grau)
+                    key = extsort.columns_key([header.index(self.ID),
+                                               header.index(self.GRAU)])
+                    order = None
+                    if self.YEAR in header:
+                        order = extsort.newest(header.index(self.YEAR))
+                    writer.writerows(extsort.unique_rows(
+                        reader, key, order,
+                        directory=os.path.dirname(filepath)))
                 os.replace(filepath+'.tmp', filepath)
         return filepath        
 
     
+_JSON_WS_RX = re.compile(r'[ \t\n\r]*')
+_JSON_NUM_TAIL_RX = re.compile(r'[0-9.eE+-]*')
+
+class _JSONStream:
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf, self.pos, self.eof = '', 0, False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _JSON_WS_RX.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == None or c not in chars:
+            raise ValueError(f'Expected one of {chars!r} in JSON stream, ' + \
+                             f'got {c!r}')
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                v, end = self.decoder.raw_decode(self.buf, self.pos)
+                if isinstance(v, (int, float)):
+                    end_tail = _JSON_NUM_TAIL_RX.match(self.buf, end).end()
+                else:
+                    end_tail = end
+                if end_tail < len(self.buf) or self.eof:
+                    self.pos = end
+                    return v
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+def iter_json_items(fp, key='items', chunk_size=1<<16):
+    '''Yields the elements of the array stored under key in the top-level
+    JSON object read from the text file fp. Only one element is held in
+    memory at a time. Other top-level members are parsed and discarded.
+    '''
+    s = _JSONStream(fp, chunk_size)
+    s.expect('{')
+    if s.peek() == '}':
+        return
+    while True:
+        k = s.value()
+        s.expect(':')
+        if k == key:
+            s.expect('[')
+            if s.peek() == ']':
+                s.pos += 1
+            else:
+                while True:
+                    yield s.value()
+                    if s.expect(',]') == ']':
+                        break
+        else:
+            s.value()
+        if s.expect(',}') == '}':
+            return
+
+def iter_ndjson(fp):
+    '''Yields the objects of a NDJSON file. A truncated last line (e.g.,
+    from an interrupted write) is ignored'''
+    for line in fp:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                if line.endswith('\n'):
+                    raise
+
+
 class GoogleCalendar(Dataset):
+    '''Dump of all events in a Google Calendar.
+
+    With ndjson=True the dump is stored as one event per line. A forced
+    download of an existing NDJSON dump only fetches events updated since
+    the newest event in the file and rewrites the file with one line per
+    event id, updated events last. Later lines supersede earlier lines
+    with the same event id.
+    '''
+    HOST = 'www.googleapis.com'
+
     def __init__(self, filename, calendarId,
-                 key_file = SERVICE_ACCOUNT_FILE, **kwargs):
+                 key_file = SERVICE_ACCOUNT_FILE, ndjson=False, **kwargs):
         super().__init__(filename, None, **kwargs)
         self.calendarId = calendarId
         self.key_file = key_file
+        self.ndjson = ndjson
+
+    def iter_events(self, **kwargs):
+        with self.open(**kwargs) as f:
+            it = iter_ndjson(f) if self.ndjson else iter_json_items(f)
+            for event in it:
+                yield event
+
+    def _list_pages(self, **list_args):
+        service = google_api.service('calendar', 'v3', self.key_file,
+                                     [google_api.CALENDAR_READONLY])
+        next_token = None
+        while True:
+            r = service.events().list(calendarId=self.calendarId,
+                                      pageToken=next_token,
+                                      **list_args).execute()
+            yield r
+            next_token = r.get('nextPageToken')
+            if not next_token:
+                break
+
+    def _download_ndjson(self, filepath):
+        events, list_args = dict(), dict()
+        if os.path.isfile(filepath):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                for i, e in enumerate(iter_ndjson(f)):
+                    events.pop(e.get('id', i), None)
+                    events[e.get('id', i)] = e
+            updated = max(chain([''], map(lambda e: e.get('updated', ''),
+                                          events.values())))
+            if updated:
+                list_args['updatedMin'] = updated
+        # updatedMin is inclusive: compact by id, superseded events last
+        for r in self._list_pages(**list_args):
+            for event in r.get('items', []):
+                key = event.get('id', len(events))
+                events.pop(key, None)
+                events[key] = event
+        with open(filepath+'.tmp', 'w', encoding='utf-8',
+                  newline='\n') as out:
+            for event in events.values():
+                out.write(json.dumps(event) + '\n')
+        os.replace(filepath+'.tmp', filepath)
+        return filepath
 
     def download(self, directory=None, force=False, **kwargs):
         filepath = self._get_filepath(directory=directory)
         if not force and os.path.isfile(filepath):
             return filepath
-        creds = service_account.Credentials.from_service_account_file(
-            self.key_file,
-            scopes=['https://www.googleapis.com/auth/calendar.readonly'])
-        service = googleapiclient.discovery.build('calendar', 'v3', credentials=creds)
-        all_r, next_token = None, None
-        while True:
-            r = service.events().list(calendarId=self.calendarId,
-                                      pageToken=next_token).execute()
+        if self.ndjson:
+            return self._download_ndjson(filepath)
+        all_r = None
+        for r in self._list_pages():
             if all_r == None:
                 all_r = r
             else:
                 all_r['items'] += r['items']
-            next_token = r.get('nextPageToken')
-            if not next_token:
-                break
         with open(filepath, 'w', encoding='utf-8', newline='\n') as out:
             json.dump(all_r, out, indent=2)
         return filepath
@@ -300,6 +805,7 @@ class GoogleCalendar(Dataset):
     
 class GoogleCalendarCSV(Dataset):
     FIELDS = ['tipo', 'discente', 'orientador', 'coorientador', 'data_ymd', '']
+    RECORD = records.record_type('CalendarEvent', FIELDS)
     RX_TYPE = re.compile(r'(?i)^\s*(Defesa|(?:Exame\s+(?:de)?\s+)?Qualifica\S+o|Semin\S+rio(?:\s*(?:de\s*)?andamento\s*)?|SAD|EQD|EQM)\s*(?:de)?\s*(Mestrado|Doutorado|)\s*(?:\((?:SAD|EQM|EQD)\))?\s*(?:de|-|:)?\s*(.*)')
     RX_EATEN_NEWLINE = re.compile('(T\S+TULO|LOCAL|DATA(.*HORA)|(CO-?)ORIENTADORA?):?\s*$')
     RX_ORIENTADOR = re.compile(      r'(?i)ORIENTADORA?:\s*(?:prof.?\.?)?\s*(?:dr.?\.)?\s*((?:\w| \w\.| )+)')
@@ -310,6 +816,7 @@ class GoogleCalendarCSV(Dataset):
     def __init__(self, filename, calendarDataset, **kwargs):
         super().__init__(filename, None, **kwargs)
         self.calendar = calendarDataset
+        self.parsed = None
 
     def __cleanup_name(self, s):
         s = self.RX_EATEN_NEWLINE.sub('', unidecode(s.strip()))
@@ -321,7 +828,7 @@ class GoogleCalendarCSV(Dataset):
             d[key] = self.__cleanup_name(m.group(1))
         
     def parse_event(self, event):
-        m = self.RX_TYPE.search(event['summary'])
+        m = self.RX_TYPE.search(event.get('summary', ''))
         if m == None:
             return None
         tipo = m.group(1).strip().lower()
@@ -349,31 +856,80 @@ class GoogleCalendarCSV(Dataset):
                 d['data_ymd'] = m.group(1)
         return d
 
+    def parsed_events(self, directory=None, force=False, **kwargs):
+        '''Returns a list of (row, description) pairs, one for each event
+        in the calendar dump that parse_event() recognizes.
+
+        Parse results are cached on disk, keyed by event id and its updated
+        timestamp, so only new or changed events are parsed again. The list
+        is kept in memory until the calendar dump changes.
+        '''
+        json_path = self.calendar.download(directory=directory, force=force,
+                                           **kwargs)
+        st = os.stat(json_path)
+        stamp = (json_path, st.st_mtime_ns, st.st_size)
+        if self.parsed != None and self.parsed[0] == stamp:
+            return self.parsed[1]
+        cache = ParseCache(self._get_filepath(directory=directory)+'.cache')
+        entries = dict()
+        events = self.calendar.iter_events(directory=directory, **kwargs)
+        for i, event in enumerate(events):
+            e_id = event.get('id')
+            value = ParseCache.MISSING
+            if e_id != None:
+                value = cache.get(e_id, event.get('updated'))
+            if value is ParseCache.MISSING:
+                d = None
+                if event.get('status') != 'cancelled':
+                    d = self.parse_event(event)
+                value = None if d == None else \
+                        [d, event.get('description', '')]
+                if e_id != None:
+                    cache.put(e_id, event.get('updated'), value)
+            entries[f'#{i}' if e_id == None else e_id] = value
+        cache.save()
+        self.parsed = (stamp, [tuple(v) for v in entries.values() if v])
+        return self.parsed[1]
+
     def download(self, directory=None, force=False, **kwargs):
         filepath = self._get_filepath(directory=directory, **kwargs)
         if not force and os.path.isfile(filepath):
             return filepath
-        with self.calendar.open(directory=directory, force=force,
-                                **kwargs) as json_f:
-            o = json.load(json_f)
-            with open(filepath, 'w', newline='') as csv_f:
-                writer = csv.DictWriter(csv_f, fieldnames=self.FIELDS)
-                writer.writeheader()
-                for entry in o['items']:
-                    d = self.parse_event(entry)
-                    if d != None:
-                        writer.writerow(d)
+        events = self.parsed_events(directory=directory, force=force, **kwargs)
+        with open(filepath, 'w', newline='') as csv_f:
+            writer = csv.DictWriter(csv_f, fieldnames=self.FIELDS)
+            writer.writeheader()
+            for d, _ in events:
+                writer.writerow(d)
         return filepath
 
+_INT_RX = re.compile(r'-?[0-9]+')
+
 def tolerant_int(e, **kwargs):
-    try:
-        matcher = re.search(r'(-?[0-9]+)', e)
-        s = '' if matcher is None else matcher.group(1)
-        if 'empty' in kwargs and s == '':
-            return kwargs['empty']
-        return int(s)
-    except ValueError:
-        pass
+    '''First integer found in string e. If there is none, returns the
+    empty named argument or None'''
+    if e.isdigit() and e.isascii():
+        return int(e)
+    m = _INT_RX.search(e)
+    if m != None:
+        return int(m.group())
+    return kwargs.get('empty')
+
+def convert_columns(rows, converters):
+    '''Converts, in place, the values of whole columns of rows (dicts or
+    lists). converters maps a column to a function applied to each of its
+    values. Since columns hold few distinct values, conversions are
+    memoized per column: converters must be pure and return immutable
+    values. Returns rows.'''
+    for col, f in converters.items():
+        memo = dict()
+        for r in rows:
+            v = r[col]
+            try:
+                r[col] = memo[v]
+            except KeyError:
+                r[col] = memo[v] = f(v)
+    return rows
 
 def _get_html_int(html, selector, **kwargs):
     if html == None:
@@ -391,10 +947,12 @@ def _get_html_ints(html, selector, **kwargs):
 
     
 class Scholar(Dataset):
+    HOST = 'scholar.google.com.br'
     __URL_BASE = 'https://scholar.google.com.br/citations?user='
     MAIN_FIELDS = ['docente', 'scholar_id', 'documents', 'citations', \
                    'docs-citing', 'docs-citing-5', 'h-index', 'h5-index']
     WORKS_FIELDS = ['year', 'citations', 'authors', 'title', 'venue']
+    WORK_RECORD = records.record_type('ScholarWork', WORKS_FIELDS)
     AUTHORS_FMT = {'sep' : ';', 'order' : 'FIRST_FIRST', 'super_compact': True}
     
     def __init__(self, docentes_dataset, basename='scholar',
@@ -508,6 +1066,7 @@ class ScholarFile(Dataset):
         self.scholar = scholar
         if suffix == '-works':
             self.FIELDS = Scholar.WORKS_FIELDS
+            self.RECORD = Scholar.WORK_RECORD
             self.AUTHORS_FMT = Scholar.AUTHORS_FMT
 
     def download(self, **kwargs):
@@ -555,6 +1114,7 @@ class ScopusWorks(InputDataset):
                                 f'File {filepath} not found! ' + msg, filepath)
 
 class CPCWorks(Dataset):
+    HOST = 'sheets.googleapis.com'
     AUTHORS_FMT = {'sep' : ';', 'order' : ','}
     ID = '1vhjisGxmd17uwEqjhegcyo-yYnUnNGZVPhBPPeJbqZQ'
     RX_FIRST_SENTENCE = re.compile(r'(?i)(.*?\w\w+)\.')
@@ -566,11 +1126,12 @@ class CPCWorks(Dataset):
         super().__init__(filename, None, **kwargs)
         sheetId = sheetId if sheetId != None else self.ID
         self.sheetId = sheetId
-        self.credentials = service_account.Credentials.from_service_account_file(
-            key_file, scopes=['https://www.googleapis.com/auth/spreadsheets'])
-        self.service = googleapiclient.discovery.build('sheets', 'v4', \
-                                                       credentials=self.credentials)
-        self.sheets = self.service.spreadsheets()
+        self.key_file = key_file
+
+    @property
+    def sheets(self):
+        return google_api.service('sheets', 'v4', self.key_file,
+                                  [google_api.SPREADSHEETS]).spreadsheets()
 
     def get_authors(self, text):
         pieces = text.split(' . ')
@@ -608,20 +1169,32 @@ class CPCWorks(Dataset):
         if len(ranges) < 1:
             raise ValueError(f'Got no ranges from sheet {self.sheetId}. ' + \
                              f'Asked for {range_address}')
-        rows = ranges[0].get('values')
+        self.write_rows(ranges[0].get('values'), filepath)
+        return filepath
+
+    def write_rows(self, rows, filepath):
+        '''Writes the CSV for the Artigos sheet rows (header first). Rows
+        that did not change since the last call (with the same header) are
+        taken from a ParseCache instead of being processed again'''
         artigo_idx = rows[0].index('Artigo (conforme Lattes)')
         header = rows[0][:artigo_idx] + ['autores'] + rows[0][artigo_idx:]
         header = [x.replace('\n', ' ').strip() for x in header]
+        version = content_key(rows[0])
         rows = rows[1:]
+        cache = ParseCache(filepath+'.cache')
         with open(filepath, mode='w', newline='', encoding=self.encoding) as f:
             writer = csv.writer(f)
             writer.writerow(header)
             for row in rows:
-                c_row = [x.replace('\n', ' ').strip() for x in row]
-                c_row = c_row[:artigo_idx ] + [self.get_authors(c_row[artigo_idx])] \
-                      + c_row[ artigo_idx:]
+                key = content_key(row)
+                c_row = cache.get(key, version)
+                if c_row is ParseCache.MISSING:
+                    c_row = [x.replace('\n', ' ').strip() for x in row]
+                    c_row = c_row[:artigo_idx ] + [self.get_authors(c_row[artigo_idx])] \
+                          + c_row[ artigo_idx:]
+                    cache.put(key, version, c_row)
                 writer.writerow(c_row)
-        return filepath
+        cache.save()
 
     def doi_getter(self):
         try:
@@ -638,6 +1211,8 @@ class CPCWorks(Dataset):
             return lambda x: None
 
 class SecretariaDiscentes(Dataset):
+    HOST = 'sheets.googleapis.com'
+    WATCH_REFETCH = True # a single sheet read, parsed against DOCENTES
     ID = '1GUhX1Ql3Ky0BzOuIo9CPdKKQg4TIpuW7VYc7MKyl15c'
     GRAUS = {'DO': 'DOUTORADO', 'ME': 'MESTRADO'}
     FIELDS = ['NM_DISCENTE', 'DS_GRAU_ACADEMICO_DISCENTE',
@@ -647,6 +1222,7 @@ class SecretariaDiscentes(Dataset):
               'DT_TERMINO', 'DT_TERMINO_ISO',
               'ST_PROF_LING_1', 'ST_PROF_LING_2',
               'ST_SAD', 'ST_QUALIFICACAO', 'NUM_SEMINARIOS']
+    RECORD = records.record_type('SecretariaDiscente', FIELDS)
     RX_COADV = re.compile(r'(?i)\s*Coorientadora?:?\s*([^\)\]]*)\)?\]?')
     
     def __init__(self, docentes, filename='secretaria.csv', **kwargs):
@@ -656,12 +1232,16 @@ class SecretariaDiscentes(Dataset):
         self.docentes_ds = docentes
         self.docentes = None
 
-    def canon_advidsor(self, name):
+    def _docentes(self):
         if not self.docentes:
             with self.docentes_ds.open_csv() as reader:
                 self.docentes = {r['docente'] for r in reader}
+        return self.docentes
+
+    def canon_advidsor(self, name):
         canon_f = lambda x: names.canon_name(name, x)
-        return next(chain(filter(None, map(canon_f, self.docentes)), [name]))
+        return next(chain(filter(None, map(canon_f, self._docentes())),
+                          [name]))
 
     def parse_name(self, text):
         lines = list(filter(len, text.split('\n')))
@@ -679,11 +1259,8 @@ class SecretariaDiscentes(Dataset):
         if not force and os.path.isfile(filepath):
             return filepath
         
-        creds = service_account.Credentials.from_service_account_file(
-            self.key_file, scopes=['https://www.googleapis.com/auth/spreadsheets'])
-        service = googleapiclient.discovery.build('sheets', 'v4',
-                                                  credentials=creds)
-        sheets = service.spreadsheets()
+        sheets = google_api.service('sheets', 'v4', self.key_file,
+                                    [google_api.SPREADSHEETS]).spreadsheets()
         range_address = 'Controle!A1:P500'
         ranges = sheets.values().batchGet(spreadsheetId=self.sheetId,
                                             majorDimension='ROWS',
@@ -693,72 +1270,104 @@ class SecretariaDiscentes(Dataset):
             raise ValueError(f'Got no ranges from sheet {self.sheetId}. ' + \
                              f'Asked for {range_address}')
         data = ranges[0].get('values')
+        self.docentes = None # re-read, DOCENTES may have changed
+        self.write_rows(data, filepath)
+        return filepath
+
+    def write_rows(self, data, filepath):
+        '''Writes the CSV for the Controle sheet data. Rows whose cells,
+        advisor cell and the docentes list did not change since the last
+        call are taken from a ParseCache instead of being parsed again.
+        DT_SITUACAO_DISCENTE (today) is always recomputed'''
+        version = content_key(sorted(self._docentes()))
+        cache = ParseCache(filepath+'.cache')
+        today = date2suc_date(date.today())
         with open(filepath, 'w', newline='', encoding=self.encoding) as out_f:
             writer = csv.DictWriter(out_f, fieldnames=self.FIELDS)
             writer.writeheader()
             for adv_row in filter(None, map(lambda x: x[0] if len(x[1])==1 else None,
                                             zip(range(len(data)), data))):
-                advisor = self.canon_advidsor(data[adv_row][0])
+                advisor = None
                 i = adv_row + 2
                 while i < len(data) and len(data[i]) > 3 and len(data[i][3]):
-                    grau = self.GRAUS.get(data[i][4].strip().upper())
-                    name, coadvisor = self.parse_name(data[i][3])
-                    matr = datetime.strptime(data[i][5].strip(), '%d/%m/%Y')
-                    term = datetime.strptime(data[i][9].strip(), '%d/%m/%Y')
-                    cells = data[i]
-                    d = {
-                        self.FIELDS[ 0]: name,
-                        self.FIELDS[ 1]: grau,
-                        self.FIELDS[ 2]: date2suc_date(matr),
-                        self.FIELDS[ 3]: date2suc_date(date.today()),
-                        self.FIELDS[ 4]: advisor,
-                        self.FIELDS[ 5]: coadvisor,
-                        self.FIELDS[ 6]: _tol_getidx(cells, 6, ''),  #prorrog_1
-                        self.FIELDS[ 7]: _tol_getidx(cells, 7, ''),  #prorrog_2
-                        self.FIELDS[ 8]: _tol_getidx(cells, 8, ''),  #tranc
-                        self.FIELDS[ 9]: date2suc_date(term),
-                        self.FIELDS[10]: term.isoformat(),
-                        self.FIELDS[11]: _tol_getidx(cells, 10, ''), #prof ing
-                        self.FIELDS[12]: _tol_getidx(cells, 11, ''), #prof 2
-                        self.FIELDS[13]: _tol_getidx(cells, 12, ''), #sad
-                        self.FIELDS[14]: _tol_getidx(cells, 13, ''), #qualify
-                        self.FIELDS[15]: _tol_getidx(cells, 14, 0 ), #seminarios
-                    }
+                    key = content_key(data[adv_row][0], data[i])
+                    d = cache.get(key, version)
+                    if d is ParseCache.MISSING:
+                        if advisor == None:
+                            advisor = self.canon_advidsor(data[adv_row][0])
+                        d = self.parse_row(data[i], advisor)
+                        cache.put(key, version, d)
+                    d[self.FIELDS[3]] = today
                     writer.writerow(d)
                     i += 1
-        return filepath
+        cache.save()
+
+    def parse_row(self, cells, advisor):
+        grau = self.GRAUS.get(cells[4].strip().upper())
+        name, coadvisor = self.parse_name(cells[3])
+        matr = datetime.strptime(cells[5].strip(), '%d/%m/%Y')
+        term = datetime.strptime(cells[9].strip(), '%d/%m/%Y')
+        return {
+            self.FIELDS[ 0]: name,
+            self.FIELDS[ 1]: grau,
+            self.FIELDS[ 2]: date2suc_date(matr),
+            self.FIELDS[ 3]: date2suc_date(date.today()),
+            self.FIELDS[ 4]: advisor,
+            self.FIELDS[ 5]: coadvisor,
+            self.FIELDS[ 6]: _tol_getidx(cells, 6, ''),  #prorrog_1
+            self.FIELDS[ 7]: _tol_getidx(cells, 7, ''),  #prorrog_2
+            self.FIELDS[ 8]: _tol_getidx(cells, 8, ''),  #tranc
+            self.FIELDS[ 9]: date2suc_date(term),
+            self.FIELDS[10]: term.isoformat(),
+            self.FIELDS[11]: _tol_getidx(cells, 10, ''), #prof ing
+            self.FIELDS[12]: _tol_getidx(cells, 11, ''), #prof 2
+            self.FIELDS[13]: _tol_getidx(cells, 12, ''), #sad
+            self.FIELDS[14]: _tol_getidx(cells, 13, ''), #qualify
+            self.FIELDS[15]: _tol_getidx(cells, 14, 0 ), #seminarios
+        }
 
 
 class CompressedCSV(Dataset):
-    def __init__(self, filename, url=None, message='', **kwargs):
+    def __init__(self, filename, url=None, message='', codec=None, level=None,
+                 **kwargs):
+        '''The file is stored as filename plus the extension of its codec
+        (see compression.EXTENSION). Downloads are recompressed into codec,
+        if given, else kept as they come'''
         super().__init__(filename, url, **kwargs)
         self.message = message
+        self.codec = codec
+        self.level = level
+
+    def _find(self, filepath):
+        for codec in compression.CODECS:
+            if os.path.isfile(filepath + compression.EXTENSION[codec]):
+                return filepath + compression.EXTENSION[codec]
+        return None
 
     def is_ready(self, **kwargs):
         directory = kwargs.get('directory', self.directory)
-        filepath = os.path.join(directory, self.filename)
-        return os.path.isfile(filepath+'.gz') or \
-               os.path.isfile(filepath+'.xz')
+        return self._find(os.path.join(directory, self.filename)) != None
         
     def download(self, force=False, **kwargs):
         filepath = self._get_filepath(**kwargs)
-        if not force and os.path.isfile(filepath+'.gz'):
-            return filepath+'.gz'
-        if not force and os.path.isfile(filepath+'.xz'):
-            return filepath+'.xz'
+        found = self._find(filepath)
+        if not force and found:
+            return found
         if self.url:
             print(f'Downloading {self.url}')
             download_url(self.url, filepath+'.tmp')
-            suff = ''
-            for ext, mod in [('gz', gzip), ('xz', lzma)]:
-                try:
-                    with mod.open(filepath+'.tmp', 'rt') as f:
-                        f.read(1000)
-                        suff = '.'+ext
-                except:
-                    pass
-            os.replace(filepath+'.tmp', filepath+suff)
-            return filepath+suff
+            codec = compression.sniff(filepath+'.tmp')
+            if self.codec not in [None, codec]:
+                compression.recompress(filepath+'.tmp', filepath+'.tmp2',
+                                       self.codec, self.level)
+                os.replace(filepath+'.tmp2', filepath+'.tmp')
+                codec = self.codec
+            dest = filepath + compression.EXTENSION[codec]
+            os.replace(filepath+'.tmp', dest)
+            for ext in compression.EXTENSION.values():
+                if filepath+ext != dest and os.path.isfile(filepath+ext):
+                    os.remove(filepath+ext)
+            return dest
         if self.message:
             print(self.message)
         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), filepath)
@@ -767,17 +1376,17 @@ class CompressedCSV(Dataset):
         return self._open(self.download(**kwargs), 'r', **kwargs)
 
     def _open(self, filepath, mode, **kwargs):
-        mod = {'.gz': gzip, '.xz': lzma}.get(filepath[-3:])
-        if not mod:
-            raise ValueError(f'Unknown extension {filepath[-3:]}')
-        return mod.open(filepath, mode+'t',
-                        newline=kwargs.get('newline'), encoding='utf-8')
+        codec = None if 'r' in mode else \
+                (self.codec or compression.codec_for_name(filepath))
+        return compression.open_text(filepath, mode, codec, self.level,
+                                     newline=kwargs.get('newline'))
 
 
 class DiscentesCAPGCNPJ(Dataset):
     # RX_PDF = re.compile(r'([0-9]{11})\s*([^\n]+)\n[^0-9]*\d,\d\d\s*(\d\d/\d\d/\d\d\d\d)\s*')
     RX_PDF = re.compile(r'([0-9]{11})\s*([^\n]+)\n')
     FIELDS = ['cpf', 'discente', 'cnpj', 'data_entrada_sociedade']
+    CHECKPOINT_ROWS = 200000
     
     def __init__(self, filename, pdfs_dir, socios, **kwargs):
         super().__init__(filename, None, **kwargs)
@@ -785,6 +1394,14 @@ class DiscentesCAPGCNPJ(Dataset):
         self.pdfs_dir = pdfs_dir
         self.socios = socios
         
+    def inputs(self, directory=None, **kwargs):
+        directory = self.directory if directory == None else directory
+        pdfs_dir = os.path.join(directory, self.pdfs_dir)
+        if not os.path.isdir(pdfs_dir):
+            return [pdfs_dir]
+        return [pdfs_dir] + [os.path.join(pdfs_dir, f) \
+                             for f in sorted(os.listdir(pdfs_dir))]
+
     def clean_cpf(self, cpf):
         if not isinstance(cpf, str) or len(cpf) < 11:
             cpf = f'{int(str(cpf)):011d}'
@@ -811,8 +1428,7 @@ class DiscentesCAPGCNPJ(Dataset):
             if m:
                 return m
         
-    def __create(self, filepath, **kwargs):
-        directory = kwargs.get('directory', self.directory)
+    def _students(self, directory):
         pdfs_dir = os.path.join(directory, self.pdfs_dir)
         students = []
         for pdf in os.listdir(pdfs_dir):
@@ -822,24 +1438,120 @@ class DiscentesCAPGCNPJ(Dataset):
                 continue
             s = s.decode('utf-8')
             students += self.RX_PDF.findall(s)
-        students = [(self.clean_cpf(c), names.clean_name(n)) \
-                    for c,n in students]
-        print(f'Looking for {len(students)} students in ~26.6 million CNPJs')
-        print('This will take many HOURS.')
-        with open(filepath+'.tmp', 'w', newline='', encoding=self.encoding) as out_f, \
-             self.socios.open_csv() as socios, \
-             tqdm(unit_scale=True, unit='row', mininterval=1, \
+        return [(self.clean_cpf(c), names.clean_name(n)) for c,n in students]
+
+    def _load_checkpoint(self, out_path, source, students):
+        try:
+            with open(out_path+'.checkpoint', 'r', encoding='utf-8') as f:
+                ckpt = json.load(f)
+            st = os.stat(source)
+            if ckpt['source'] != [os.path.abspath(source), st.st_size,
+                                  st.st_mtime_ns] or \
+                    ckpt['students'] != content_key(students) or \
+                    os.path.getsize(out_path) < ckpt['out_size']:
+                return None
+            return ckpt
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_checkpoint(self, out_path, out_f, ckpt):
+        out_f.flush()
+        os.fsync(out_f.fileno())
+        with open(out_path+'.checkpoint.tmp', 'w', encoding='utf-8') as f:
+            json.dump(ckpt, f)
+        os.replace(out_path+'.checkpoint.tmp', out_path+'.checkpoint')
+
+    def _socios_lines(self, f, ckpt):
+        for line in f:
+            ckpt['next'] += len(line)
+            yield line.decode(self.socios.encoding)
+
+    def _scan(self, out_path, students):
+        '''Writes the matches of students in socios to out_path. Every
+        CHECKPOINT_ROWS rows and when interrupted, the position in the
+        decompressed socios stream and the size of out_path up to the last
+        row read from there are saved to out_path.checkpoint. A later call
+        with the same socios file and students resumes from there, dropping
+        anything written after that size. Returns the number of matches'''
+        source = self.socios.download()
+        ckpt = self._load_checkpoint(out_path, source, students)
+        if ckpt != None:
+            print(f'Resuming at row {ckpt["rows"]} of {self.socios} from ' + \
+                  f'{out_path}.checkpoint')
+            os.truncate(out_path, ckpt['out_size'])
+            out_f = open(out_path, 'a', newline='', encoding=self.encoding)
+        else:
+            st = os.stat(source)
+            ckpt = {'source': [os.path.abspath(source), st.st_size,
+                               st.st_mtime_ns],
+                    'students': content_key(students), 'fields': None,
+                    'offset': 0, 'rows': 0, 'wrote': 0, 'out_size': 0}
+            out_f = open(out_path, 'w', newline='', encoding=self.encoding)
+        if compression.sniff(source) == 'plain':
+            in_f = open(source, 'rb')
+            in_f.seek(ckpt['offset'])
+        else:
+            in_f = compression.open_binary(source, 'rb')
+            left = ckpt['offset']
+            while left > 0: # skip without parsing, still much faster
+                chunk = in_f.read(min(left, 1 << 20))
+                if not chunk:
+                    break
+                left -= len(chunk)
+        ckpt['next'] = ckpt['offset']
+        with out_f, in_f, \
+             tqdm(unit_scale=True, unit='row', mininterval=1,
+                  initial=ckpt['rows'],
                   desc=f'Finding students in {self.socios}') as pbar:
-            writer = csv.DictWriter(out_f, fieldnames=self.FIELDS)
-            writer.writeheader()
-            wrote = 0
-            for r in socios:
-                merged = self._match_student(r, students)
-                if merged:
-                    writer.writerow(merged)
-                    wrote += 1
-                    print(f'CNPJ {merged["cnpj"]} for {merged["discente"]}')
-                pbar.update(1)
+            lines = self._socios_lines(in_f, ckpt)
+            socios = csv.DictReader(lines, fieldnames=ckpt['fields'],
+                                    delimiter=self.socios.csv_delim)
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=self.FIELDS)
+            def flush():
+                text = buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+                out_f.write(text)
+                return len(text.encode(self.encoding))
+            try:
+                # every ckpt.update() is a single call, so that an interrupt
+                # never saves the output size without the matching offset
+                if ckpt['fields'] == None:
+                    fields = socios.fieldnames
+                    writer.writeheader()
+                    ckpt.update(fields=fields, offset=ckpt['next'],
+                                out_size=flush())
+                for r in socios:
+                    end = ckpt['next'] # csv.reader does not read ahead
+                    merged = self._match_student(r, students)
+                    size = ckpt['out_size']
+                    if merged:
+                        writer.writerow(merged)
+                        size += flush()
+                    ckpt.update(offset=end, rows=ckpt['rows'] + 1,
+                                wrote=ckpt['wrote'] + (1 if merged else 0),
+                                out_size=size)
+                    if merged:
+                        print(f'CNPJ {merged["cnpj"]} for ' + \
+                              f'{merged["discente"]}')
+                    if ckpt['rows'] % self.CHECKPOINT_ROWS == 0:
+                        self._save_checkpoint(out_path, out_f, ckpt)
+                    pbar.update(1)
+            except BaseException:
+                self._save_checkpoint(out_path, out_f, ckpt)
+                raise
+        if os.path.isfile(out_path+'.checkpoint'):
+            os.remove(out_path+'.checkpoint')
+        return ckpt['wrote']
+
+    def __create(self, filepath, **kwargs):
+        directory = kwargs.get('directory', self.directory)
+        students = self._students(directory)
+        print(f'Looking for {len(students)} students in ~26.6 million CNPJs')
+        print('This will take many HOURS. Interrupting saves a checkpoint ' + \
+              'that the next run resumes from.')
+        wrote = self._scan(filepath+'.tmp', students)
         cpf_filepath = re.sub(r'.csv$', '+cpf.csv', filepath)
         os.replace(filepath+'.tmp', cpf_filepath)
         with open(filepath, 'w', newline='', encoding=self.encoding) as out_f, \
@@ -962,22 +1674,18 @@ CAPG_CNPJ_DETAILS = DiscentesCAPGCNPJDetails('capg-cnpj-details.csv', CAPG_CNPJ,
                                              EMPRESAS_BRASIL, CNAE_SECUNDARIA)
 
 def fix_all_names():
-    names.fix_csv_names([DOCENTES, PPGCC_CALENDAR_CSV],
-                        ['docente', 'orientador'],
-                        read_only=[0], allow_ambiguous=True)
-    names.fix_csv_names([DOCENTES, PPGCC_CALENDAR_CSV],
-                        ['docente', 'coorientador'],
-                        read_only=[0], allow_ambiguous=True)
-    names.fix_csv_names([DOCENTES, SUC_DISCENTES_PPGCC],
-                        ['docente', 'NM_ORIENTADOR_PRINCIPAL'],
-                        read_only=[0], allow_ambiguous=True)
-    names.fix_csv_names([SUC_DISCENTES_PPGCC, PPGCC_CALENDAR_CSV],
-                        ['NM_DISCENTE', 'discente'],
-                        read_only=[0], allow_ambiguous=True)
-    names.fix_csv_names([SUC_DISCENTES_PPGCC, CAPG_CNPJ],
-                        ['NM_DISCENTE', 'discente'],
-                        read_only=[0], allow_ambiguous=True)
-    names.fix_csv_names([SUC_DISCENTES_PPGCC, CAPG_CNPJ_DETAILS],
-                        ['NM_DISCENTE', 'discente'],
-                        read_only=[0], allow_ambiguous=True)
-    
+    plan = names.NameFixPlan()
+    plan.add([DOCENTES, PPGCC_CALENDAR_CSV], ['docente', 'orientador'],
+             read_only=[0], allow_ambiguous=True)
+    plan.add([DOCENTES, PPGCC_CALENDAR_CSV], ['docente', 'coorientador'],
+             read_only=[0], allow_ambiguous=True)
+    plan.add([DOCENTES, SUC_DISCENTES_PPGCC],
+             ['docente', 'NM_ORIENTADOR_PRINCIPAL'],
+             read_only=[0], allow_ambiguous=True)
+    plan.add([SUC_DISCENTES_PPGCC, PPGCC_CALENDAR_CSV],
+             ['NM_DISCENTE', 'discente'], read_only=[0], allow_ambiguous=True)
+    plan.add([SUC_DISCENTES_PPGCC, CAPG_CNPJ], ['NM_DISCENTE', 'discente'],
+             read_only=[0], allow_ambiguous=True)
+    plan.add([SUC_DISCENTES_PPGCC, CAPG_CNPJ_DETAILS],
+             ['NM_DISCENTE', 'discente'], read_only=[0], allow_ambiguous=True)
+    plan.run()
@@ -3,11 +3,11 @@ import os
 import os.path
 import re
 import csv
-import json
 from unidecode import unidecode
 from datetime import datetime, date
-from itertools import chain, product
-from ppgcc_metrics import names, datasets
+from itertools import chain
+from functools import partial
+from ppgcc_metrics import names, datasets, extsort, records
 
 def h_index(citations):
     d = dict()
@@ -23,6 +23,7 @@ def h_index(citations):
 class Bibliometrics(datasets.Dataset):
     FIELDS = ['group', 'pub_year', 'base_year', 'source',
               'h', 'h5', 'documents', 'citations']
+    RECORD = records.record_type('BibliometricsRow', FIELDS)
 
     def __init__(self, docentes, linhas, filename='bibliometrics-year.csv', \
                  scopus=None, scholar=None, base_year=None, **kwargs):
@@ -69,22 +70,23 @@ class Bibliometrics(datasets.Dataset):
                  self.docentes_ds.open_csv() as docs_reader:
                 docs = [r['docente'] for r in docs_reader \
                         if r['status'].upper().strip()=='PERMANENTE']
-                self.linhas = [r for r in linhas_reader \
-                               if names.is_in(r['docente'], docs)]
+                linhas = list(linhas_reader)
+                matches = names.match_many([r['docente'] for r in linhas], docs)
+                self.linhas = [r for r in linhas if matches[r['docente']]]
         return self.linhas
 
     def fetch_for(self, src_name, source_ds, base_year, dict_sink):
         if source_ds == None:
             return
-        with source_ds.open_csv() as reader:
+        with source_ds.open_records() as reader:
             fields = reader.fieldnames
             year_f = self._get_fieldname(fields, 'year')
             a_f = self._get_fieldname(fields, 'authors')
             cited_f = self._get_fieldname(fields, 'cited by', 'citations')
-            rows = [x for x in reader]
-            for r in rows:
-                r[cited_f] = datasets.tolerant_int(r[cited_f], empty=0)
-                r[year_f] = datasets.tolerant_int(r[year_f])
+            rows = datasets.convert_columns([x for x in reader], {
+                cited_f: partial(datasets.tolerant_int, empty=0),
+                year_f: datasets.tolerant_int
+            })
             self._write_metrics('all', src_name, rows, base_year,
                                 fields, dict_sink)
             linhas = self._get_linhas()
@@ -124,13 +126,13 @@ class BibliometricsAggregate(datasets.Dataset):
         filepath = self._get_filepath(directory=kwargs.get('directory'))
         if not force and os.path.isfile(filepath):
             return filepath
-        with self.bib.open_csv() as reader, \
+        with self.bib.open_records() as reader, \
              open(filepath, 'w', newline='', encoding=self.encoding) as out_f:
             out = csv.DictWriter(out_f, fieldnames=self.FIELDS)
             out.writeheader()
-            data = [x for x in reader]
-            for r, c in product(data, self._NUMERIC_FIELDS):
-                r[c] = datasets.tolerant_int(r[c], empty=0)
+            to_int = partial(datasets.tolerant_int, empty=0)
+            data = datasets.convert_columns([x for x in reader],
+                               dict.fromkeys(self._NUMERIC_FIELDS, to_int))
             for g, s in {(r['group'], r['source']) for r in data}:
                 sub = [r for r in data if r['group']==g and r['source']==s]
                 row = {'group': g, 'source': s,
@@ -175,7 +177,6 @@ class AugmentedDiscentes(datasets.Dataset):
         self.doi_getter = None
         self.secretaria = secretaria
         self.calendar = calendar
-        self.calendar_data = None
         self.calendar_csv = calendar_csv
 
     def weight(self, cpc_row):
@@ -188,22 +189,18 @@ class AugmentedDiscentes(datasets.Dataset):
             == self.__PUB_TYPE_STR.get(pub_type)
 
     def is_in_master_defense(self, name, phd_enroll_year, cpc_entry):
-        if not self.calendar_data and self.calendar:
-            with self.calendar.open() as fp:
-                self.calendar_data = json.load(fp)
-        if not self.calendar_data:
+        if not self.calendar_csv:
             return False
         if not self.doi_getter:
             self.doi_getter = self.cpc.doi_getter()
-        for event in self.calendar_data['items']:
-            e_dict = datasets.PPGCC_CALENDAR_CSV.parse_event(event)
-            if e_dict == None or e_dict['tipo'] != 'DFM' or \
+        for e_dict, description in self.calendar_csv.parsed_events():
+            if e_dict['tipo'] != 'DFM' or \
                not names.same_name(e_dict['discente'], name):
                 continue
             doi = self.doi_getter(cpc_entry)
             if doi:
-                print(f'######## returning {doi in event["description"]}')
-                return doi in event['description']
+                print(f'######## returning {doi in description}')
+                return doi in description
             is_per = cpc_entry['Tipo'] in ['Periódico', 'Periodico', 'Journal']
             year = datasets.tolerant_int(cpc_entry['Ano'])
             defense_year = date.fromisoformat(e_dict['data_ymd']).year
@@ -218,7 +215,7 @@ class AugmentedDiscentes(datasets.Dataset):
             if pub_type not in self.__PUB_TYPE_STR:
                 raise ValueError(f'Bad publication type {pub_type}')
         if not self.cpc_data:
-            with self.cpc.open_csv() as reader:
+            with self.cpc.open_records() as reader:
                 self.cpc_data = [x for x in reader]
         fmt = self.cpc.AUTHORS_FMT
         nm = dis['NM_DISCENTE']
@@ -264,17 +261,19 @@ class AugmentedDiscentes(datasets.Dataset):
             sec_fields = list(filter(lambda x: x not in suc_reader.fieldnames, \
                                       sec_reader.fieldnames))
             fieldnames = suc_reader.fieldnames + sec_fields + self.EXTRA_FIELDS
-            students = [dict(x) for x in suc_reader]
+            Student = records.record_type('AugmentedDiscente', fieldnames)
+            students = [Student(x) for x in suc_reader]
+            index = names.NameIndex()
+            add = lambda d: index.add(d['NM_DISCENTE'], d, \
+                                      group=d['DS_GRAU_ACADEMICO_DISCENTE'].strip())
+            for d in students:
+                add(d)
             for row in sec_reader:
                 nm = row['NM_DISCENTE']
                 grau = row['DS_GRAU_ACADEMICO_DISCENTE']
-                has = lambda d: names.same_name(d['NM_DISCENTE'], nm) and \
-                           d['DS_GRAU_ACADEMICO_DISCENTE'].strip()==grau
-                cands = list(filter(has, students))
+                cands = index.find(nm, group=grau)
                 if len(cands) > 1:
-                    has = lambda d: d['NM_DISCENTE'].strip()==nm and \
-                               d['DS_GRAU_ACADEMICO_DISCENTE'].strip()==grau
-                    cands = list(filter(has, students))
+                    cands = [d for d in cands if d['NM_DISCENTE'].strip()==nm]
                 if len(cands):
                     for f in sec_fields:
                         cands[0][f] = row[f]
@@ -282,15 +281,14 @@ class AugmentedDiscentes(datasets.Dataset):
                     if not cands[0][f] or cands[0][f].upper().strip()=='NA':
                         cands[0][f] = row[f]
                 else:
-                    students.append(dict(row))
+                    students.append(Student(row))
+                    add(students[-1])
         with self.calendar_csv.open_csv() as cal_reader:
             for event in cal_reader:
                 name = event['discente']
                 grau = self.__EVT_TIPO_GRAU.get(event['tipo'])
                 if grau:
-                    cands = [r for r in students \
-                             if r['DS_GRAU_ACADEMICO_DISCENTE']==grau and \
-                             names.same_name(r['NM_DISCENTE'], name)]
+                    cands = index.find(name, group=grau)
                     if len(cands) > 1:
                         cands = [r for r in cands \
                                  if r['NM_DISCENTE']==name]
@@ -303,7 +301,7 @@ class AugmentedDiscentes(datasets.Dataset):
                         months = round((end - begin).days / 30)
                         cands[0]['QT_MES_TITULACAO'] = months
         with open(filepath+'.tmp', 'w', newline='', encoding=self.encoding) as out_f:
-            writer = csv.DictWriter(out_f, fieldnames=fieldnames)
+            writer = records.RecordWriter(out_f, Student)
             writer.writeheader()
             for d in students:
                 k = 'NM_SITUACAO_DISCENTE'
@@ -338,6 +336,7 @@ class MultiProgramDocentes(datasets.Dataset):
         filepath = self._get_filepath(**kwargs)
         if not force and os.path.isfile(filepath):
             return filepath
+        datasets.download_concurrently(self.year2dataset.values())
         fields = []
         for year in sorted(self.year2dataset.keys(), reverse=True):
             with self.year2dataset[year].open_csv() as reader:
@@ -347,16 +346,19 @@ class MultiProgramDocentes(datasets.Dataset):
             writer.writeheader()
             for year in sorted(self.year2dataset.keys(), reverse=True):
                 ds = self.year2dataset[year]
-                ids = set()
-                with ds.open_csv() as reader:
-                    for row in reader:
-                        if self.program_code in row['CD_PROGRAMA_IES']:
-                            ids.add(row['ID_PESSOA'].strip())
-                with ds.open_csv() as reader:
-                    for row in reader:
-                        if row['ID_PESSOA'].strip() in ids and \
-                           self.program_code not in row['CD_PROGRAMA_IES']:
-                            writer.writerow(row)
+                with ds.open(newline='') as in_f:
+                    reader = csv.reader(in_f, delimiter=ds.csv_delim)
+                    header = next(reader)
+                    id_idx = header.index('ID_PESSOA')
+                    prog_idx = header.index('CD_PROGRAMA_IES')
+                    in_prog = lambda r: self.program_code in r[prog_idx]
+                    # rows of other programs of people also in this program
+                    select = lambda g: [r for r in g if not in_prog(r)] \
+                                       if any(map(in_prog, g)) else []
+                    for row in extsort.filter_groups(
+                            reader, lambda r: r[id_idx].strip(), select,
+                            directory=os.path.dirname(filepath)):
+                        writer.writerow(dict(zip(header, row)))
         return filepath
         
 
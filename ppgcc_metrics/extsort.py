@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+'''External (on-disk) sorting and grouping of CSV rows in bounded memory.
+
+Rows are lists of strings, as produced by csv.reader. At most run_rows rows
+are held in memory: larger inputs are spilled as sorted runs to temporary CSV
+files and k-way merged with heapq.merge.
+'''
+import os
+import csv
+import heapq
+import tempfile
+from itertools import groupby
+
+RUN_ROWS = 200000
+
+def columns_key(indices):
+    '''Key function for the tuple of the values at the given indices'''
+    return lambda row: tuple(row[i] for i in indices)
+
+def newest(index):
+    '''order function for unique_rows() keeping the row with the largest
+    year in column index. Rows with non-numeric years come last'''
+    def order(row):
+        v = row[index].strip()
+        return -int(v) if v.isdigit() else 1
+    return order
+
+def _spill(rows, directory, number):
+    path = os.path.join(directory, f'run-{number:05}.csv')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return path
+
+def sort_rows(rows, key, run_rows=RUN_ROWS, directory=None):
+    '''Yields rows sorted by key. The sort is stable.
+
+    directory is where the temporary runs are written (system default if
+    None). They are removed once the generator is exhausted or closed.
+    '''
+    run, runs = [], []
+    with tempfile.TemporaryDirectory(prefix='extsort-', dir=directory) as tmp:
+        for row in rows:
+            run.append(row)
+            if len(run) >= run_rows:
+                run.sort(key=key)
+                runs.append(_spill(run, tmp, len(runs)))
+                run = []
+        run.sort(key=key)
+        if not runs:
+            yield from run
+            return
+        files = [open(p, 'r', encoding='utf-8', newline='') for p in runs]
+        try:
+            # heapq.merge() breaks ties by iterable order: stability holds
+            yield from heapq.merge(*[csv.reader(f) for f in files], run,
+                                   key=key)
+        finally:
+            for f in files:
+                f.close()
+
+def filter_groups(rows, key, select, run_rows=RUN_ROWS, directory=None):
+    '''Yields, in input order, the rows kept by select(group) for every group
+    of rows with the same key(row). select receives the rows of a group in
+    input order and returns those to keep. Only a single group needs to fit
+    in memory.'''
+    numbered = ([str(i)] + row for i, row in enumerate(rows))
+    seq_key = lambda row: key(row[1:])
+    def kept():
+        for _, group in groupby(sort_rows(numbered, seq_key, run_rows,
+                                          directory), seq_key):
+            group = list(group)
+            seqs = dict()
+            for row in group:
+                seqs[id(row)] = row[0]
+                del row[0]
+            for row in select(group):
+                yield [seqs[id(row)]] + row
+    for row in sort_rows(kept(), lambda row: int(row[0]), run_rows,
+                         directory):
+        yield row[1:]
+
+def unique_rows(rows, key, order=None, run_rows=RUN_ROWS, directory=None):
+    '''Yields, in input order, a single row for every distinct key(row): the
+    first one or, if given, the one with smallest order(row), ties broken
+    by input order'''
+    if order == None:
+        select = lambda group: group[:1]
+    else:
+        select = lambda group: [min(group, key=order)]
+    return filter_groups(rows, key, select, run_rows=run_rows,
+                         directory=directory)
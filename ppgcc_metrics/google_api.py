@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+'''Process-wide factory for Google API clients.
+
+Service-account credentials are loaded once per (key file, scopes) and
+shared, so their access token is reused until it expires. Built clients are
+kept per thread (their httplib2 transports are not thread-safe) and reuse
+their keep-alive connections. Discovery documents not bundled with
+googleapiclient are cached on disk in DISCOVERY_DIR.
+'''
+import os
+import hashlib
+import threading
+from time import time
+from functools import lru_cache
+import googleapiclient.discovery
+from googleapiclient.discovery_cache.base import Cache
+from google.oauth2 import service_account
+
+DISCOVERY_DIR = os.path.join('data', 'discovery')
+DISCOVERY_MAX_AGE = 7 * 24 * 3600
+CALENDAR_READONLY = 'https://www.googleapis.com/auth/calendar.readonly'
+SPREADSHEETS = 'https://www.googleapis.com/auth/spreadsheets'
+
+class DiscoveryCache(Cache):
+    '''googleapiclient discovery cache storing one file per document'''
+    def __init__(self, directory=DISCOVERY_DIR, max_age=DISCOVERY_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.directory, name)
+
+    def get(self, url):
+        path = self._path(url)
+        try:
+            if time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(url)
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        with open(path+'.tmp', 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(path+'.tmp', path)
+
+@lru_cache(maxsize=32)
+def _credentials(key_file, scopes):
+    return service_account.Credentials.from_service_account_file(
+        key_file, scopes=list(scopes))
+
+def credentials(key_file, scopes):
+    '''Shared service-account credentials for key_file and scopes'''
+    return _credentials(os.path.abspath(key_file), tuple(sorted(scopes)))
+
+_local = threading.local()
+
+def service(name, version, key_file, scopes):
+    '''Client for the given API, built once per thread'''
+    clients = getattr(_local, 'clients', None)
+    if clients == None:
+        clients = _local.clients = dict()
+    key = (name, version, os.path.abspath(key_file), tuple(sorted(scopes)))
+    if key not in clients:
+        clients[key] = googleapiclient.discovery.build(
+            name, version, credentials=credentials(key_file, scopes),
+            cache=DiscoveryCache())
+    return clients[key]
+
+def reset():
+    '''Forgets cached credentials and the clients of the calling thread'''
+    _credentials.cache_clear()
+    _local.clients = dict()
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+'''Run-wide timers and counters for datasets and name matching.
+
+Every entry is keyed by a string such as 'download:cpc.csv' or
+'names.canon_maps' and accumulates calls, wall and CPU seconds, rows and
+bytes read and written and cache hits. Times are inclusive: a download
+that triggers the download of its inputs also accounts for their time.
+'''
+import os
+import sys
+import csv
+import json
+import threading
+import importlib
+from time import perf_counter, process_time
+from datetime import datetime
+from functools import wraps
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+FIELDS = ['calls', 'wall', 'cpu', 'rows_in', 'rows_out',
+          'bytes_in', 'bytes_out', 'cache_hits']
+
+STATS = dict()
+EXTRA = dict()
+STARTED = datetime.now()
+_LOCK = threading.Lock() # guards STATS, PROFILE and the _THREAD_ lists
+_local = threading.local()
+_THREAD_COUNTS = [] # count() dicts of each thread, merged by report()
+
+def reset():
+    global STARTED
+    with _LOCK:
+        STATS.clear()
+        for stats in PROFILE.values():
+            stats[:] = [0, 0, 0.0]
+        for _, stats in _THREAD_PROFILE:
+            stats[:] = [0, 0, 0.0]
+        for counts in _THREAD_COUNTS:
+            counts.clear()
+    EXTRA.clear()
+    STARTED = datetime.now()
+
+def add(key, **values):
+    with _LOCK:
+        e = STATS.get(key)
+        if e == None:
+            e = STATS[key] = dict.fromkeys(FIELDS, 0)
+        for k, v in values.items():
+            e[k] += v
+
+def _count(key, n=1):
+    try:
+        counts = _local.counts
+    except AttributeError:
+        counts = _local.counts = dict()
+        with _LOCK:
+            _THREAD_COUNTS.append(counts)
+    counts[key] = counts.get(key, 0) + n
+
+def _ignore(key, n=1):
+    pass
+
+# count(key, n=1) adds n to the calls of key, for hot paths. Each thread
+# counts into its own dict, without locking. A no-op unless enabled
+count = _ignore
+
+def set_counting(enabled=True):
+    '''Enables (or disables) count(). Disabled by default, as it is called
+    from the hottest paths of names.py. start_profiling() enables it'''
+    global count
+    count = _count if enabled else _ignore
+
+def is_counting():
+    return count is _count
+
+@contextmanager
+def timing(key):
+    wall, cpu = perf_counter(), process_time()
+    try:
+        yield
+    finally:
+        add(key, calls=1, wall=perf_counter()-wall, cpu=process_time()-cpu)
+
+def timed(key):
+    '''Decorator accounting calls and wall/CPU time of a function'''
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with timing(key):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_download(download):
+    '''Wraps a Dataset.download implementation. A call whose returned file
+    was not modified during the call counts as a cache hit.'''
+    @wraps(download)
+    def wrapper(self, *args, **kwargs):
+        start, key = datetime.now().timestamp(), f'download:{self}'
+        with timing(key):
+            path = download(self, *args, **kwargs)
+        try:
+            st = os.stat(path)
+            if st.st_mtime < start:
+                add(key, cache_hits=1)
+            else:
+                add(key, bytes_out=st.st_size)
+        except (OSError, TypeError):
+            pass
+        return path
+    return wrapper
+
+class CountingDictReader(csv.DictReader):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows = 0
+
+    def __next__(self):
+        row = super().__next__()
+        self.rows += 1
+        return row
+
+class CountingDictWriter(csv.DictWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows = 0
+
+    def writeheader(self):
+        rows = self.rows
+        result = super().writeheader()
+        self.rows = rows
+        return result
+
+    def writerow(self, rowdict):
+        self.rows += 1
+        return super().writerow(rowdict)
+
+    def writerows(self, rowdicts):
+        for row in rowdicts:
+            self.writerow(row)
+
+def position(f):
+    '''Uncompressed byte offset of a text file object, or 0 if unknown'''
+    try:
+        if f.writable():
+            f.flush()
+        return f.buffer.tell()
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+def report():
+    '''Returns all entries as a JSON-serializable dict'''
+    with _LOCK:
+        entries = {k: dict(v) for k, v in STATS.items()}
+        for counts in _THREAD_COUNTS:
+            for k, v in counts.copy().items(): # owner may be counting
+                entries.setdefault(k, dict.fromkeys(FIELDS, 0))['calls'] += v
+    return {'started': STARTED.isoformat(timespec='seconds'),
+            'finished': datetime.now().isoformat(timespec='seconds'),
+            'entries': entries, **EXTRA}
+
+def dump_json(filepath):
+    with open(filepath+'.tmp', 'w', encoding='utf-8') as f:
+        json.dump(report(), f, indent=2)
+    os.replace(filepath+'.tmp', filepath)
+    return filepath
+
+def _fmt_bytes(n):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if n < 1024 or unit == 'GiB':
+            return f'{n:.0f}{unit}' if unit == 'B' else f'{n:.1f}{unit}'
+        n /= 1024
+
+def print_report(file=sys.stdout):
+    entries = report()['entries']
+    print(f'{"entry":40} {"calls":>9} {"wall s":>9} {"cpu s":>9} ' + \
+          f'{"rows in":>9} {"rows out":>9} {"in":>9} {"out":>9} ' + \
+          f'{"hits":>6}', file=file)
+    for k in sorted(entries, key=lambda k: -entries[k]['wall']):
+        e = entries[k]
+        print(f'{k[:40]:40} {e["calls"]:9} {e["wall"]:9.2f} ' + \
+              f'{e["cpu"]:9.2f} {e["rows_in"]:9} {e["rows_out"]:9} ' + \
+              f'{_fmt_bytes(e["bytes_in"]):>9} ' + \
+              f'{_fmt_bytes(e["bytes_out"]):>9} {e["cache_hits"]:6}',
+              file=file)
+    if 'profile' in EXTRA:
+        prof = EXTRA['profile']
+        print(f'\nProfiled functions ({prof["samples"]} stack samples in ' + \
+              f'{prof["stacks"]}):', file=file)
+        for k, e in sorted(prof['functions'].items(),
+                           key=lambda p: -p[1]['est_wall']):
+            print(f'{k[:60]:60} {e["calls"]:11} calls ' + \
+                  f'~{e["est_wall"]:9.2f} s', file=file)
+
+
+PROFILE_ENV = 'PPGCC_PROFILE'
+PROFILE_TARGETS = ['ppgcc_metrics.names:canon_name',
+                   'ppgcc_metrics.names:safe_distance',
+                   'ppgcc_metrics.names:is_author',
+                   'ppgcc_metrics.derived:AugmentedDiscentes.get_works',
+                   'ppgcc_metrics.datasets:DiscentesCAPGCNPJ._match_student']
+PROFILE = defaultdict(lambda: [0, 0, 0.0]) # key -> [calls, sampled, wall]
+_THREAD_PROFILE = [] # (key, stats) of each thread, merged by stop_profiling()
+_profiling = None
+
+def _resolve(target):
+    module, attr = target.split(':')
+    owner = importlib.import_module(module)
+    path = attr.split('.')
+    for name in path[:-1]:
+        owner = getattr(owner, name)
+    return owner, path[-1]
+
+def _profiled(f, key, sample_every):
+    local = threading.local() # each thread counts without locking
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            stats = local.stats
+        except AttributeError:
+            stats = local.stats = [0, 0, 0.0]
+            with _LOCK:
+                _THREAD_PROFILE.append((key, stats))
+        stats[0] += 1
+        if stats[0] % sample_every:
+            return f(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            stats[1] += 1
+            stats[2] += perf_counter() - start
+    wrapper.__profiled__ = f
+    return wrapper
+
+# leaf frames of threads waiting for work, whose stacks are not sampled
+_IDLE_FRAMES = {('threading.py', 'wait'), ('thread.py', '_worker'),
+                ('queue.py', 'get'), ('selectors.py', 'select')}
+
+class _StackSampler(threading.Thread):
+    '''Samples the stacks of all threads but idle ones. Each stack is
+    rooted at the name of its thread. Process workers (e.g., canon_maps
+    with workers=N) are not sampled'''
+    def __init__(self, interval):
+        super().__init__(name='ppgcc-stack-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def _sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident or frame == None:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename),
+                    code.co_name) in _IDLE_FRAMES:
+                continue
+            stack = []
+            while frame != None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ' + \
+                             f'({os.path.basename(code.co_filename)}' + \
+                             f':{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}'))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+def start_profiling(interval=0.005, sample_every=64, targets=PROFILE_TARGETS):
+    '''Wraps the functions in targets ('module:attr.path') with call
+    counters that time one in every sample_every calls and starts sampling
+    the stacks of all busy threads every interval seconds. Also enables
+    count(). Functions run in process workers are neither counted nor
+    sampled.'''
+    global _profiling
+    if _profiling != None:
+        return
+    set_counting(True)
+    patched = []
+    for target in targets:
+        owner, name = _resolve(target)
+        f = owner.__dict__[name]
+        setattr(owner, name, _profiled(f, target, sample_every))
+        patched.append((owner, name, f))
+    sampler = _StackSampler(interval)
+    sampler.start()
+    _profiling = (patched, sampler)
+
+def is_profiling():
+    return _profiling != None
+
+def stop_profiling(directory='data'):
+    '''Restores the wrapped functions, writes the sampled stacks in
+    collapsed format (one "root;...;leaf count" line per stack, as read by
+    flamegraph.pl and speedscope) and attaches the profile to report().
+    Disables count(), keeping what was counted. Returns the path of the
+    collapsed stacks file.'''
+    global _profiling
+    if _profiling == None:
+        return None
+    patched, sampler = _profiling
+    _profiling = None
+    set_counting(False)
+    for owner, name, f in reversed(patched):
+        setattr(owner, name, f)
+    sampler.stopped.set()
+    sampler.join()
+    with _LOCK:
+        for key, stats in _THREAD_PROFILE:
+            total = PROFILE[key]
+            for i, v in enumerate(stats):
+                total[i] += v
+        _THREAD_PROFILE.clear()
+    os.makedirs(directory, exist_ok=True)
+    filepath = os.path.join(directory,
+                            f'profile-{datetime.now():%Y%m%d-%H%M%S}.folded')
+    with open(filepath, 'w', encoding='utf-8') as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    functions = dict()
+    for key, (calls, sampled, wall) in PROFILE.items():
+        functions[key] = {'calls': calls, 'sampled': sampled,
+                          'est_wall': wall * calls / sampled if sampled else 0.0}
+    EXTRA['profile'] = {'stacks': filepath, 'interval': sampler.interval,
+                        'samples': sum(sampler.stacks.values()),
+                        'functions': functions}
+    return filepath
+
+def profiling_from_env():
+    '''Starts profiling if the PPGCC_PROFILE environment variable is set
+    to a non-empty value other than 0. A numeric value other than 1 is used
+    as the sampling interval in milliseconds.'''
+    value = os.environ.get(PROFILE_ENV, '').strip()
+    if value in ['', '0']:
+        return False
+    try:
+        ms = float(value)
+        start_profiling(**({'interval': ms/1000} if ms != 1 else {}))
+    except ValueError:
+        start_profiling()
+    return True
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''Memory-mapped scanning of uncompressed CSV files.
+
+Record boundaries and fields are found on the raw bytes of the mapped file:
+lines without quotes are split at the delimiter without decoding, only lines
+with quotes go through the csv module. Records spanning several lines are
+joined following the quoting rules of the default csv dialect, so a quote in
+the middle of an unquoted field is kept as a literal, as csv does. Fields
+are decoded when accessed. This relies on the delimiter being ASCII and the
+encoding being ASCII-compatible (UTF-8, ISO-8859-1), which holds for every
+dataset in this repository.
+'''
+import csv
+
+_BOM = b'\xef\xbb\xbf'
+_QUOTE = ord('"')
+
+def _in_quotes(line, delim):
+    '''True if line ends inside a quoted field, following the rules of the
+    default csv dialect: a quote only opens a quoted field at the start of
+    the field (elsewhere it is literal) and "" inside it is a quote'''
+    quoted, closing, at_start = False, False, True
+    for c in line:
+        if quoted:
+            if c == _QUOTE:
+                quoted, closing = False, True
+        elif closing and c == _QUOTE:
+            quoted, closing = True, False
+        else:
+            closing = False
+            if c == delim:
+                at_start = True
+            elif c == _QUOTE and at_start:
+                quoted, at_start = True, False
+            else:
+                at_start = False
+    return quoted
+
+class ScanRow:
+    '''Row yielded by Scanner. Supports the read-only part of the dict
+    interface of csv.DictReader rows: r['field'] (None for fields missing
+    from a short row), get(), `in`, keys(), values(), items() and len()'''
+    __slots__ = ('_index', '_values', '_encoding')
+
+    def __init__(self, index, values, encoding):
+        self._index = index
+        self._values = values
+        self._encoding = encoding
+
+    def _value(self, i):
+        if i >= len(self._values):
+            return None
+        v = self._values[i]
+        if type(v) is bytes:
+            v = self._values[i] = v.decode(self._encoding)
+        return v
+
+    def __getitem__(self, key):
+        return self._value(self._index[key])
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i == None else self._value(i)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def values(self):
+        return [self._value(i) for i in self._index.values()]
+
+    def items(self):
+        return [(k, self._value(i)) for k, i in self._index.items()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (ScanRow, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f'ScanRow({self.to_dict()!r})'
+
+class Scanner:
+    '''Iterates over the rows of source, a mmap or, as a fallback for
+    compressed files, a text file opened with newline=''. Yields ScanRow
+    objects or, if columns is given, tuples with the decoded values of these
+    columns only. where is a list of (columns, test) pairs: rows are only
+    yielded if every test(*values) holds for the decoded values of its
+    columns, which are decoded before (and instead of) the rest of the row.
+    close() closes source'''
+    def __init__(self, source, delimiter=',', encoding='utf-8', columns=None,
+                 where=None):
+        self.source = source
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.rows = 0
+        self.pos = 0
+        if isinstance(source, (bytes, bytearray)) or hasattr(source, 'find'):
+            self._raw = self._mapped()
+        else:
+            self._raw = csv.reader(source, delimiter=delimiter)
+        header = next(self._raw, None) or []
+        self.fieldnames = [self._decode(f) for f in header]
+        if self.fieldnames and self.fieldnames[0].startswith('\ufeff'):
+            self.fieldnames[0] = self.fieldnames[0][1:]
+        self._index = {f: i for i, f in enumerate(self.fieldnames)}
+        self.columns = None
+        if columns != None:
+            self.columns = [self._index[c] for c in columns]
+        self.where = [([self._index[c] for c in cols], test) \
+                      for cols, test in (where or [])]
+
+    def _decode(self, v):
+        return v.decode(self.encoding) if type(v) is bytes else v
+
+    def _mapped(self):
+        mm, size = self.source, len(self.source)
+        find, delim = mm.find, self.delimiter.encode('ascii')
+        if mm[:3] == _BOM:
+            self.pos = 3
+        while self.pos < size:
+            start = self.pos
+            end = find(b'\n', start)
+            end = size if end < 0 else end
+            line = mm[start:end]
+            if b'"' in line:
+                while end < size and _in_quotes(line, delim[0]):
+                    end = find(b'\n', end + 1)
+                    end = size if end < 0 else end
+                    line = mm[start:end]
+                self.pos = end + 1
+                yield next(csv.reader([line.decode(self.encoding)],
+                                      delimiter=self.delimiter), [])
+                continue
+            self.pos = end + 1
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            yield line.split(delim) if line else []
+
+    def __iter__(self):
+        return self
+
+    def _accepts(self, values):
+        n = len(values)
+        for indices, test in self.where:
+            if not test(*[self._decode(values[i]) if i < n else None \
+                          for i in indices]):
+                return False
+        return True
+
+    def __next__(self):
+        values = next(self._raw)
+        while True:
+            if values != []:
+                self.rows += 1
+                if not self.where or self._accepts(values):
+                    break
+            values = next(self._raw)
+        if self.columns != None:
+            n = len(values)
+            return tuple(self._decode(values[i]) if i < n else None \
+                         for i in self.columns)
+        return ScanRow(self._index, values, self.encoding)
+
+    def close(self):
+        if hasattr(self.source, 'close'):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
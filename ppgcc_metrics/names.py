@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 import re
+import os
+import csv
+import threading
 from unidecode import unidecode
-from itertools import product, chain, cycle
+from itertools import product, chain, cycle, combinations
 from Levenshtein import distance
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from ppgcc_metrics import instrument
 
 RX_SPACE = re.compile(r'  +')
 RX_DOT = re.compile(r'\.\s*$')
@@ -13,7 +19,38 @@ def clean_name(name):
         return None
     return RX_SPACE.sub(' ', unidecode(name.strip()).upper())
 
-def safe_distance(a, b):
+def _banded_distance(a, b, k):
+    '''Levenshtein distance between a and b if it is at most k, else k+1.
+    Only cells within k of the diagonal are computed and rows stop as soon
+    as all of them exceed k'''
+    if abs(len(a) - len(b)) > k:
+        return k + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        lo, hi = max(1, i - k), min(len(b), i + k)
+        cur = [i] + [k + 1] * len(b)
+        for j in range(lo, hi + 1):
+            cur[j] = min(prev[j] + 1, cur[j-1] + 1,
+                         prev[j-1] + (ca != b[j-1]))
+        if min(cur[lo-1:hi+1]) > k:
+            return k + 1
+        prev = cur
+    return min(prev[-1], k + 1)
+
+try:
+    distance('ab', 'b', score_cutoff=1)
+    def bounded_distance(a, b, k):
+        '''Levenshtein distance between a and b if it is at most k, else
+        k+1'''
+        if abs(len(a) - len(b)) > k:
+            return k + 1
+        return distance(a, b, score_cutoff=k)
+except TypeError: # python-Levenshtein < 0.21 has no score_cutoff
+    bounded_distance = _banded_distance
+
+def safe_distance(a, b, max_distance=None):
+    '''Distance between name tokens. If max_distance is given, any distance
+    larger than it may be reported as max_distance+1'''
     a = RX_DOT.sub('', a)
     b = RX_DOT.sub('', b)
     if a == b:
@@ -26,8 +63,16 @@ def safe_distance(a, b):
         return 0
     if len(a) < 3 or len(b) < 3:
         return max(len(a), len(b)) + 1
+    if max_distance != None:
+        return bounded_distance(a, b, max_distance)
     return distance(a, b)
 
+@lru_cache(maxsize=1 << 16)
+def _close(a, b, max_distance):
+    '''safe_distance(a, b) <= max_distance, memoized: the same token pairs
+    are compared over and over by canon_name()'''
+    return safe_distance(a, b, max_distance) <= max_distance
+
 def _subsplit(string, outer_sep, inner_sep, keep_inner='LEFT'):
     result = []
     for outer in string.split(outer_sep):
@@ -57,21 +102,20 @@ def canon_name(x, y, levenshtein=0, levenshtein_last=None,
       - super_compact: Read JP Doe as J. P. Doe
       - large_last: Only apply levenshtein_last if last name is larger than this
     '''
+    instrument.count('names.canon_name')
     if x == None or y == None:
         return None
-    if super_compact:
-        x, y = _parse_super_compact(x), _parse_super_compact(y)
-    x = _subsplit(clean_name(x), ' ', '.', keep_inner='LEFT')
-    y = _subsplit(clean_name(y), ' ', '.', keep_inner='LEFT')
+    x, y = list(_name_tokens(x, super_compact)), \
+           list(_name_tokens(y, super_compact))
     if len(x) == 0 or len(y) == 0:
         return None
     if levenshtein_last == None:
         levenshtein_last = levenshtein
     if max(len(x[-1]), len(y[-1])) >= large_last:
         levenshtein_last += 1
-    if safe_distance(x[-1], y[-1]) > levenshtein_last:
+    if not _close(x[-1], y[-1], levenshtein_last):
         return None
-    if safe_distance(x[0], y[0]) > levenshtein:
+    if not _close(x[0], y[0], levenshtein):
         return None
     if len(RX_DOT.sub('', x[0])) == 1 and len(y[0]) > 1:
         x[0] = y[0]
@@ -83,14 +127,14 @@ def canon_name(x, y, levenshtein=0, levenshtein_last=None,
         return ' '.join(x)
     sub = x[1:-1]
     for middle_name in y[1:-1]:
-        ms = list(map(lambda x: safe_distance(x, middle_name) <= levenshtein, sub))
+        ms = list(map(lambda x: _close(x, middle_name, levenshtein), sub))
         if True not in ms:
             return None
         else:
             sub = sub[ms.index(True)+1:]
     sub = y[1:-1]
     for i in range(1, len(x)-1):
-        ms = list(map(lambda u: safe_distance(u, x[i]) <= levenshtein, sub))
+        ms = list(map(lambda u: _close(u, x[i], levenshtein), sub))
         if True in ms:
             cand_y = sub[ms.index(True)]
             if len(RX_DOT.sub('', x[i])) == 1 and len(cand_y) > 1:
@@ -98,9 +142,137 @@ def canon_name(x, y, levenshtein=0, levenshtein_last=None,
             sub = sub[ms.index(True)+1:]
     return ' '.join(x)
     
+def _registry_applies(kwargs):
+    '''The registry holds decisions for the default tolerance of
+    canon_name(). Callers asking for another one get fuzzy matching'''
+    return kwargs.get('levenshtein', 0) == 0 and \
+           kwargs.get('levenshtein_last') in [None, 0] and \
+           kwargs.get('large_last', 7) == 7
+
 def same_name(*args, **kwargs):
+    instrument.count('names.same_name')
+    if REGISTRY != None and len(args) == 2 and _registry_applies(kwargs):
+        known = REGISTRY.same(*args, kwargs.get('super_compact', False))
+        if known != None:
+            instrument.count('names.registry_hits')
+            return known
     return canon_name(*args, **kwargs) != None
 
+@lru_cache(maxsize=1 << 16)
+def _name_tokens(name, super_compact=False):
+    '''Tuple of cleaned tokens of name. Memoized, as the same names are
+    compared against many others'''
+    if super_compact:
+        name = _parse_super_compact(name)
+    return tuple(_subsplit(clean_name(name), ' ', '.', keep_inner='LEFT'))
+
+def _deletions(string, depth):
+    result, frontier = {string}, {string}
+    for i in range(depth):
+        frontier = {x[:j] + x[j+1:] for x in frontier for j in range(len(x))}
+        result |= frontier
+    return result
+
+class NameIndex:
+    '''Candidate index for repeated same_name() lookups against a fixed
+    set of names.
+
+    Names are blocked by last name (and by first initial when
+    levenshtein=0). Last names are indexed under their deletion
+    neighbourhood, so the last-name typos tolerated by canon_name() never
+    split a match across blocks. find() only calls same_name() on the few
+    names sharing a block with the queried name.
+
+    Named arguments are the same as canon_name().
+    '''
+    def __init__(self, levenshtein=0, levenshtein_last=None,
+                 super_compact=False, large_last=7, **ignored):
+        self.kwargs = {'levenshtein': levenshtein,
+                       'levenshtein_last': levenshtein_last,
+                       'super_compact': super_compact,
+                       'large_last': large_last}
+        self.lev_last = levenshtein if levenshtein_last == None \
+                                    else levenshtein_last
+        self.entries = []
+        self.blocks = dict()
+
+    def _keys(self, name, probe):
+        tokens = _name_tokens(name, self.kwargs['super_compact']) \
+                 if name != None else []
+        if len(tokens) == 0:
+            return []
+        last, first = RX_DOT.sub('', tokens[-1]), RX_DOT.sub('', tokens[0])
+        first = first[:1] if self.kwargs['levenshtein'] == 0 else None
+        tol = self.lev_last + 1
+        large = len(tokens[-1]) + 1 >= self.kwargs['large_last'] - tol
+        lasts = _deletions(last, tol if large else self.lev_last)
+        if len(last) == 1:
+            lasts.add(('*' if probe else '^') + last)
+        elif len(last) > 3:
+            lasts.add(('^' if probe else '*') + last[0])
+        return [(l, first) for l in lasts]
+
+    def add(self, name, value=None, group=None):
+        idx = len(self.entries)
+        self.entries.append((name, name if value == None else value))
+        for k in self._keys(name, False):
+            self.blocks.setdefault((group, k), []).append(idx)
+
+    def candidates(self, name, group=None):
+        idxs = set()
+        for k in self._keys(name, True):
+            idxs.update(self.blocks.get((group, k), []))
+        return [self.entries[i] for i in sorted(idxs)]
+
+    def find(self, name, group=None):
+        '''Values of all indexed names in group for which same_name()
+        holds, in insertion order'''
+        return [v for n, v in self.candidates(name, group) \
+                if same_name(n, name, **self.kwargs)]
+
+def match_many(a, b, use_registry=True, **kwargs):
+    '''Match relation between the names of a and of b: a dict from every
+    distinct name x in a to a dict from every name y in b for which
+    canon_name(x, y, **kwargs) is not None to that canonical name.
+
+    Gives the same result as calling canon_name() on all pairs, but names
+    with the same tokens after cleaning are compared only once, and only
+    pairs sharing a NameIndex block are compared. As in same_name(), if
+    use_registry and both names are in the REGISTRY, they match only if
+    they are the same person (the canonical name is then the longest)'''
+    super_compact = kwargs.get('super_compact', False)
+    def by_tokens(names):
+        groups = dict()
+        for nm in dict.fromkeys(names):
+            tokens = _name_tokens(nm, super_compact) if nm != None else []
+            if tokens:
+                groups.setdefault(tuple(tokens), []).append(nm)
+        return groups
+    registry = REGISTRY if use_registry and _registry_applies(kwargs) \
+               else None
+    result = {x: dict() for x in a}
+    index, people = NameIndex(**kwargs), dict()
+    for ys in by_tokens(b).values():
+        index.add(ys[0], ys)
+        p = None if registry == None else registry.person(ys[0], super_compact)
+        if p != None:
+            people.setdefault(p, []).append(ys)
+    for xs in by_tokens(a).values():
+        p = None if registry == None else registry.person(xs[0], super_compact)
+        for y, ys in index.candidates(xs[0]):
+            if p != None and registry.person(y, super_compact) != None:
+                continue # decided by the registry, below
+            c = canon_name(xs[0], y, **kwargs)
+            if c != None:
+                for x in xs:
+                    result[x].update(dict.fromkeys(ys, c))
+        for ys in people.get(p, []) if p != None else []:
+            c = canon_name(xs[0], ys[0], **kwargs) or \
+                _variant(max(xs[0], ys[0], key=len), super_compact)
+            for x in xs:
+                result[x].update(dict.fromkeys(ys, c))
+    return result
+
 
 def parse_authors(author_list, sep=';', order=',', **ignored):
     '''Get a list of author names in FIRST_FIRST order from a string
@@ -132,6 +304,7 @@ def parse_authors(author_list, sep=';', order=',', **ignored):
                 result.append(parts[1] + ' ' + parts[0])
     return result
 
+@instrument.timed('names.is_author')
 def is_author(name, author_list, position=None, sep=';', order=',', **kwargs):
     '''Return True if name is in the given author_list
     
@@ -160,6 +333,7 @@ def is_author(name, author_list, position=None, sep=';', order=',', **kwargs):
         cands = [cands[position]]
     return any(map(lambda c: same_name(name, c, **kwargs), cands))
 
+@instrument.timed('names.same_authors')
 def same_authors(a, b, allow_extras=False, **kwargs):
     if a == b:
         return True
@@ -172,31 +346,82 @@ def same_authors(a, b, allow_extras=False, **kwargs):
         return False
     return True
 
+@instrument.timed('names.is_in')
 def is_in(name, iterable, allow_ambiguous=True, **kwargs):
     matcher = lambda x: same_name(name, x, **kwargs)
     matches = len(list(filter(bool, map(matcher, iterable))))
     return matches == 1 or (allow_ambiguous and matches >= 1)
 
+def _match_later(a, b, executor, shards, **kwargs):
+    '''Returns a function that returns match_many(a, b, **kwargs). With an
+    executor, a is split in shards that are matched in the background'''
+    if executor == None:
+        return lambda: match_many(a, b, **kwargs)
+    a = list(a)
+    size = max(1, -(-len(a) // shards))
+    futures = [executor.submit(match_many, a[k:k+size], b, **kwargs) \
+               for k in range(0, len(a), size)]
+    return lambda: dict(chain.from_iterable(f.result().items() \
+                                            for f in futures))
+
+@instrument.timed('names.canon_maps')
 def canon_maps(*args, allow_ambiguous=False, max_levenshtein=1, 
-               max_levenshtein_last=None):
+               max_levenshtein_last=None, workers=None, executor=None):
+    '''Maps from the names of each iterable in args to the canonical name
+    they share with a name in another iterable. Matching of each set pair
+    and tier is sharded among workers processes (or executor, which is not
+    shut down). The result does not depend on the number of workers'''
     if max_levenshtein_last == None:
         max_levenshtein_last = max_levenshtein
     lev, lev_last = 0, 0
     sets = [{clean_name(y) for y in x} for x in args]
     ambiguous = set()
     maps = [dict() for x in args]
-    for lev, lev_last in product(range(max_levenshtein+1), \
-                                 range(max_levenshtein_last+1)):
+    order = [{x: k for k, x in enumerate(s)} for s in sets]
+    pool = None
+    if executor == None and workers != None and workers > 1:
+        executor = pool = ProcessPoolExecutor(workers)
+    shards = 4 * (workers or os.cpu_count() or 1)
+    tiers = list(product(range(max_levenshtein+1), \
+                         range(max_levenshtein_last+1)))
+    # submit all tiers at once, so that workers are never idle. The
+    # registry is applied to the merged maps, not within the workers
+    pending = {(t, i, j): _match_later(sets[i], list(sets[j]), executor,
+                                       shards, levenshtein=t[0],
+                                       levenshtein_last=t[1],
+                                       use_registry=False) \
+               for t in tiers for i, j in combinations(range(len(sets)), 2)}
+    try:
+        _merge_tiers(sets, tiers, pending, order, maps, ambiguous,
+                     allow_ambiguous)
+    finally:
+        if pool != None:
+            pool.shutdown(cancel_futures=True)
+    for nm, m in filter(lambda p: p[0] in p[1], product(ambiguous, maps)):
+        del m[nm]
+    if REGISTRY != None:
+        REGISTRY.apply(sets, maps)
+    return maps
+
+def _merge_tiers(sets, tiers, pending, order, maps, ambiguous,
+                 allow_ambiguous):
+    for t in tiers:
+        # matches[i, j][nm][x] == canon_name(nm, x) if i < j else
+        # canon_name(x, nm), for nm in sets[i] and x in sets[j]
+        matches = dict()
+        for i, j in combinations(range(len(sets)), 2):
+            matches[i, j] = pending.pop((t, i, j))()
+            matches[j, i] = {x: dict() for x in sets[j]}
+            for nm, xs in matches[i, j].items():
+                for x, c in xs.items():
+                    matches[j, i][x][nm] = c
         for i in range(len(sets)):
             for nm in sets[i]:
-                get_p = lambda x: (x, canon_name(nm if i < j else x, \
-                                            x  if i < j else nm, \
-                                            levenshtein=lev, \
-                                            levenshtein_last=lev_last))
                 for j in range(len(sets)):
                     if j == i:
                         continue
-                    cands = list(filter(lambda p: p[1] != None, map(get_p, sets[j])))
+                    cands = sorted(matches[i, j][nm].items(),
+                                   key=lambda p: order[j][p[0]])
                     if len(cands) == 1 and cands[0][0] != nm:
                         x, c = cands[0]
                         assert c == nm or c == x
@@ -209,31 +434,223 @@ def canon_maps(*args, allow_ambiguous=False, max_levenshtein=1,
                     if not allow_ambiguous and len(cands) > 1:
                         all_names = chain([nm], map(lambda p: p[0], cands))
                         ambiguous.add(sorted(all_names, key=len)[0])
-    for nm, m in filter(lambda p: p[0] in p[1], product(ambiguous, maps)):
-        del m[nm]
-    return maps
 
+class NameFixPlan:
+    '''Batch of fix_csv_names() calls. run() has the same effect as the
+    calls in the order they were add()ed, but reads each dataset once,
+    and rewrites each modified dataset once, applying the maps of all
+    steps to all of its columns in a single pass.'''
+    def __init__(self):
+        self.steps = []
+
+    def add(self, datasets, columns, read_only=[], **kwargs):
+        '''Adds a fix_csv_names(datasets, columns, read_only, **kwargs)
+        step'''
+        if len(datasets) !=  len(columns):
+            raise ValueError(f'fix_csv_names requires len(datasets) == len(columns)')
+        self.steps.append((list(datasets), list(columns), set(read_only),
+                           kwargs))
+        return self
+
+    @instrument.timed('names.NameFixPlan.run')
+    def run(self):
+        by_ds = dict() # id(ds) -> (ds, columns)
+        for dss, columns, _, _ in self.steps:
+            for ds, col in zip(dss, columns):
+                by_ds.setdefault(id(ds), (ds, dict()))[1][col] = None
+        values = dict() # (id(ds), col) -> distinct values, as of this step
+        for key, (ds, columns) in by_ds.items():
+            sets = {col: set() for col in columns}
+            with ds.open_csv() as reader:
+                for row in reader:
+                    for col, s in sets.items():
+                        s.add(row[col])
+            for col, s in sets.items():
+                values[key, col] = s
+        rewrites = dict() # id(ds) -> {col: [c_map, ...]}
+        for dss, columns, read_only, kwargs in self.steps:
+            keys = [(id(ds), col) for ds, col in zip(dss, columns)]
+            c_maps = canon_maps(*[values[k] for k in keys], **kwargs)
+            if REGISTRY != None:
+                REGISTRY.learn(c_maps, [f'{ds}:{col}' \
+                                        for ds, col in zip(dss, columns)],
+                               **kwargs)
+            for i, (key, c_map) in enumerate(zip(keys, c_maps)):
+                if i in read_only or not c_map:
+                    continue
+                values[key] = {c_map.get(n, n) for n in values[key]}
+                rewrites.setdefault(key[0], dict()) \
+                        .setdefault(key[1], []).append(c_map)
+        for key, col_maps in rewrites.items():
+            ds = by_ds[key][0]
+            with ds.open_csv() as reader, \
+                 ds.replace_csv(fieldnames=reader.fieldnames) as writer:
+                for row in reader:
+                    for col, c_maps in col_maps.items():
+                        n = row[col]
+                        for c_map in c_maps:
+                            n = c_map.get(n, n)
+                        row[col] = n
+                    writer.writerow(row)
+        if REGISTRY != None:
+            REGISTRY.save()
+
+@instrument.timed('names.fix_csv_names')
 def fix_csv_names(datasets, columns, read_only=[], **kwargs):
-    if len(datasets) !=  len(columns):
-        raise ValueError(f'fix_csv_names requires len(datasets) == len(columns)')
-    sets = []
-    for ds, col in zip(datasets, columns):
-        with ds.open_csv() as reader:
-            sets.append({row[col] for row in reader})
-    c_maps = canon_maps(*sets, **kwargs)
-    del sets
-    in_datasets = datasets
-    if read_only != []:
-        datasets = list(datasets)
-        columns = list(columns)
-    for i in sorted(read_only, reverse=True):
-        del datasets[i]
-        del columns[i]
-        del c_maps[i]
-    for ds, col, c_map in zip(datasets, columns, c_maps):
-        with ds.replace_csv() as writer, ds.open_csv() as reader:
-            for row in reader:
-                n = row[col]
-                row[col] = c_map[n] if n in c_map else n
-                writer.writerow(row)
-    return in_datasets
+    NameFixPlan().add(datasets, columns, read_only, **kwargs).run()
+    return datasets
+
+REGISTRY_FILE = os.path.join('data', 'identities.csv')
+REGISTRY = None
+
+def _variant(name, super_compact=False):
+    if name == None:
+        return None
+    return ' '.join(_name_tokens(name, super_compact)) or None
+
+class IdentityRegistry:
+    '''Persistent map from name variants to person ids, stored as a CSV
+    with columns person, variant, source and manual.
+
+    Variants are stored as the tokens canon_name() compares ('J.P. Doe'
+    and, with super_compact, 'JP Doe' are both 'J. P. DOE'), so a single
+    registry serves all sources and AUTHORS_FMTs. Person ids are the most
+    complete variant seen when the person was first registered. learn()
+    adds the matches found by canon_maps(); rows with manual set (edited
+    by hand or by assign()) are never changed by learn().
+    '''
+    FIELDS = ['person', 'variant', 'source', 'manual']
+
+    def __init__(self, filepath=REGISTRY_FILE):
+        self.filepath = filepath
+        self.rows = dict() # variant -> row dict
+        self.dirty = False
+        self.lock = threading.Lock()
+        if os.path.isfile(filepath):
+            with open(filepath, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f):
+                    self.rows[row['variant']] = row
+
+    def person(self, name, super_compact=False):
+        '''Person id of name, or None if unknown'''
+        row = self.rows.get(_variant(name, super_compact))
+        return None if row == None else row['person']
+
+    def same(self, a, b, super_compact=False):
+        '''True or False if a and b are both registered, else None'''
+        pa = self.person(a, super_compact)
+        if pa == None:
+            return None
+        pb = self.person(b, super_compact)
+        return None if pb == None else pa == pb
+
+    def _put(self, variant, person, source, manual):
+        old = self.rows.get(variant)
+        if old != None and old['manual'] and not manual:
+            return
+        self.rows[variant] = {'person': person, 'variant': variant,
+                              'source': source if old == None \
+                                        else old['source'],
+                              'manual': '1' if manual else ''}
+        self.dirty = True
+
+    def assign(self, name, person, source='', super_compact=False):
+        '''Manually assigns name to person (a name or person id). Use
+        assign(x, x) to keep x apart from the people it was matched to'''
+        person_id = self.person(person) or _variant(person)
+        with self.lock:
+            self._put(_variant(name, super_compact), person_id, source, True)
+            if person_id not in self.rows:
+                self._put(person_id, person_id, source, True)
+
+    def learn(self, maps, sources=None, max_levenshtein=1,
+              max_levenshtein_last=None, **ignored):
+        '''Registers the matches of canon_maps() (maps from each name to
+        its canonical name), called with the given tolerances. Names
+        already registered to different people are left as they are. A
+        name matched to a registered one is only added to its person if it
+        also matches the person id within these tolerances, without adding
+        names to it, so that chains (JOAO DOE ~ JOAO PEDRO DOE ~ JOAO PAULO
+        DOE) do not merge different people'''
+        sources = sources or [''] * len(maps)
+        if max_levenshtein_last == None:
+            max_levenshtein_last = max_levenshtein
+        def matches(name, person):
+            for lev, lev_last in product(range(max_levenshtein+1),
+                                         range(max_levenshtein_last+1)):
+                c = canon_name(name, person, levenshtein=lev,
+                               levenshtein_last=lev_last)
+                if c != None and len(c.split(' ')) <= len(person.split(' ')):
+                    return True
+            return False
+        with self.lock:
+            for m, source in zip(maps, sources):
+                for name, canon in m.items():
+                    x, c = _variant(name), _variant(canon)
+                    if x == None or c == None:
+                        continue
+                    px, pc = self.person(x), self.person(c)
+                    if px == None and pc == None:
+                        self._put(c, c, source, False)
+                        self._put(x, c, source, False)
+                    elif px == None:
+                        if matches(x, pc):
+                            self._put(x, pc, source, False)
+                    elif pc == None:
+                        if matches(c, px):
+                            self._put(c, px, source, False)
+
+    def apply(self, sets, maps):
+        '''Applies registered decisions to the result of canon_maps() over
+        sets: drops mappings between names of different people and maps
+        registered names to their person id if it is a name in another
+        set'''
+        for m in maps:
+            for name, canon in list(m.items()):
+                if self.same(name, canon) == False:
+                    del m[name]
+        for i, (names, m) in enumerate(zip(sets, maps)):
+            others = set().union(*[s for j, s in enumerate(sets) if j != i])
+            for name in names:
+                p = self.person(name)
+                if p != None and p != name and name not in m and p in others:
+                    m[name] = p
+
+    def save(self):
+        '''Writes the registry, if changed since loaded'''
+        with self.lock:
+            if not self.dirty:
+                return self.filepath
+            directory = os.path.dirname(self.filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.filepath+'.tmp', 'w', encoding='utf-8',
+                      newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                writer.writeheader()
+                for variant in sorted(self.rows):
+                    writer.writerow(self.rows[variant])
+            os.replace(self.filepath+'.tmp', self.filepath)
+            self.dirty = False
+        return self.filepath
+
+def use_registry(registry=REGISTRY_FILE):
+    '''Makes same_name(), match_many(), canon_maps() and NameFixPlan consult
+    (and learn into) registry, an IdentityRegistry or the path of one. None
+    disables the registry. Returns the registry'''
+    global REGISTRY
+    if isinstance(registry, str):
+        registry = IdentityRegistry(registry)
+    REGISTRY = registry
+    return registry
+
+REGISTRY_ENV = 'PPGCC_REGISTRY'
+
+def registry_from_env():
+    '''Uses the registry at REGISTRY_FILE (as run.py and the shell do)
+    unless the PPGCC_REGISTRY environment variable is 0. Values other than
+    1 are used as the path of the registry. Returns the registry or None'''
+    value = os.environ.get(REGISTRY_ENV, '').strip()
+    if value == '0':
+        return use_registry(None)
+    return use_registry(REGISTRY_FILE if value in ['', '1'] else value)
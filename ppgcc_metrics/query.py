@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+'''Lazy queries over the rows of a Dataset.
+
+A Query is built by chaining where(), select(), group_by() and limit() on
+Dataset.query(). Nothing is read until the query is iterated. Predicates
+given to where() before group_by() and the columns they and the rest of the
+query need are pushed into Dataset.scan(): only these columns are decoded,
+and the projected columns of rejected rows are never decoded at all.
+
+    q = ds.SUC_DISCENTES_PPGCC.query() \\
+          .where(DS_GRAU_ACADEMICO_DISCENTE='MESTRADO') \\
+          .where(lambda y: int(y) >= 2017, 'AN_BASE') \\
+          .group_by('AN_BASE', n=Count(), orientadores=CountDistinct(
+                    'NM_ORIENTADOR_PRINCIPAL'))
+    for row in q:
+        print(row['AN_BASE'], row['n'], row['orientadores'])
+
+Values are strings, as in csv.DictReader rows.
+'''
+from itertools import islice
+
+def _number(v):
+    try:
+        return int(v)
+    except ValueError:
+        return float(v)
+
+class Aggregate:
+    '''Base of the aggregates given to Query.group_by(). Values of column
+    are given to convert, if set, before step(); None and empty values
+    are skipped'''
+    def __init__(self, column=None, convert=None):
+        self.column = column
+        self.convert = convert
+
+    def start(self):
+        return None
+
+    def step(self, acc, value):
+        return value
+
+    def finish(self, acc):
+        return acc
+
+class Count(Aggregate):
+    '''Number of rows or, if column is given, of non-empty values'''
+    def start(self):
+        return 0
+
+    def step(self, acc, value):
+        return acc + 1
+
+class Sum(Aggregate):
+    '''Sum of the values of column, converted to numbers by default'''
+    def __init__(self, column, convert=_number):
+        super().__init__(column, convert)
+
+    def start(self):
+        return 0
+
+    def step(self, acc, value):
+        return acc + value
+
+class Min(Aggregate):
+    def step(self, acc, value):
+        return value if acc == None or value < acc else acc
+
+class Max(Aggregate):
+    def step(self, acc, value):
+        return value if acc == None or value > acc else acc
+
+class CountDistinct(Aggregate):
+    def start(self):
+        return set()
+
+    def step(self, acc, value):
+        acc.add(value)
+        return acc
+
+    def finish(self, acc):
+        return len(acc)
+
+class Collect(Aggregate):
+    '''List of the values of column, in input order'''
+    def start(self):
+        return []
+
+    def step(self, acc, value):
+        acc.append(value)
+        return acc
+
+def _test(value, as_str):
+    if callable(value):
+        return value
+    if isinstance(value, (set, frozenset, list, tuple)):
+        values = frozenset(map(str, value) if as_str else value)
+        return lambda v: v in values
+    value = str(value) if as_str else value
+    return lambda v: v == value
+
+def _filters(function, columns, equals, as_str):
+    filters = []
+    if function != None:
+        if not columns:
+            raise ValueError('where(function) needs the columns it receives')
+        filters.append((tuple(columns), function))
+    elif columns:
+        raise ValueError('where() got columns without a function')
+    for column, value in equals.items():
+        filters.append(((column,), _test(value, as_str)))
+    return filters
+
+def _having(rows, cols, test):
+    for r in rows:
+        if test(*[r[c] for c in cols]):
+            yield r
+
+class Query:
+    '''Lazy, immutable query: every method returns a new Query. Iterating
+    yields dicts with the selected columns (all columns by default) or,
+    after group_by(), with the group keys and the aggregates'''
+    def __init__(self, dataset, **kwargs):
+        self.dataset = dataset
+        self.kwargs = kwargs
+        self._where = []
+        self._select = None
+        self._group = None
+        self._having = []
+        self._post_select = None
+        self._limit = None
+
+    def _copy(self, **changes):
+        q = Query.__new__(Query)
+        q.__dict__.update(self.__dict__)
+        q.__dict__.update(changes)
+        return q
+
+    def where(self, function=None, *columns, **equals):
+        '''Keeps rows for which function(*values of columns) is true and
+        whose columns given as keywords are equal to the value (compared as
+        a string), belong to it (a set, list or tuple) or satisfy it (a
+        callable). After group_by(), filters the groups and values are
+        compared as they are'''
+        grouped = self._group != None
+        filters = _filters(function, columns, equals, not grouped)
+        if grouped:
+            return self._copy(_having=self._having + filters)
+        return self._copy(_where=self._where + filters)
+
+    def select(self, *columns):
+        '''Keeps only the given columns, in this order'''
+        if self._group != None:
+            return self._copy(_post_select=list(columns))
+        return self._copy(_select=list(columns))
+
+    def group_by(self, *keys, **aggregates):
+        '''Groups rows by the values of keys and computes the given
+        aggregates for each group (a Count() named "count" if none). Groups
+        are yielded in order of first appearance'''
+        if self._group != None:
+            raise ValueError('Query is already grouped')
+        if not aggregates:
+            aggregates = {'count': Count()}
+        for name in aggregates:
+            if name in keys:
+                raise ValueError(f'Aggregate {name} clashes with a key')
+        return self._copy(_group=(list(keys), aggregates))
+
+    def limit(self, n):
+        '''Stops after n results'''
+        return self._copy(_limit=n if self._limit == None \
+                                   else min(n, self._limit))
+
+    def columns(self):
+        '''Columns read from the dataset, or None for all of them'''
+        if self._group != None:
+            keys, aggregates = self._group
+            used = keys + [a.column for a in aggregates.values() \
+                           if a.column != None]
+        elif self._select != None:
+            used = self._select
+        else:
+            return None
+        for cols, _ in self._where:
+            used = used + list(cols)
+        return list(dict.fromkeys(used))
+
+    def _scanned(self):
+        columns = self.columns()
+        with self.dataset.scan(columns=columns, where=self._where,
+                               **self.kwargs) as rows:
+            if columns == None:
+                for r in rows:
+                    yield r.to_dict()
+                return
+            names = self._select if self._group == None else columns
+            idx = [columns.index(c) for c in names]
+            for t in rows:
+                yield {c: t[i] for c, i in zip(names, idx)}
+
+    def _grouped(self, rows):
+        keys, aggregates = self._group
+        aggregates = list(aggregates.items())
+        groups = dict()
+        for r in rows:
+            key = tuple(r[k] for k in keys)
+            accs = groups.get(key)
+            if accs == None:
+                accs = groups[key] = [a.start() for _, a in aggregates]
+            for i, (_, a) in enumerate(aggregates):
+                if a.column != None:
+                    v = r[a.column]
+                    if v == None or v == '':
+                        continue
+                    if a.convert != None:
+                        v = a.convert(v)
+                else:
+                    v = r
+                accs[i] = a.step(accs[i], v)
+        for key, accs in groups.items():
+            out = dict(zip(keys, key))
+            for (name, a), acc in zip(aggregates, accs):
+                out[name] = a.finish(acc)
+            yield out
+
+    def _results(self, rows):
+        if self._group == None:
+            return rows
+        rows = self._grouped(rows)
+        for cols, test in self._having:
+            rows = _having(rows, cols, test)
+        if self._post_select != None:
+            names = self._post_select
+            rows = ({c: r[c] for c in names} for r in rows)
+        return rows
+
+    def __iter__(self):
+        scanned = self._scanned()
+        rows = self._results(scanned)
+        try:
+            if self._limit == None:
+                yield from rows
+            else:
+                yield from islice(rows, self._limit)
+        finally:
+            scanned.close() # releases the scan on early exits
+
+    def to_list(self):
+        return list(self)
+
+    def first(self):
+        '''First result, or None'''
+        for r in self.limit(1):
+            return r
+        return None
+
+    def count(self):
+        '''Number of results'''
+        n = 0
+        for _ in self:
+            n += 1
+        return n
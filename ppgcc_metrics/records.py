@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+'''Compact rows for CSV schemas.
+
+record_type() creates a class with one __slot__ per CSV field. Instances
+behave like the dicts yielded by csv.DictReader restricted to the schema
+fields: r['field'] reads and writes a value, a field that was never set is
+absent (KeyError, `in`, get()) and setting a field outside the schema raises
+KeyError. They can be given to csv.DictWriter, but RecordReader and
+RecordWriter avoid building intermediate dicts.
+'''
+import re
+import csv
+import keyword
+from functools import lru_cache
+from unidecode import unidecode
+
+_NON_ID_RX = re.compile(r'\W|^(?=\d)')
+
+def _slot_names(fields):
+    slots = []
+    for i, f in enumerate(fields):
+        s = _NON_ID_RX.sub('_', unidecode(str(f))) or f'field_{i}'
+        if keyword.iskeyword(s) or s.startswith('__'):
+            s = 'f_' + s
+        while s in slots:
+            s += f'_{i}'
+        slots.append(s)
+    return slots
+
+class Record:
+    '''Base of classes created by record_type()'''
+    __slots__ = ()
+    FIELDS = ()
+    _SLOTS = ()
+    _FIELD2SLOT = {}
+
+    def __init__(self, mapping=(), **kwargs):
+        for k, v in dict(mapping, **kwargs).items():
+            if k != None: # extra fields of a long csv.DictReader row
+                self[k] = v
+
+    @classmethod
+    def from_values(cls, values):
+        '''New record with the values of FIELDS, in order'''
+        r = cls.__new__(cls)
+        for s, v in zip(cls._SLOTS, values):
+            object.__setattr__(r, s, v)
+        return r
+
+    def _slot(self, key):
+        try:
+            return self._FIELD2SLOT[key]
+        except (KeyError, TypeError):
+            raise KeyError(key) from None
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._slot(key))
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, self._slot(key), value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, self._slot(key))
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        s = self._FIELD2SLOT.get(key) if isinstance(key, str) else None
+        return s != None and hasattr(self, s)
+
+    def get(self, key, default=None):
+        s = self._FIELD2SLOT.get(key) if isinstance(key, str) else None
+        return default if s == None else getattr(self, s, default)
+
+    def keys(self):
+        return dict.fromkeys(f for f, s in zip(self.FIELDS, self._SLOTS) \
+                             if hasattr(self, s)).keys()
+
+    def values(self):
+        return [self[f] for f in self.keys()]
+
+    def items(self):
+        return [(f, self[f]) for f in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def copy(self):
+        return type(self)(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+@lru_cache(maxsize=256)
+def _record_type(name, fields):
+    slots = _slot_names(fields)
+    return type(name, (Record,), {'__slots__': tuple(slots),
+                                  'FIELDS': fields,
+                                  '_SLOTS': tuple(slots),
+                                  '_FIELD2SLOT': dict(zip(fields, slots))})
+
+def record_type(name, fields):
+    '''Record class for the given CSV field names. Calls with the same name
+    and fields return the same class'''
+    return _record_type(name, tuple(fields))
+
+class RecordReader:
+    '''Like csv.DictReader, but yields records. Fields of record_type missing
+    from the header are left unset, header columns outside record_type are
+    ignored. Without record_type, a type is made from the header'''
+    def __init__(self, f, record_type=None, name='Row', **fmtparams):
+        self.reader = csv.reader(f, **fmtparams)
+        self.fieldnames = next(self.reader, None) or []
+        self.record_type = record_type if record_type != None else \
+                           _record_type(name, tuple(self.fieldnames))
+        self.rows = 0
+        idx = {f: i for i, f in enumerate(self.fieldnames)}
+        self._idx = [(s, idx[f]) for f, s in zip(self.record_type.FIELDS,
+                                                 self.record_type._SLOTS) \
+                     if f in idx]
+        self._identity = self.record_type.FIELDS == tuple(self.fieldnames)
+
+    @property
+    def line_num(self):
+        return self.reader.line_num
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.reader)
+        while row == []:
+            row = next(self.reader)
+        self.rows += 1
+        if self._identity and len(row) == len(self.fieldnames):
+            return self.record_type.from_values(row)
+        r = self.record_type.__new__(self.record_type)
+        for s, i in self._idx:
+            object.__setattr__(r, s, row[i] if i < len(row) else None)
+        return r
+
+class RecordWriter:
+    '''Like csv.DictWriter over the fields of record_type. Accepts records
+    and dicts. Unset fields are written as empty values'''
+    def __init__(self, f, record_type, **fmtparams):
+        self.writer = csv.writer(f, **fmtparams)
+        self.record_type = record_type
+        self.fieldnames = list(record_type.FIELDS)
+        self.rows = 0
+
+    def writeheader(self):
+        return self.writer.writerow(self.fieldnames)
+
+    def writerow(self, r):
+        self.rows += 1
+        if type(r) is self.record_type:
+            return self.writer.writerow([getattr(r, s, None) \
+                                         for s in r._SLOTS])
+        extra = [k for k in r.keys() if k not in self.record_type._FIELD2SLOT]
+        if extra:
+            raise ValueError(f'fields not in {self.record_type.__name__}: ' + \
+                             ', '.join(map(repr, extra)))
+        return self.writer.writerow([r.get(f) for f in self.fieldnames])
+
+    def writerows(self, rows):
+        for r in rows:
+            self.writerow(r)
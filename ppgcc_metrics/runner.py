@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+'''Non-interactive runner: builds datasets and their upstreams in parallel.
+
+Targets are named as in the shell (ds.CPC_CSV, de.AUG_DISCENTES), by
+attribute name alone (CPC_CSV) or by file name (cpc.csv).
+'''
+import os
+import sys
+import time
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ppgcc_metrics import datasets, instrument, compression, names
+
+EXIT_OK, EXIT_FAILED, EXIT_USAGE, EXIT_INTERRUPTED = 0, 1, 2, 130
+REPORT_FILE = os.path.join('data', 'run-report.json')
+
+def named_datasets():
+    '''Dict from shell-style name (ds.X, de.Y) to Dataset'''
+    from ppgcc_metrics import derived
+    result = dict()
+    for m_name, m in [('ds', datasets), ('de', derived)]:
+        for nm in dir(m):
+            if isinstance(getattr(m, nm), datasets.Dataset):
+                result[f'{m_name}.{nm}'] = getattr(m, nm)
+    return result
+
+def resolve(target, named=None):
+    '''Returns the Dataset named by target or raises KeyError'''
+    if isinstance(target, datasets.Dataset):
+        return target
+    named = named_datasets() if named == None else named
+    if target in named:
+        return named[target]
+    matches = [d for nm, d in named.items() \
+               if nm.split('.', 1)[1] == target or str(d) == target]
+    if len(matches) != 1:
+        raise KeyError(target)
+    return matches[0]
+
+def plan(targets):
+    '''Targets and all their upstreams, upstreams first'''
+    order, state = [], dict()
+    def visit(d):
+        st = state.get(id(d))
+        if st == 'done':
+            return
+        if st == 'visiting':
+            raise ValueError(f'Dependency cycle through {d}')
+        state[id(d)] = 'visiting'
+        for up in d.upstreams():
+            visit(up)
+        state[id(d)] = 'done'
+        order.append(d)
+    for d in targets:
+        visit(d)
+    return order
+
+def run(targets, jobs=1, force=False, force_all=False, dry_run=False,
+        log=print, **kwargs):
+    '''Downloads/processes targets after their upstreams, running up to jobs
+    datasets at once. force re-processes the targets, force_all also their
+    upstreams. Datasets whose upstreams failed are skipped. Returns a dict
+    from Dataset to 'ok', 'failed', 'skipped' or 'dry-run'.'''
+    targets = [resolve(t) for t in targets]
+    order = plan(targets)
+    forced = order if force_all else (targets if force else [])
+    forced = {id(d) for d in forced}
+    status = dict()
+    if dry_run:
+        for d in order:
+            log(f'Would {"force " if id(d) in forced else ""}download {d}')
+            status[d] = 'dry-run'
+        return status
+
+    def build(d):
+        with instrument.timing(f'runner:{d}'):
+            d.download(force=id(d) in forced, **kwargs)
+
+    pending, running = list(order), dict()
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        while pending or running:
+            for d in list(pending):
+                ups = d.upstreams()
+                if any(status.get(u) in ['failed', 'skipped'] for u in ups):
+                    log(f'Skipping {d}: upstream failed')
+                    status[d] = 'skipped'
+                    pending.remove(d)
+                elif all(status.get(u) == 'ok' for u in ups) and \
+                        len(running) < max(1, jobs):
+                    log(f'Downloading data for {d}...')
+                    running[executor.submit(build, d)] = d
+                    pending.remove(d)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                d = running.pop(future)
+                e = future.exception()
+                if e == None:
+                    status[d] = 'ok'
+                else:
+                    status[d] = 'failed'
+                    log(f'Failed {d}: {e!r}')
+                    traceback.print_exception(type(e), e, e.__traceback__)
+    except BaseException:
+        # do not wait for in-flight builds (e.g., on Ctrl+C)
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return status
+
+WATCH_INTERVAL = 2.0
+
+def downstream(changed, order, keep=None):
+    '''Datasets of order (upstreams first) that are in changed or depend on
+    one of them, in the same order. Datasets for which keep(d) is false are
+    left out and do not make their downstreams depend on changed'''
+    dirty, result = {id(d) for d in changed}, []
+    for d in order:
+        if id(d) in dirty or any(id(u) in dirty for u in d.upstreams()):
+            if keep == None or keep(d):
+                dirty.add(id(d))
+                result.append(d)
+    return result
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+class Watcher:
+    '''Polls the inputs() of targets and of their upstreams. When they
+    change, rebuilds the datasets that read them and their downstreams
+    within the targets, in dependency order. Remote datasets (with a
+    host()) are not re-fetched, so their downstreams use their current
+    files, unless they set WATCH_REFETCH (e.g., SecretariaDiscentes, which
+    reads DOCENTES). InputDatasets are never rebuilt'''
+    def __init__(self, targets, jobs=1, log=print, **kwargs):
+        self.order = plan([resolve(t) for t in targets])
+        self.jobs = jobs
+        self.log = log
+        self.kwargs = kwargs
+        self.stats = self._snapshot()
+
+    def _snapshot(self):
+        return {id(d): {p: _stat(p) for p in d.inputs(**self.kwargs)} \
+                for d in self.order}
+
+    def changed(self):
+        '''Datasets whose inputs changed since the last call'''
+        stats, self.stats = self.stats, self._snapshot()
+        return [d for d in self.order if stats[id(d)] != self.stats[id(d)]]
+
+    def rebuild(self, changed):
+        '''Forces download() of the downstreams of changed. Returns the
+        status dict of run()'''
+        def keep(d):
+            if d.host() != None and not d.WATCH_REFETCH:
+                self.log(f'Not re-fetching remote dataset {d}, which may ' + \
+                         'be stale')
+                return False
+            return True
+        stale = [d for d in downstream(changed, self.order, keep) \
+                 if not isinstance(d, datasets.InputDataset)]
+        if not stale:
+            return dict()
+        self.log(f'Changed: {", ".join(map(str, changed))}. Rebuilding ' + \
+                 ', '.join(map(str, stale)))
+        return run(stale, jobs=self.jobs, force=True, log=self.log,
+                   **self.kwargs)
+
+    def poll(self):
+        '''Rebuilds what changed since the last poll(), if anything'''
+        changed = self.changed()
+        return self.rebuild(changed) if changed else None
+
+    def watch(self, interval=WATCH_INTERVAL):
+        '''Calls poll() every interval seconds until interrupted. Changes
+        are only acted upon once inputs stop changing for an interval, so
+        that files being saved are not read halfway'''
+        pending = []
+        while True:
+            time.sleep(interval)
+            changed = self.changed()
+            if changed:
+                pending += [d for d in changed if d not in pending]
+            elif pending:
+                self.rebuild(pending)
+                pending = []
+
+def _detach_stdin():
+    fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(fd, 0)
+    os.close(fd)
+    sys.stdin = open(os.devnull, 'r')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='run.py', description='Download and process datasets and ' + \
+            'their upstreams. Without targets, builds everything get_all() ' +\
+            'builds.')
+    parser.add_argument('targets', nargs='*',
+                        help='ds.NAME, de.NAME, NAME or file name')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='datasets built concurrently (default: 1)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='re-download/re-process the targets')
+    parser.add_argument('--force-all', action='store_true',
+                        help='also re-download/re-process upstreams')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only print what would be built')
+    parser.add_argument('-l', '--list', action='store_true',
+                        help='list target names and exit')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='after building, rebuild the targets affected ' +\
+                             'by changes to input files until interrupted')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL,
+                        help='watch polling interval in seconds ' + \
+                             f'(default: {WATCH_INTERVAL})')
+    parser.add_argument('--compress-threads', type=int, metavar='N',
+                        help='(de)compress xz and gzip files with N threads ' +\
+                             'of the xz or pigz tools, 0 for one per core ' +\
+                             '(default: 1, in-process)')
+    parser.add_argument('--no-registry', action='store_true',
+                        help='do not use nor update the person-identity ' + \
+                             f'registry ({names.REGISTRY_FILE})')
+    parser.add_argument('--report', default=REPORT_FILE,
+                        help=f'run report JSON (default: {REPORT_FILE})')
+    args = parser.parse_args(argv)
+    _detach_stdin()
+
+    named = named_datasets()
+    if args.list:
+        for nm, d in named.items():
+            print(f'{nm:30} {str(d):30} {"" if d.is_ready() else "[PENDING]"}')
+        return EXIT_OK
+    try:
+        targets = [resolve(t, named) for t in args.targets]
+    except KeyError as e:
+        print(f'Unknown target: {e.args[0]}. Use --list', file=sys.stderr)
+        return EXIT_USAGE
+    if not targets:
+        targets = [d for d in named.values() if not d.non_trivial]
+
+    if args.compress_threads != None:
+        compression.THREADS = args.compress_threads
+    if args.no_registry:
+        names.use_registry(None)
+    else:
+        names.registry_from_env()
+    instrument.profiling_from_env()
+    try:
+        status = run(targets, jobs=args.jobs, force=args.force,
+                     force_all=args.force_all, dry_run=args.dry_run)
+        if args.watch and not args.dry_run:
+            print(f'Watching inputs every {args.interval}s. ' + \
+                  'Interrupt to stop', file=sys.stderr)
+            Watcher(targets, jobs=args.jobs).watch(args.interval)
+    except KeyboardInterrupt:
+        print('Interrupted', file=sys.stderr)
+        return EXIT_INTERRUPTED
+    finally:
+        if not args.dry_run:
+            report_dir = os.path.dirname(args.report) or '.'
+            os.makedirs(report_dir, exist_ok=True)
+            instrument.stop_profiling(report_dir)
+            instrument.dump_json(args.report)
+    failed = [str(d) for d, st in status.items() if st in ['failed', 'skipped']]
+    if failed:
+        print(f'Failed or skipped: {", ".join(failed)}', file=sys.stderr)
+        return EXIT_FAILED
+    return EXIT_OK
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+from ppgcc_metrics import runner
+
+if __name__ == '__main__':
+    status = runner.main()
+    if status == runner.EXIT_INTERRUPTED:
+        # do not wait for the executor threads of interrupted builds
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+    sys.exit(status)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from ppgcc_metrics import datasets as ds
 from ppgcc_metrics import derived as de
+from ppgcc_metrics import instrument, runner, names
 import itertools
 
 ALL_DATASETS = list(itertools.chain(
@@ -8,6 +9,25 @@ ALL_DATASETS = list(itertools.chain(
     filter(lambda x: isinstance(getattr(de, x), ds.Dataset), dir(de))
 ))
 
+REPORT_FILE = 'data/run-report.json'
+
+def profile(enable=True):
+    '''Starts (or stops) counting and sampling the name matching hot paths
+    listed in instrument.PROFILE_TARGETS. Also enabled by PPGCC_PROFILE=1'''
+    if enable:
+        instrument.start_profiling()
+    else:
+        print(f'Collapsed stacks saved to {instrument.stop_profiling()}')
+
+def report(filepath=REPORT_FILE):
+    '''Prints timings, row/byte counts and cache hits since the shell
+    started (or since the last instrument.reset()) and saves them as JSON.
+    If profiling, stops it and attaches the profile to the JSON'''
+    if instrument.is_profiling():
+        profile(False)
+    instrument.print_report()
+    print(f'Report saved to {instrument.dump_json(filepath)}')
+
 def get_all(**kwargs):
     for m in [ds, de]:
         for d in filter(lambda x: isinstance(x, ds.Dataset) and not x.non_trivial, \
@@ -15,13 +35,34 @@ def get_all(**kwargs):
             print(f'Downloading data for {d}...')
             d.download(**kwargs)
     print(f'Download & processing completed for all datasets')
+    report()
+
+def watch(*targets, interval=runner.WATCH_INTERVAL, **kwargs):
+    '''Rebuilds the targets (default: what get_all() builds) affected by
+    edits to input files (docentes.csv, linhas.csv, CAPG PDFs, ...) until
+    interrupted with Ctrl+C'''
+    if not targets:
+        targets = [d for d in runner.named_datasets().values() \
+                   if not d.non_trivial]
+    print(f'Watching inputs every {interval}s. Ctrl+C to stop')
+    try:
+        runner.Watcher(targets, **kwargs).watch(interval)
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == '__main__':
+    instrument.profiling_from_env()
+    names.registry_from_env()
     print('\n--=[ ppgcc-metrics interactive shell ]=--\n' +
             '    (actually, just an IPython shell)\n'
           '\n' +
           'Use get_all() to ensure all datasets are available. Use the ' +
           'force=True parameter to force re-download and/or re-processing.\n' +
+          'Use report() to see where time went (also saved to ' +
+          f'{REPORT_FILE}). Use profile() or PPGCC_PROFILE=1 to also ' +
+          'profile name matching.\n' +
+          'Use watch() to rebuild what depends on input files as they ' +
+          'are edited.\n' +
           'Available datasets:')
     has_pending = False
     for m_name in ['ds', 'de']:
@@ -6,3 +6,11 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 import ppgcc_metrics.datasets as datasets
 import ppgcc_metrics.names as names
+import ppgcc_metrics.instrument as instrument
+import ppgcc_metrics.runner as runner
+import ppgcc_metrics.extsort as extsort
+import ppgcc_metrics.records as records
+import ppgcc_metrics.compression as compression
+import ppgcc_metrics.mmapcsv as mmapcsv
+import ppgcc_metrics.google_api as google_api
+import ppgcc_metrics.query as query
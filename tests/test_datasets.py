@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
-from .context import datasets
+from .context import datasets, names, instrument, compression
 import unittest
+from unittest import mock
 import csv
+import io
+import os
+import sys
 import lzma
 import json
+import shutil
 import tempfile
+import threading
+import subprocess
+import http.server
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
 from os.path import join, isfile, abspath, dirname
 from datetime import date
 from pkg_resources import resource_string, resource_stream, resource_listdir
@@ -91,6 +102,70 @@ class SucupiraTests(unittest.TestCase):
                 ]
                 self.assertEqual(sub, ex)
 
+    def _serve(self, body):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_port}/'
+
+    def testDownloadCodecs(self):
+        lines = ['ID;X;NM'] + [f'{i}; N\u00c3O SE  APLICA ;Jo\u00e3o {i}'
+                               for i in range(200)]
+        url = self._serve(('\r\n'.join(lines) + '\n').encode('iso-8859-1'))
+        expected = [{'ID': str(i), 'X': 'NA', 'NM': f'Jo\u00e3o {i}'}
+                    for i in range(200)]
+        with tempfile.TemporaryDirectory() as d:
+            for codec, magic in [(None, b'\xfd7zXZ'), ('gz', b'\x1f\x8b'),
+                                 ('plain', b'ID;X;')]:
+                ds = datasets.SucupiraDataset('f.csv.xz', url, directory=d,
+                                              codec=codec, level=1)
+                ds.CHUNK_SIZE = 7
+                ds.download(force=True)
+                with open(join(d, 'f.csv.xz'), 'rb') as f:
+                    self.assertEqual(f.read(len(magic)), magic)
+                with ds.open_csv() as reader:
+                    self.assertEqual([dict(r) for r in reader], expected)
+
+    def testDownloadConcurrently(self):
+        url = self._serve(b'a;b\n1;2\n')
+        with tempfile.TemporaryDirectory() as d:
+            dss = [datasets.SucupiraDataset(f'{y}.csv.xz', url, directory=d)
+                   for y in range(2013, 2019)]
+            paths = datasets.download_concurrently(dss, jobs=3)
+            self.assertEqual(paths, [join(d, f'{y}.csv.xz')
+                                     for y in range(2013, 2019)])
+            for ds in dss:
+                with ds.open_csv() as reader:
+                    self.assertEqual([dict(r) for r in reader],
+                                     [{'a': '1', 'b': '2'}])
+
+    def testProgramForcesEachYearOnce(self):
+        forced = []
+        class Year(datasets.SucupiraDataset):
+            def download(self, force=False, **kwargs):
+                if force:
+                    forced.append(self.filename)
+                return super().download(force=force, **kwargs)
+        url = self._serve(b'a;b\n1;41001010025P2\n')
+        with tempfile.TemporaryDirectory() as d:
+            y2ds = {y: Year(f'{y}.csv.xz', url, directory=d)
+                    for y in [2017, 2018]}
+            prgm = datasets.SucupiraProgram('ppgcc.csv', '41001010025', y2ds,
+                                            directory=d)
+            prgm.download(force=True)
+            self.assertEqual(sorted(forced), ['2017.csv.xz', '2018.csv.xz'])
+            with prgm.open_csv() as reader:
+                self.assertEqual(len(list(reader)), 2)
+
     def testReplaceCSV(self):
         with tempfile.TemporaryDirectory() as d:
             with lzma.open(join(d, 'f.csv'), 'wt', newline='\r\n', \
@@ -104,6 +179,184 @@ class SucupiraTests(unittest.TestCase):
             with ds.open_csv() as r:
                 self.assertEqual([dict(d) for d in r], [{'a':'3', 'b':'4'}])
 
+class CompressionTests(unittest.TestCase):
+    _serve = SucupiraTests._serve
+    TEXT = ''.join(f'{i};Jo\u00e3o {i}\r\n' for i in range(5000))
+
+    def testRoundTrip(self):
+        with tempfile.TemporaryDirectory() as d:
+            for codec in compression.CODECS:
+                for threads in [1, 2, 0]:
+                    path = join(d, f'f-{codec}-{threads}')
+                    with compression.open_text(path, 'w', codec, 1, threads,
+                                               newline='') as f:
+                        f.write(self.TEXT)
+                    self.assertEqual(compression.sniff(path), codec)
+                    with compression.open_text(path, threads=threads,
+                                               newline='') as f:
+                        self.assertEqual(f.read(), self.TEXT)
+                    with compression.open_text(path, threads=threads,
+                                               newline='') as f:
+                        self.assertEqual(f.readline(), '0;Jo\u00e3o 0\r\n')
+
+    def testXZBlocks(self):
+        block_size = compression.XZ_BLOCK_SIZE
+        compression.XZ_BLOCK_SIZE = 1 << 14
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                for text in ['', self.TEXT]:
+                    with compression.open_text(join(d, 'f.xz'), 'w',
+                                               newline='') as f:
+                        f.write(text)
+                    with open(join(d, 'f.xz'), 'rb') as f:
+                        data = f.read()
+                    self.assertEqual(lzma.decompress(data).decode(), text)
+                # footer: backward size and the index, which lists the blocks
+                index_size = (int.from_bytes(data[-8:-4], 'little') + 1) * 4
+                index = data[-12-index_size:-12]
+                self.assertEqual(index[0], 0)
+                self.assertEqual(index[1],
+                                 -(-len(self.TEXT.encode()) // (1 << 14)))
+                if shutil.which('xz'):
+                    out = subprocess.run(
+                        ['xz', '-T2', '-dc', join(d, 'f.xz')],
+                        capture_output=True, check=True)
+                    self.assertEqual(out.stdout.decode(), self.TEXT)
+        finally:
+            compression.XZ_BLOCK_SIZE = block_size
+
+    def testEmptyPlain(self):
+        with tempfile.TemporaryDirectory() as d:
+            open(join(d, 'f'), 'w').close()
+            with compression.open_text(join(d, 'f')) as f:
+                self.assertEqual(f.read(), '')
+            self.assertIsNone(compression.open_mmap(join(d, 'f')))
+
+    def testCorrupt(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(join(d, 'f.xz'), 'wb') as f:
+                f.write(b'\xfd7zXZ\x00garbage')
+            for threads in [1, 0]:
+                with self.assertRaises((OSError, lzma.LZMAError)):
+                    with compression.open_text(join(d, 'f.xz'),
+                                               threads=threads) as f:
+                        f.read()
+
+    FAKE_TOOL = '''#!{python}
+import os, sys, signal, shutil
+sys.stderr.write('warning\\n' * 100000) # more than a pipe buffer
+sys.stderr.flush()
+if {rc} < 0:
+    signal.signal(-{rc}, signal.SIG_DFL)
+    os.kill(os.getpid(), -{rc})
+shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)
+sys.exit({rc})
+'''
+
+    def _fake_tool(self, d, rc):
+        path = join(d, f'tool{rc}')
+        with open(path, 'w') as f:
+            f.write(self.FAKE_TOOL.format(python=sys.executable, rc=rc))
+        os.chmod(path, 0o755)
+        return path
+
+    def testToolStderrAndSignals(self):
+        tools = dict(compression.TOOLS)
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                with open(join(d, 'f.xz'), 'wb') as f:
+                    f.write(lzma.compress(b'abc'))
+                compression.TOOLS['xz'] = self._fake_tool(d, 0)
+                with compression.open_binary(join(d, 'f.xz'),
+                                             threads=2) as f:
+                    self.assertEqual(lzma.decompress(f.read()), b'abc')
+                compression.TOOLS['xz'] = self._fake_tool(d, -2) # SIGINT
+                with compression.open_binary(join(d, 'g.xz'), 'wb',
+                                             threads=2) as f:
+                    f.write(b'abc')
+                compression.TOOLS['xz'] = self._fake_tool(d, 3)
+                with self.assertRaises(OSError) as cm:
+                    with compression.open_binary(join(d, 'f.xz'),
+                                                 threads=2) as f:
+                        f.read()
+                self.assertIn('warning', str(cm.exception))
+                self.assertIsNone(compression._tool('xz', None))
+        finally:
+            compression.TOOLS.update(tools)
+
+    def testRecompress(self):
+        with tempfile.TemporaryDirectory() as d:
+            with compression.open_text(join(d, 'a.gz'), 'w') as f:
+                f.write(self.TEXT)
+            compression.recompress(join(d, 'a.gz'), join(d, 'b'), 'xz', 1)
+            self.assertEqual(compression.sniff(join(d, 'b')), 'xz')
+            with compression.open_text(join(d, 'b'), newline='') as f:
+                self.assertEqual(f.read(), self.TEXT)
+
+    def testCompressedCSV(self):
+        raw = lzma.compress('a,b\r\n1,\u00e7\r\n'.encode('utf-8'))
+        url = self._serve(raw)
+        with tempfile.TemporaryDirectory() as d:
+            for codec, ext in [(None, '.xz'), ('gz', '.gz'), ('plain', '')]:
+                ds = datasets.CompressedCSV('f.csv', url, codec=codec,
+                                            directory=d)
+                self.assertEqual(ds.download(force=True), join(d, 'f.csv'+ext))
+                self.assertTrue(ds.is_ready())
+                for other in ['.xz', '.gz', '']:
+                    self.assertEqual(isfile(join(d, 'f.csv'+other)),
+                                     other == ext)
+                with ds.open_csv() as reader:
+                    self.assertEqual([dict(r) for r in reader],
+                                     [{'a': '1', 'b': '\u00e7'}])
+
+class AsyncDownloadTests(unittest.TestCase):
+    _serve = SucupiraTests._serve
+
+    class Slow(datasets.Dataset):
+        def __init__(self, name, host, ups=(), log=None):
+            super().__init__(name, None)
+            self.HOST = host
+            self.ups = list(ups)
+            self.log = log
+        def download(self, force=False, **kwargs):
+            self.log.append(('start', self.filename, self.HOST))
+            time.sleep(0.05)
+            self.log.append(('end', self.filename, self.HOST))
+            return self.filename
+
+    def testHTTP(self):
+        url = self._serve(b'a,b\r\n1,2\r\n')
+        with tempfile.TemporaryDirectory() as d:
+            dss = [datasets.Dataset(f'{i}.csv', url, directory=d)
+                   for i in range(4)]
+            self.assertEqual(dss[0].host(), url.split('/')[2])
+            paths = asyncio.run(datasets.AsyncDownloader().download_all(dss))
+            self.assertEqual(paths, [join(d, f'{i}.csv') for i in range(4)])
+            for ds in dss:
+                with ds.open_csv() as reader:
+                    self.assertEqual([dict(r) for r in reader],
+                                     [{'a': '1', 'b': '2'}])
+            self.assertEqual(asyncio.run(dss[0].download_async()), paths[0])
+
+    def testHostLimitAndUpstreams(self):
+        log = []
+        shared = self.Slow('shared', 'h1', log=log)
+        dss = [self.Slow(f'd{i}', 'h1' if i % 2 else 'h2', [shared], log)
+               for i in range(6)]
+        async def run():
+            downloader = datasets.AsyncDownloader(executor, host_limit=2)
+            return await downloader.download_all(dss)
+        with ThreadPoolExecutor(8) as executor:
+            self.assertEqual(asyncio.run(run()), [f'd{i}' for i in range(6)])
+        starts = [x for x in log if x[0] == 'start']
+        self.assertEqual([x[1] for x in starts].count('shared'), 1)
+        self.assertEqual(starts[0][1], 'shared')
+        running, peak = dict(), dict()
+        for ev, name, host in log:
+            running[host] = running.get(host, 0) + (1 if ev == 'start' else -1)
+            peak[host] = max(peak.get(host, 0), running[host])
+        self.assertEqual(peak, {'h1': 2, 'h2': 2})
+
 class SucupiraDateTests(unittest.TestCase):
     def testNone(self):
         self.assertEqual(datasets.suc_date2iso(None), None)
@@ -157,6 +410,41 @@ class SucupiraDateTests(unittest.TestCase):
         self.assertEqual(datasets.suc_date2iso('01-SEP-2018'), '2018-09-01')
         self.assertEqual(datasets.suc_date2iso('01-OCT-2018'), '2018-10-01')
         self.assertEqual(datasets.suc_date2iso('01-DEC-2018'), '2018-12-01')
+    def testLowerCaseAndTime(self):
+        self.assertEqual(datasets.suc_date2iso('24jan2017:00:00:00'), '2017-01-24')
+    def testBadDay(self):
+        self.assertEqual(datasets.suc_date2iso('31FEV2018'), '31FEV2018')
+
+class ConversionTests(unittest.TestCase):
+    def testTolerantInt(self):
+        self.assertEqual(datasets.tolerant_int('2017'), 2017)
+        self.assertEqual(datasets.tolerant_int('007'), 7)
+        self.assertEqual(datasets.tolerant_int(' 1,234 citations'), 1)
+        self.assertEqual(datasets.tolerant_int('delta -3'), -3)
+        self.assertEqual(datasets.tolerant_int('\u00b2'), None)
+        self.assertEqual(datasets.tolerant_int(''), None)
+        self.assertEqual(datasets.tolerant_int('', empty=0), 0)
+        self.assertEqual(datasets.tolerant_int('n/a', empty=0), 0)
+
+    def testConvertColumns(self):
+        calls = []
+        def to_int(v):
+            calls.append(v)
+            return datasets.tolerant_int(v, empty=0)
+        rows = [{'y': '2017', 'c': '3', 'n': 'x'},
+                {'y': '2017', 'c': '', 'n': 'y'},
+                {'y': '2018', 'c': '3', 'n': 'z'}]
+        result = datasets.convert_columns(rows, {'y': to_int, 'c': to_int})
+        self.assertIs(result, rows)
+        self.assertEqual(rows, [{'y': 2017, 'c': 3, 'n': 'x'},
+                                {'y': 2017, 'c': 0, 'n': 'y'},
+                                {'y': 2018, 'c': 3, 'n': 'z'}])
+        self.assertEqual(calls, ['2017', '2018', '3', ''])
+
+    def testConvertListColumns(self):
+        rows = [['1', 'a'], ['2', 'b']]
+        datasets.convert_columns(rows, {0: int})
+        self.assertEqual(rows, [[1, 'a'], [2, 'b']])
 
 class GoogleCalendarTests(unittest.TestCase):
     def setUp(self):
@@ -303,7 +591,102 @@ class GoogleCalendarCSVTests(unittest.TestCase):
             self.assertEqual(data[2]['orientador'], 'MARCIO CASTRO')
             self.assertEqual(data[2]['coorientador'], 'PATRICIA DELLA MEA PLENTZ')
             self.assertEqual(data[2]['data_ymd'], '2018-06-05')
-        
+
+    def testParsedEventsMatchCSV(self):
+        events = self.cal_csv.parsed_events()
+        with self.cal_csv.open_csv() as reader:
+            rows = [x for x in reader]
+        self.assertEqual([d['discente'] for d, _ in events],
+                         [r['discente'] for r in rows])
+        self.assertTrue(events[0][1].startswith('EVENTO: Defesa de Mestrado'))
+
+    def testParseCacheSkipsUnchanged(self):
+        self.cal_csv.parsed_events()
+        cache_path = join(self.tmp.name, 'calendar.csv.cache')
+        self.assertTrue(isfile(cache_path))
+        with open(cache_path) as f:
+            cache = json.load(f)
+        for e in cache.values():
+            if e[1]:
+                e[1][0]['discente'] = 'CACHED'
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f)
+        json_path = join(self.tmp.name, 'calendar.json')
+        with open(json_path) as f:
+            o = json.load(f)
+        o['items'][0]['updated'] = '2020-01-01T00:00:00.000Z'
+        with open(json_path, 'w') as f:
+            json.dump(o, f)
+        self.cal_csv.parsed = None
+        events = self.cal_csv.parsed_events()
+        self.assertEqual([d['discente'] for d, _ in events],
+                         ['LUCAS VIANA KNOCHENHUAER', 'CACHED', 'CACHED'])
+
+
+class JSONStreamTests(unittest.TestCase):
+    def testSameAsJsonLoad(self):
+        text = resource_string('tests.resources', 'calendar.json').decode()
+        ex = json.loads(text)['items']
+        for chunk_size in [1, 7, 4096]:
+            with io.StringIO(text) as f:
+                items = list(datasets.iter_json_items(f, chunk_size=chunk_size))
+            self.assertEqual(items, ex)
+
+    def testTrickyMembers(self):
+        text = '{"a": "items", "n": 12345, "b": [{"items": 1}], ' + \
+               '"items": [1, "]", {"x": [2]}, 3.25], "z": null}'
+        for chunk_size in [1, 3, 100]:
+            with io.StringIO(text) as f:
+                items = list(datasets.iter_json_items(f, chunk_size=chunk_size))
+            self.assertEqual(items, [1, ']', {'x': [2]}, 3.25])
+
+    def testEmpty(self):
+        with io.StringIO('{}') as f:
+            self.assertEqual(list(datasets.iter_json_items(f)), [])
+        with io.StringIO('{"items": []}') as f:
+            self.assertEqual(list(datasets.iter_json_items(f)), [])
+
+    def testNDJSONCalendarLaterLinesWin(self):
+        with tempfile.TemporaryDirectory() as d:
+            cal = datasets.GoogleCalendar('calendar.ndjson', 'x', ndjson=True,
+                                          directory=d)
+            items = json.loads(resource_string('tests.resources',
+                                               'calendar.json'))['items']
+            cancelled = {'id': items[1]['id'], 'status': 'cancelled',
+                         'updated': '2020-01-01T00:00:00.000Z'}
+            with open(join(d, 'calendar.ndjson'), 'w') as f:
+                for e in items + [cancelled]:
+                    f.write(json.dumps(e) + '\n')
+            self.assertEqual(len(list(cal.iter_events())), 4)
+            cal_csv = datasets.GoogleCalendarCSV('calendar.csv', cal,
+                                                 directory=d)
+            with cal_csv.open_csv() as reader:
+                self.assertEqual([r['discente'] for r in reader],
+                                 ['LUCAS VIANA KNOCHENHUAER', 'LAIS BORIN'])
+
+    def testNDJSONIncrementalCompacts(self):
+        pages = []
+        class FakeCalendar(datasets.GoogleCalendar):
+            def _list_pages(self, **list_args):
+                pages.append(list_args)
+                return [{'items': [{'id': 'a', 'updated': '2020-01-02'},
+                                   {'id': 'c', 'updated': '2020-01-03'}]}]
+        with tempfile.TemporaryDirectory() as d:
+            cal = FakeCalendar('calendar.ndjson', 'x', ndjson=True,
+                               directory=d)
+            with open(join(d, 'calendar.ndjson'), 'w') as f:
+                f.write('{"id": "a", "updated": "2020-01-01"}\n')
+                f.write('{"id": "b", "updated": "2020-01-02"}\n')
+                f.write('{"id": "c", "upd') # interrupted write
+            for i in range(2):
+                cal.download(force=True)
+            self.assertEqual(pages[-1], {'updatedMin': '2020-01-03'})
+            self.assertEqual([(e['id'], e['updated']) \
+                              for e in cal.iter_events()],
+                             [('b', '2020-01-02'), ('a', '2020-01-02'),
+                              ('c', '2020-01-03')])
+            self.assertFalse(isfile(join(d, 'calendar.ndjson.tmp')))
+
 
 class InputDatasetTests(unittest.TestCase):
     def testRequireExistence(self):
@@ -336,6 +719,179 @@ class InputDatasetTests(unittest.TestCase):
                 self.assertEqual([dict(d) for d in r], [{'a': '3', 'b': '4'}])
             
 
+class FixNamesTests(unittest.TestCase):
+    FILES = {
+        'docentes.csv': 'docente,status\nFulano Silveira,PERMANENTE\n' + \
+                        'Ana Costa Lima,PERMANENTE\n',
+        'cal.csv': 'discente,orientador,coorientador\n' + \
+                   'Joao Silva,FULANO S.,ANA C. LIMA\n' + \
+                   'Maria Souza,ANA COSTA LIMA,FULANO SILVEIRA\n',
+        'suc.csv': 'NM_DISCENTE,NM_ORIENTADOR_PRINCIPAL\n' + \
+                   'JOAO PEDRO SILVA,FULANO S.\nMARIA SOUZA,ANA LIMA\n',
+    }
+
+    def _datasets(self, d):
+        for name, text in self.FILES.items():
+            with open(join(d, name), 'w', newline='') as f:
+                f.write(text)
+        return [datasets.InputDataset(name, directory=d) \
+                for name in ['docentes.csv', 'cal.csv', 'suc.csv']]
+
+    def _steps(self, doc, cal, suc):
+        return [([doc, cal], ['docente', 'orientador']),
+                ([doc, cal], ['docente', 'coorientador']),
+                ([doc, suc], ['docente', 'NM_ORIENTADOR_PRINCIPAL']),
+                ([suc, cal], ['NM_DISCENTE', 'discente']),
+                ([cal, suc], ['orientador', 'NM_ORIENTADOR_PRINCIPAL'])]
+
+    def _contents(self, d):
+        result = dict()
+        for name in self.FILES:
+            with open(join(d, name)) as f:
+                result[name] = f.read()
+        return result
+
+    def testSameAsSequential(self):
+        with tempfile.TemporaryDirectory() as seq_d, \
+             tempfile.TemporaryDirectory() as plan_d:
+            for dss, cols in self._steps(*self._datasets(seq_d)):
+                names.fix_csv_names(dss, cols, read_only=[0],
+                                    allow_ambiguous=True)
+            instrument.reset()
+            plan = names.NameFixPlan()
+            for dss, cols in self._steps(*self._datasets(plan_d)):
+                plan.add(dss, cols, read_only=[0], allow_ambiguous=True)
+            plan.run()
+            expected = self._contents(seq_d)
+            self.assertNotEqual(expected, self.FILES)
+            self.assertEqual(self._contents(plan_d), expected)
+            entries = instrument.report()['entries']
+            self.assertEqual(entries['open_csv:docentes.csv']['calls'], 1)
+            self.assertEqual(entries['open_csv:cal.csv']['calls'], 2)
+            self.assertEqual(entries['replace_csv:cal.csv']['calls'], 1)
+
+    def testLengthMismatch(self):
+        with self.assertRaises(ValueError):
+            names.NameFixPlan().add([datasets.DOCENTES], ['a', 'b'])
+
+class DeltaSheetTests(unittest.TestCase):
+    class Secretaria(datasets.SecretariaDiscentes):
+        parsed = 0
+        def parse_row(self, cells, advisor):
+            self.parsed += 1
+            return super().parse_row(cells, advisor)
+
+    class CPC(datasets.CPCWorks):
+        def __init__(self):
+            self.encoding = 'utf-8'
+            self.authors = 0
+        def get_authors(self, text):
+            self.authors += 1
+            return super().get_authors(text)
+
+    def _student(self, name, matr='01/03/2018'):
+        return ['', '', '', name, 'ME', matr, '', '', '', '01/03/2020']
+
+    def testSecretaria(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(join(d, 'docentes.csv'), 'w') as f:
+                f.write('docente\nFulano Silveira\n')
+            docentes = datasets.InputDataset('docentes.csv', directory=d)
+            path = join(d, 'secretaria.csv')
+            data = [['Controle', 'x'], ['F. SILVEIRA'], [],
+                    self._student('Ana Costa'),
+                    self._student('Joao Silva')]
+            sec = self.Secretaria(docentes, directory=d)
+            sec.write_rows(data, path)
+            with open(path) as f:
+                first = f.read()
+            self.assertEqual(sec.parsed, 2)
+            self.assertIn('FULANO SILVEIRA', first)
+
+            sec = self.Secretaria(docentes, directory=d)
+            sec.write_rows(data, path)
+            self.assertEqual(sec.parsed, 0)
+            with open(path) as f:
+                self.assertEqual(f.read(), first)
+
+            data[4] = self._student('Joao Silva', '02/03/2018')
+            sec.write_rows(data, path)
+            self.assertEqual(sec.parsed, 1)
+            with open(path) as f:
+                self.assertIn('02MAR2018', f.read())
+
+    def testCPC(self):
+        header = ['Tipo', 'Artigo (conforme Lattes)', 'Ano']
+        rows = [header, ['Journal', 'DOE, J.; ROE, R. . A title', '2019'],
+                ['Conf', 'SILVA, A. . Other', '2018']]
+        with tempfile.TemporaryDirectory() as d:
+            path = join(d, 'cpc.csv')
+            cpc = self.CPC()
+            cpc.write_rows(rows, path)
+            self.assertEqual(cpc.authors, 2)
+            with open(path) as f:
+                first = f.read()
+            self.assertIn('DOE, J.; ROE, R.', first)
+            rows.append(['Conf', 'COSTA, B. . Third', '2020'])
+            cpc.write_rows(rows, path)
+            self.assertEqual(cpc.authors, 3)
+            with open(path) as f:
+                self.assertTrue(f.read().startswith(first))
+            cpc.write_rows([header + ['Extra']] + rows[1:], path)
+            self.assertEqual(cpc.authors, 6)
+
+class SQLiteTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(join(self.tmp.name, 'people.csv'), 'w', newline='') as f:
+            f.write('ID_PESSOA,NM_DISCENTE,Ano\n' +
+                    '1,João da Silva,2017\n' +
+                    '2,Maria Souza,2018\n' +
+                    '3,Ana  Costa,2018\n')
+        self.ds = datasets.InputDataset('people.csv', directory=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testIndexedLookup(self):
+        rows = list(self.ds.sql('SELECT * FROM {table} WHERE ID_PESSOA=?',
+                                ('2',)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['NM_DISCENTE'], 'Maria Souza')
+        rows = list(self.ds.sql('SELECT ID_PESSOA FROM {table} ' +
+                                'WHERE NM_DISCENTE_CLEAN=?', ('ANA COSTA',)))
+        self.assertEqual(rows, [{'ID_PESSOA': '3'}])
+        idx = {r['name'] for r in self.ds.sql('SELECT name FROM ' +
+                                              'sqlite_master WHERE ' +
+                                              'tbl_name=\'people_csv\' AND ' +
+                                              'type=\'index\'')}
+        self.assertEqual(idx, {'people_csv__ID_PESSOA', 'people_csv__Ano',
+                               'people_csv__NM_DISCENTE_CLEAN'})
+
+    def testAggregateYears(self):
+        rows = list(self.ds.sql('SELECT Ano, COUNT(*) AS n FROM {table} ' +
+                                'WHERE Ano >= 2018 GROUP BY Ano'))
+        self.assertEqual(rows, [{'Ano': 2018, 'n': 2}])
+
+    def testTableNames(self):
+        self.assertEqual(datasets.Dataset('calendar.json', None).sql_table(),
+                         'calendar_json')
+        self.assertEqual(datasets.Dataset('calendar.csv', None).sql_table(),
+                         'calendar_csv')
+        rows = list(self.ds.sql("SELECT '{x}' AS s, COUNT(*) AS n " +
+                                "FROM {table}"))
+        self.assertEqual(rows, [{'s': '{x}', 'n': 3}])
+
+    def testRebuildOnlyWhenChanged(self):
+        self.ds.to_sqlite()
+        q = 'SELECT COUNT(*) AS n FROM people_csv'
+        db = join(self.tmp.name, datasets.SQLITE_FILE)
+        self.assertEqual(list(datasets.sqlite_query(q, db=db)), [{'n': 3}])
+        with open(join(self.tmp.name, 'people.csv'), 'a', newline='') as f:
+            f.write('4,Pedro Alves,2019\n')
+        self.assertEqual(list(self.ds.sql(q)), [{'n': 4}])
+
+
 class SecretariaDiscentesTest(unittest.TestCase):
     def testParseNameSimple(self):
         ds = datasets.SecretariaDiscentes(datasets.DOCENTES)
@@ -425,6 +981,107 @@ class DiscentesCAPGCNPJTest(unittest.TestCase):
                                     ('78945612310', 'Ciclano da Silva')])
         self.assertFalse(m)
 
+class InterruptingCAPGCNPJ(datasets.DiscentesCAPGCNPJ):
+    def __init__(self, *args, interrupt_at=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interrupt_at = interrupt_at
+        self.matched = 0
+
+    def _match_student(self, row_d, student_pairs):
+        if self.matched == self.interrupt_at:
+            raise KeyboardInterrupt()
+        self.matched += 1
+        return super()._match_student(row_d, student_pairs)
+
+class CAPGCNPJCheckpointTests(unittest.TestCase):
+    STUDENTS = [('12345678910', 'FULANO DA SILVA'),
+                ('78945612310', 'CICLANO DE SOUZA')]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rows = []
+        for i in range(500):
+            cpf, nome = self.STUDENTS[i % 2] if i % 7 == 0 else \
+                        (f'{i:011d}', f'SOCIO {i}')
+            rows.append({'cnpj': f'{i:014d}', 'nome_socio': nome,
+                         'cnpj_cpf_do_socio': '***' + cpf[3:9] + '**',
+                         'data_entrada_sociedade': '2019-01-20',
+                         'obs': 'a\nb' if i % 5 == 0 else ''})
+        with open(join(self.tmp.name, 'socio.csv'), 'w', encoding='utf-8',
+                  newline='') as f:
+            w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            w.writeheader()
+            w.writerows(rows)
+        self.out = join(self.tmp.name, 'out.csv')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _capg(self, interrupt_at=None):
+        socios = datasets.CompressedCSV('socio.csv', directory=self.tmp.name)
+        capg = InterruptingCAPGCNPJ('capg.csv', 'pdfs', socios,
+                                    directory=self.tmp.name,
+                                    interrupt_at=interrupt_at)
+        capg.CHECKPOINT_ROWS = 40
+        return capg
+
+    def _read(self):
+        with open(self.out, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+
+    def checkResume(self):
+        full = self._capg()
+        wrote = full._scan(self.out, self.STUDENTS)
+        self.assertEqual(wrote, 72)
+        expected = self._read()
+        self.assertFalse(isfile(self.out + '.checkpoint'))
+        for stop in [0, 39, 40, 133, 499]:
+            first = self._capg(interrupt_at=stop)
+            with self.assertRaises(KeyboardInterrupt):
+                first._scan(self.out, self.STUDENTS)
+            self.assertTrue(isfile(self.out + '.checkpoint'))
+            second = self._capg()
+            self.assertEqual(second._scan(self.out, self.STUDENTS), wrote)
+            self.assertEqual(second.matched, 500 - stop)
+            self.assertEqual(self._read(), expected, msg=f'stop={stop}')
+            self.assertFalse(isfile(self.out + '.checkpoint'))
+
+    def testResumePlain(self):
+        self.checkResume()
+
+    def testResumeCompressed(self):
+        path = join(self.tmp.name, 'socio.csv')
+        compression.recompress(path, path + '.xz', 'xz')
+        os.remove(path)
+        self.checkResume()
+
+    def testInterruptInWriterow(self):
+        wrote = self._capg()._scan(self.out, self.STUDENTS)
+        expected = self._read()
+        writerow = csv.DictWriter.writerow
+        for stop in [1, 2, 30]: # 1 is the header
+            calls = []
+            def interrupting(writer, row):
+                result = writerow(writer, row)
+                calls.append(row)
+                if len(calls) == stop:
+                    raise KeyboardInterrupt()
+                return result
+            with mock.patch.object(csv.DictWriter, 'writerow', interrupting):
+                with self.assertRaises(KeyboardInterrupt):
+                    self._capg()._scan(self.out, self.STUDENTS)
+            self.assertTrue(isfile(self.out + '.checkpoint'))
+            self.assertEqual(self._capg()._scan(self.out, self.STUDENTS),
+                             wrote)
+            self.assertEqual(self._read(), expected, msg=f'stop={stop}')
+
+    def testRestartOnOtherStudents(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self._capg(interrupt_at=100)._scan(self.out, self.STUDENTS)
+        capg = self._capg()
+        capg._scan(self.out, self.STUDENTS[:1])
+        self.assertEqual(capg.matched, 500)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from .context import extsort
+import unittest
+import random
+import tempfile
+import os
+
+class ExtSortTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = random.Random(7)
+        self.rows = [[str(rng.randint(0, 30)), rng.choice('ab'), str(i),
+                      rng.choice(['x,y', 'line\nbreak', '"q"', ''])]
+                     for i in range(500)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testSortIsStableAcrossRuns(self):
+        key = lambda r: int(r[0])
+        expected = sorted(self.rows, key=key)
+        for run_rows in [7, 100, 1000]:
+            actual = list(extsort.sort_rows(iter(self.rows), key, run_rows,
+                                            directory=self.tmp.name))
+            self.assertEqual(actual, expected)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def testUniqueKeepsFirstInInputOrder(self):
+        key = extsort.columns_key([0, 1])
+        seen, expected = set(), []
+        for r in self.rows:
+            if key(r) not in seen:
+                seen.add(key(r))
+                expected.append(r)
+        actual = list(extsort.unique_rows(iter(self.rows), key, run_rows=13))
+        self.assertEqual(actual, expected)
+
+    def testUniqueNewest(self):
+        rows = [['1', '2015'], ['2', '2016'], ['1', '2017'], ['1', ''],
+                ['2', '2016'], ['3', 'NA']]
+        actual = list(extsort.unique_rows(rows, extsort.columns_key([0]),
+                                          extsort.newest(1), run_rows=2))
+        self.assertEqual(actual, [['2', '2016'], ['1', '2017'], ['3', 'NA']])
+
+    def testFilterGroups(self):
+        has_b = lambda g: [r for r in g if r[1] == 'a'] \
+                          if any(r[1] == 'b' for r in g) else []
+        groups = dict()
+        for r in self.rows:
+            groups.setdefault(r[0], []).append(r)
+        expected = [r for r in self.rows if r[1] == 'a' and \
+                    any(x[1] == 'b' for x in groups[r[0]])]
+        actual = list(extsort.filter_groups(iter(self.rows), lambda r: r[0],
+                                            has_b, run_rows=50))
+        self.assertEqual(actual, expected)
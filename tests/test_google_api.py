@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from .context import google_api, datasets
+import unittest
+import tempfile
+import threading
+import os
+from os.path import join, isfile, abspath, dirname
+
+class GoogleApiTests(unittest.TestCase):
+    def setUp(self):
+        google_api.reset()
+        self.key_file = abspath(join(dirname(__file__), '..',
+                                     datasets.SERVICE_ACCOUNT_FILE))
+        if not isfile(self.key_file):
+            self.skipTest('No Google API key file.')
+
+    def tearDown(self):
+        google_api.reset()
+
+    def testCredentialsAreShared(self):
+        a = google_api.credentials(self.key_file, ['b', 'a'])
+        self.assertIs(google_api.credentials(self.key_file, ['a', 'b']), a)
+        self.assertIsNot(google_api.credentials(self.key_file, ['a']), a)
+
+    def testServicePerThread(self):
+        scopes = [google_api.SPREADSHEETS]
+        s = google_api.service('sheets', 'v4', self.key_file, scopes)
+        self.assertIs(google_api.service('sheets', 'v4', self.key_file,
+                                         scopes), s)
+        other = []
+        t = threading.Thread(target=lambda: other.append(
+            google_api.service('sheets', 'v4', self.key_file, scopes)))
+        t.start()
+        t.join()
+        self.assertIsNot(other[0], s)
+
+class LazyServiceTests(unittest.TestCase):
+    def testLazyCPCWorks(self):
+        with tempfile.TemporaryDirectory() as d:
+            cpc = datasets.CPCWorks(key_file=join(d, 'missing.json'))
+            self.assertEqual(cpc.sheetId, datasets.CPCWorks.ID)
+
+class DiscoveryCacheTests(unittest.TestCase):
+    def testRoundTrip(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = google_api.DiscoveryCache(join(d, 'disc'), max_age=60)
+            self.assertIsNone(cache.get('https://x/api'))
+            cache.set('https://x/api', '{"a": 1}')
+            self.assertEqual(cache.get('https://x/api'), '{"a": 1}')
+            self.assertIsNone(cache.get('https://x/other'))
+            path = cache._path('https://x/api')
+            os.utime(path, (0, 0))
+            self.assertIsNone(cache.get('https://x/api'))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from .context import datasets, names, instrument
+import unittest
+import tempfile
+import json
+import time
+import io
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, isfile
+
+class InstrumentTests(unittest.TestCase):
+    def setUp(self):
+        instrument.reset()
+        instrument.set_counting(True)
+
+    def tearDown(self):
+        instrument.set_counting(False)
+
+    def testCountsRowsAndCacheHits(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(join(d, 'f.csv'), 'w') as f:
+                f.write('a,b\n1,2\n3,4\n')
+            ds = datasets.InputDataset('f.csv')
+            with ds.open_csv(directory=d) as r:
+                self.assertEqual(len(list(r)), 2)
+            with ds.replace_csv(directory=d) as w:
+                w.writerows([{'a': 5, 'b': 6}] * 3)
+            entries = instrument.report()['entries']
+            # replace_csv() also opens the file to read its header
+            self.assertEqual(entries['open_csv:f.csv']['calls'], 2)
+            self.assertEqual(entries['open_csv:f.csv']['rows_in'], 2)
+            self.assertEqual(entries['open_csv:f.csv']['bytes_in'], 2*12)
+            self.assertEqual(entries['replace_csv:f.csv']['rows_out'], 3)
+            self.assertEqual(entries['replace_csv:f.csv']['bytes_out'], 4*5)
+            self.assertEqual(entries['download:f.csv']['calls'], 2)
+            self.assertEqual(entries['download:f.csv']['cache_hits'], 2)
+
+    def testCountsNameCalls(self):
+        names.is_author('John Doe', 'Roe, R.; Doe, J.')
+        entries = instrument.report()['entries']
+        self.assertEqual(entries['names.is_author']['calls'], 1)
+        self.assertEqual(entries['names.same_name']['calls'], 2)
+        self.assertEqual(entries['names.canon_name']['calls'], 2)
+
+    def testCountingIsOptIn(self):
+        instrument.set_counting(False)
+        names.same_name('John Doe', 'J. Doe')
+        self.assertNotIn('names.same_name', instrument.report()['entries'])
+        instrument.start_profiling(interval=1, targets=[])
+        self.assertTrue(instrument.is_counting())
+        names.same_name('John Doe', 'J. Doe')
+        with tempfile.TemporaryDirectory() as d:
+            instrument.stop_profiling(directory=d)
+        self.assertFalse(instrument.is_counting())
+        entries = instrument.report()['entries']
+        self.assertEqual(entries['names.same_name']['calls'], 1)
+
+    def testThreadSafeCounts(self):
+        def work():
+            for i in range(2000):
+                instrument.count('t.count')
+                instrument.add('t.add', calls=1, rows_in=2)
+        with ThreadPoolExecutor(4) as ex:
+            for f in [ex.submit(work) for i in range(4)]:
+                f.result()
+        entries = instrument.report()['entries']
+        self.assertEqual(entries['t.count']['calls'], 8000)
+        self.assertEqual(entries['t.add']['calls'], 8000)
+        self.assertEqual(entries['t.add']['rows_in'], 16000)
+
+    def testDumpJSON(self):
+        with tempfile.TemporaryDirectory() as d:
+            names.same_name('John Doe', 'J. Doe')
+            with open(instrument.dump_json(join(d, 'report.json'))) as f:
+                report = json.load(f)
+            self.assertEqual(report['entries']['names.same_name']['calls'], 1)
+            out = io.StringIO()
+            instrument.print_report(file=out)
+            self.assertIn('names.same_name', out.getvalue())
+
+    def testProfiling(self):
+        original = names.canon_name
+        with tempfile.TemporaryDirectory() as d:
+            instrument.start_profiling(interval=0.001, sample_every=2,
+                                       targets=['ppgcc_metrics.names:canon_name'])
+            self.assertTrue(instrument.is_profiling())
+            self.assertIsNot(names.canon_name, original)
+            for i in range(10):
+                self.assertTrue(names.same_name('John Doe', 'J. Doe'))
+            path = instrument.stop_profiling(directory=d)
+            self.assertIs(names.canon_name, original)
+            self.assertTrue(isfile(path))
+            prof = instrument.report()['profile']
+            self.assertEqual(prof['stacks'], path)
+            stats = prof['functions']['ppgcc_metrics.names:canon_name']
+            self.assertEqual(stats['calls'], 10)
+            self.assertEqual(stats['sampled'], 5)
+
+    def testProfilingCountsPerThread(self):
+        def work():
+            for i in range(100):
+                names.canon_name('John Doe', 'J. Doe')
+        with tempfile.TemporaryDirectory() as d:
+            instrument.start_profiling(interval=1, sample_every=10,
+                                       targets=['ppgcc_metrics.names:canon_name'])
+            with ThreadPoolExecutor(4) as ex:
+                for f in [ex.submit(work) for i in range(4)]:
+                    f.result()
+            instrument.stop_profiling(directory=d)
+        prof = instrument.report()['profile']
+        stats = prof['functions']['ppgcc_metrics.names:canon_name']
+        self.assertEqual(stats['calls'], 400)
+        self.assertEqual(stats['sampled'], 40)
+
+    def testProfilingSamplesWorkerThreads(self):
+        def work():
+            deadline = time.time() + 0.3
+            while time.time() < deadline:
+                names.canon_name('John Doe', 'J. Doe')
+        with tempfile.TemporaryDirectory() as d:
+            instrument.start_profiling(interval=0.001, targets=[])
+            with ThreadPoolExecutor(1, thread_name_prefix='build') as ex:
+                ex.submit(work).result()
+            with open(instrument.stop_profiling(directory=d)) as f:
+                stacks = f.read().splitlines()
+        self.assertTrue(stacks)
+        self.assertTrue(all(st.startswith('build') for st in stacks \
+                            if 'canon_name' in st))
+        self.assertTrue(any('canon_name' in st for st in stacks))
+        self.assertFalse(any(st.startswith('MainThread') for st in stacks))
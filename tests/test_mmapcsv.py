@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from .context import mmapcsv, datasets, instrument
+import unittest
+import random
+import tempfile
+import lzma
+import mmap
+import csv
+import io
+import os
+
+class ScannerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = random.Random(3)
+        self.fields = ['id', 'nome', 'obs']
+        self.rows = [{'id': str(i), 'nome': rng.choice(['João', 'Ana']),
+                      'obs': rng.choice(['x,y', 'line\nbreak', '"q"', '',
+                                         'plain', 'crlf\r\nbreak'])}
+                     for i in range(300)]
+        self.path = os.path.join(self.tmp.name, 'f.csv')
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=self.fields)
+            w.writeheader()
+            w.writerows(self.rows)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _map(self, data):
+        path = os.path.join(self.tmp.name, 'm.csv')
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def testSameAsDictReader(self):
+        with open(self.path, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            s = mmapcsv.Scanner(mm)
+            self.assertEqual(s.fieldnames, self.fields)
+            self.assertEqual([r.to_dict() for r in s], self.rows)
+            self.assertEqual(s.rows, len(self.rows))
+            self.assertGreaterEqual(s.pos, os.path.getsize(self.path))
+
+    def testColumns(self):
+        with open(self.path, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            got = list(mmapcsv.Scanner(mm, columns=['obs', 'id']))
+        self.assertEqual(got, [(r['obs'], r['id']) for r in self.rows])
+        with self.assertRaises(KeyError):
+            mmapcsv.Scanner(b'a,b\n1,2\n', columns=['c'])
+
+    def testLazyDecoding(self):
+        s = mmapcsv.Scanner(b'a;b\r\n\xff;2\r\n\r\n3\r\n', ';')
+        rows = list(s)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['b'], '2')
+        with self.assertRaises(UnicodeDecodeError):
+            rows[0]['a']
+        self.assertEqual(rows[1]['a'], '3')
+        self.assertIsNone(rows[1]['b'])
+        self.assertEqual(rows[1].get('c', 'x'), 'x')
+
+    def testBOMAndNoTrailingNewline(self):
+        s = mmapcsv.Scanner(b'\xef\xbb\xbfa,b\n1,"x\ny"')
+        self.assertEqual(s.fieldnames, ['a', 'b'])
+        self.assertEqual([r.to_dict() for r in s], [{'a': '1', 'b': 'x\ny'}])
+
+    def testBareQuotes(self):
+        data = 'a,b\n1,ab"c\n2,"q""uote\nx"\n3,"z"z""\n4,"e"""\n5,f"\n'
+        expected = list(csv.DictReader(io.StringIO(data, newline='')))
+        got = [r.to_dict() for r in mmapcsv.Scanner(data.encode('utf-8'))]
+        self.assertEqual(got, expected)
+        self.assertEqual(len(got), 5)
+
+    def testTextFallback(self):
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            self.assertEqual([r.to_dict() for r in mmapcsv.Scanner(f)],
+                             self.rows)
+
+    def testDatasetScan(self):
+        instrument.reset()
+        ds = datasets.Dataset('f.csv', None, directory=self.tmp.name)
+        with ds.scan() as s:
+            self.assertEqual(list(s), self.rows)
+        with ds.scan(columns=['id']) as s:
+            self.assertEqual([r for r, in s], [r['id'] for r in self.rows])
+        self.assertEqual(instrument.STATS['scan:f.csv']['rows_in'],
+                         2 * len(self.rows))
+        self.assertEqual(instrument.STATS['scan:f.csv']['bytes_in'],
+                         2 * os.path.getsize(self.path))
+
+    def testDatasetScanCompressed(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with lzma.open(os.path.join(self.tmp.name, 'g.csv.xz'), 'wb') as f:
+            f.write(data)
+        ds = datasets.CompressedCSV('g.csv', directory=self.tmp.name)
+        with ds.scan() as s:
+            self.assertEqual(list(s), self.rows)
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 from .context import names as n
 from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
 import unittest
+import random
+import tempfile
+import os
+from Levenshtein import distance
 
 class CleanNameTests(unittest.TestCase):
     def testUpercase(self):
@@ -203,6 +208,21 @@ class SameAuthorsTest(unittest.TestCase):
                                        'Huf A., Siqueira F.',
                                         allow_extras=False, **fmt))
         
+class BoundedDistanceTests(unittest.TestCase):
+    def testRandom(self):
+        rng = random.Random(5)
+        words = [''.join(rng.choice('ABCE') for i in range(rng.randint(0, 9)))
+                 for j in range(150)]
+        for a in words:
+            for b in rng.sample(words, 20):
+                d = distance(a, b)
+                for k in range(4):
+                    ex = d if d <= k else k + 1
+                    self.assertEqual(n._banded_distance(a, b, k), ex)
+                    self.assertEqual(n.bounded_distance(a, b, k), ex)
+                    self.assertEqual(n.safe_distance(a, b, k) <= k,
+                                     n.safe_distance(a, b) <= k)
+
 class CanonMapsTest(unittest.TestCase):
     def testEmpytLists(self):
         self.assertEqual(list(repeat(dict(), 2)), n.canon_maps([], []))
@@ -244,3 +264,190 @@ class CanonMapsTest(unittest.TestCase):
         b = ['Fulano Silveira', 'Fulano Silvera']
         self.assertEqual([dict(), {n.clean_name(b[1]): n.clean_name(a[0])}], \
                          n.canon_maps(a, b, allow_ambiguous=True))
+
+class ParallelCanonMapsTest(unittest.TestCase):
+    A = ['Fulano Silveira', 'Lucas Viana Knochenhauer', 'Ana Costa',
+         'João P. Silva', 'Maria da Costa e Silva', 'Jo Li', 'C. Leite']
+    B = ['Fulano Silvera', 'Lucas Knochenhuaer', 'Ana C. Costa',
+         'Joao Silva', 'Maria Silva', 'Jo Lu', 'Carlos Leite', 'Ana Costa']
+    C = ['F. Silveira', 'Lucas V. Knochenhauer', 'Joao Pedro Silva']
+
+    def testWorkers(self):
+        for kwargs in [{}, {'allow_ambiguous': True},
+                       {'max_levenshtein': 0, 'max_levenshtein_last': 2}]:
+            ex = n.canon_maps(self.A, self.B, self.C, **kwargs)
+            self.assertEqual(n.canon_maps(self.A, self.B, self.C, workers=2,
+                                          **kwargs), ex)
+
+    def testExecutor(self):
+        ex = n.canon_maps(self.A, self.B)
+        with ThreadPoolExecutor(3) as executor:
+            self.assertEqual(n.canon_maps(self.A, self.B, executor=executor),
+                             ex)
+            self.assertEqual(executor.submit(len, 'ab').result(), 2)
+
+class NameIndexTest(unittest.TestCase):
+    NAMES = ['Fulano Silveira', 'Fulano Silvera', 'F. Silveira', 'Fulano S.',
+             'Lucas Viana Knochenhauer', 'Lucas Knochenhuaer', 'Lucas Silva',
+             'Ana Costa', 'Ana Costa Lima', 'Joao Silva', 'Josi Silva',
+             'João P. Silva', 'JP Doe', 'Joao Pedro Doe', 'J. Doe', 'Jo Li',
+             'Jo Lu', 'Maria', 'Maria da Costa e Silva', 'C. Leite']
+
+    def checkBruteForce(self, **kwargs):
+        index = n.NameIndex(**kwargs)
+        for nm in self.NAMES:
+            index.add(nm)
+        for q in self.NAMES + ['Fulano Silvieira', 'Lucas Knochenhauerr',
+                               'Mario', 'L. Knochenhauer', 'Jose Silva']:
+            ex = [x for x in self.NAMES if n.same_name(x, q, **kwargs)]
+            self.assertEqual(index.find(q), ex, msg=f'q={q}, {kwargs}')
+
+    def testDefault(self):
+        self.checkBruteForce()
+    def testLevenshtein(self):
+        self.checkBruteForce(levenshtein=1)
+        self.checkBruteForce(levenshtein=1, levenshtein_last=0)
+    def testLevenshteinLast(self):
+        self.checkBruteForce(levenshtein_last=1)
+        self.checkBruteForce(levenshtein_last=2)
+    def testSuperCompact(self):
+        self.checkBruteForce(super_compact=True)
+    def testGroups(self):
+        index = n.NameIndex()
+        index.add('Ana Costa', 1, group='MESTRADO')
+        index.add('Ana Costa', 2, group='DOUTORADO')
+        self.assertEqual(index.find('Ana C. Costa', group='DOUTORADO'), [2])
+        self.assertEqual(index.find('Ana Costa'), [])
+    def testFewCandidates(self):
+        index = n.NameIndex()
+        for nm in self.NAMES:
+            index.add(nm)
+        self.assertEqual([x for x, v in index.candidates('Ana Lima Costa')],
+                         ['Ana Costa'])
+
+class MatchManyTest(unittest.TestCase):
+    def checkBruteForce(self, **kwargs):
+        a = NameIndexTest.NAMES + ['Fulano Silvieira', 'L. Knochenhauer',
+                                   'JOAO SILVA', 'Joao  Silva', None, '']
+        b = NameIndexTest.NAMES + ['Jose Silva', 'Mario', None]
+        ex = {x: {y: n.canon_name(x, y, **kwargs) for y in b \
+                  if n.canon_name(x, y, **kwargs) != None} for x in a}
+        self.assertEqual(n.match_many(a, b, **kwargs), ex, msg=f'{kwargs}')
+
+    def testDefault(self):
+        self.checkBruteForce()
+    def testLevenshtein(self):
+        self.checkBruteForce(levenshtein=1)
+        self.checkBruteForce(levenshtein=1, levenshtein_last=0)
+    def testLevenshteinLast(self):
+        self.checkBruteForce(levenshtein_last=2)
+    def testSuperCompact(self):
+        self.checkBruteForce(super_compact=True)
+    def testEmpty(self):
+        self.assertEqual(n.match_many([], ['Ana Costa']), {})
+        self.assertEqual(n.match_many(['Ana Costa'], []), {'Ana Costa': {}})
+
+class IdentityRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'identities.csv')
+
+    def tearDown(self):
+        n.use_registry(None)
+        self.tmp.cleanup()
+
+    def testLearnFromCanonMaps(self):
+        reg = n.IdentityRegistry(self.path)
+        maps = n.canon_maps(['JOAO PEDRO DOE', 'MARIA SOUZA'],
+                            ['J. P. DOE', 'Maria Souza'])
+        reg.learn(maps, ['a:x', 'b:y'])
+        self.assertEqual(reg.person('J.P. Doe'), 'JOAO PEDRO DOE')
+        self.assertEqual(reg.person('JP Doe', super_compact=True),
+                         'JOAO PEDRO DOE')
+        self.assertEqual(reg.person('MARIA SOUZA'), None)
+        self.assertTrue(reg.same('j. p. doe', 'Joao Pedro Doe'))
+        self.assertEqual(reg.same('J. P. DOE', 'Maria Souza'), None)
+        reg.save()
+        loaded = n.IdentityRegistry(self.path)
+        self.assertEqual(loaded.rows, reg.rows)
+        self.assertEqual(loaded.rows['J. P. DOE']['source'], 'b:y')
+
+    def testLearnDoesNotChain(self):
+        reg = n.IdentityRegistry(self.path)
+        reg.learn([{'JOAO DOE': 'JOAO PEDRO DOE'}])
+        reg.learn([{'JOAO DOE': 'JOAO PAULO DOE'},
+                   {'JOAO PAULO DOE': 'JOAO DOE'}])
+        self.assertEqual(reg.person('JOAO DOE'), 'JOAO PEDRO DOE')
+        self.assertEqual(reg.person('JOAO PAULO DOE'), None)
+        self.assertEqual(reg.same('JOAO PAULO DOE', 'JOAO PEDRO DOE'), None)
+        reg.learn([{'J. P. DOE': 'JOAO DOE'}])
+        self.assertEqual(reg.person('J. P. DOE'), 'JOAO PEDRO DOE')
+
+    def testLearnUsesCanonMapsTolerance(self):
+        reg = n.IdentityRegistry(self.path)
+        reg.learn([{'JOAO DOE': 'JOAO PEDRO DOE'}])
+        reg.learn([{'JOAO PEDRA DOE': 'JOAO PEDRO DOE'}], max_levenshtein=0)
+        self.assertEqual(reg.person('JOAO PEDRA DOE'), None)
+        reg.learn([{'JOAO PEDRA DOE': 'JOAO PEDRO DOE'}])
+        self.assertEqual(reg.person('JOAO PEDRA DOE'), 'JOAO PEDRO DOE')
+
+    def testRegistryOnlyForDefaultTolerance(self):
+        reg = n.use_registry(self.path)
+        reg.assign('ANA COSTA', 'ANA COSTA')
+        reg.assign('ANA COSTE', 'ANA COSTE')
+        self.assertFalse(n.same_name('Ana Costa', 'Ana Coste'))
+        self.assertTrue(n.same_name('Ana Costa', 'Ana Coste',
+                                    levenshtein_last=1))
+
+    def testMatchManyUsesRegistry(self):
+        a, b = ['J. Doe', 'Maria Silva'], ['JOAO DOE', 'JOSE DOE', 'Maria Souza']
+        self.assertEqual(n.match_many(a, b)['J. Doe'],
+                         {'JOAO DOE': 'JOAO DOE', 'JOSE DOE': 'JOSE DOE'})
+        reg = n.use_registry(self.path)
+        reg.assign('JOAO DOE', 'JOAO DOE')
+        reg.assign('J. DOE', 'JOSE DOE')
+        reg.assign('MARIA SILVA', 'MARIA SOUZA')
+        matches = n.match_many(a, b)
+        self.assertEqual(matches['J. Doe'], {'JOSE DOE': 'JOSE DOE'})
+        self.assertEqual(list(matches['Maria Silva']), ['Maria Souza'])
+        for x in a:
+            self.assertEqual(set(matches[x]),
+                             {y for y in b if n.same_name(x, y)})
+        self.assertEqual(len(n.match_many(a, b, use_registry=False)['J. Doe']),
+                         2)
+
+    def testRegistryFromEnv(self):
+        env = os.environ.get(n.REGISTRY_ENV)
+        try:
+            os.environ[n.REGISTRY_ENV] = '0'
+            self.assertIsNone(n.registry_from_env())
+            os.environ[n.REGISTRY_ENV] = self.path
+            reg = n.registry_from_env()
+            self.assertIs(n.REGISTRY, reg)
+            self.assertEqual(reg.filepath, self.path)
+        finally:
+            if env == None:
+                del os.environ[n.REGISTRY_ENV]
+            else:
+                os.environ[n.REGISTRY_ENV] = env
+
+    def testManualDecisionsPersist(self):
+        reg = n.use_registry(self.path)
+        self.assertTrue(n.same_name('J. DOE', 'JOAO DOE'))
+        reg.assign('JOAO DOE', 'JOAO DOE')
+        reg.assign('J. DOE', 'JOSE DOE')
+        reg.learn([{'J. DOE': 'JOAO DOE'}])
+        self.assertEqual(reg.person('J. DOE'), 'JOSE DOE')
+        reg.save()
+        n.use_registry(self.path)
+        self.assertFalse(n.same_name('J. DOE', 'JOAO DOE'))
+        self.assertTrue(n.is_author('J. Doe', 'Doe, Jose; Silva, Ana'))
+        self.assertFalse(n.is_author('Joao Doe', 'Doe, J.; Silva, Ana'))
+        maps = n.canon_maps(['J. DOE'], ['JOAO DOE', 'JOSE DOE'])
+        self.assertEqual(maps, [{'J. DOE': 'JOSE DOE'}, {}])
+
+    def testUnknownNamesFallBack(self):
+        n.use_registry(n.IdentityRegistry(self.path))
+        self.assertTrue(n.same_name('Ana Costa', 'Ana C. Costa'))
+        self.assertFalse(n.same_name('Ana Costa', 'Ana Lima'))
+        self.assertFalse(os.path.exists(n.REGISTRY.save()))
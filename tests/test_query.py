@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from .context import query, datasets, mmapcsv, instrument
+from .context import compression
+import unittest
+import tempfile
+import random
+import csv
+import os
+
+class QueryTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = random.Random(7)
+        self.fields = ['AN_BASE', 'NM_DISCENTE', 'NM_GRAU_ACADEMICO', 'obs']
+        self.rows = [{'AN_BASE': str(rng.randint(2015, 2019)),
+                      'NM_DISCENTE': f'DISCENTE {i % 40}',
+                      'NM_GRAU_ACADEMICO': rng.choice(['MESTRADO',
+                                                       'DOUTORADO']),
+                      'obs': rng.choice(['', 'a,b', 'x\ny', '7'])}
+                     for i in range(200)]
+        self.ds = datasets.Dataset('q.csv', None, directory=self.tmp.name)
+        with open(os.path.join(self.tmp.name, 'q.csv'), 'w',
+                  encoding='utf-8', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=self.fields)
+            w.writeheader()
+            w.writerows(self.rows)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testAllRows(self):
+        self.assertEqual(self.ds.query().to_list(), self.rows)
+        self.assertEqual(self.ds.query().count(), len(self.rows))
+
+    def testWhereSelect(self):
+        q = self.ds.query().where(NM_GRAU_ACADEMICO='MESTRADO') \
+                   .where(lambda y: int(y) >= 2017, 'AN_BASE') \
+                   .select('NM_DISCENTE', 'obs')
+        self.assertEqual(q.columns(), ['NM_DISCENTE', 'obs',
+                                       'NM_GRAU_ACADEMICO', 'AN_BASE'])
+        ex = [{'NM_DISCENTE': r['NM_DISCENTE'], 'obs': r['obs']} \
+              for r in self.rows if r['NM_GRAU_ACADEMICO'] == 'MESTRADO' \
+                                    and int(r['AN_BASE']) >= 2017]
+        self.assertEqual(list(q), ex)
+        self.assertEqual(self.ds.query().where(AN_BASE={2015, '2016'}) \
+                         .count(), len([r for r in self.rows \
+                                        if r['AN_BASE'] < '2017']))
+        with self.assertRaises(ValueError):
+            self.ds.query().where(lambda y: True)
+
+    def testImmutable(self):
+        q = self.ds.query()
+        q.where(AN_BASE='2015').select('obs')
+        self.assertEqual(q.count(), len(self.rows))
+
+    def testPushdown(self):
+        # projected values of rejected rows are never decoded
+        s = mmapcsv.Scanner(b'a,b\n1,\xff\n2,y\n\n3\n',
+                            where=[(['a'], lambda a: a == '2')],
+                            columns=['b'])
+        self.assertEqual(list(s), [('y',)])
+        self.assertEqual(s.rows, 3)
+        s = mmapcsv.Scanner(b'a,b\n1,\xff\n2,y\n', columns=['b'])
+        with self.assertRaises(UnicodeDecodeError):
+            list(s)
+
+    def testGroupBy(self):
+        q = self.ds.query().where(NM_GRAU_ACADEMICO='DOUTORADO') \
+                   .group_by('AN_BASE', n=query.Count(),
+                             obs=query.Count('obs'),
+                             alunos=query.CountDistinct('NM_DISCENTE'),
+                             total=query.Sum('obs', convert=len),
+                             first=query.Min('NM_DISCENTE'))
+        self.assertEqual(set(q.columns()), {'AN_BASE', 'obs', 'NM_DISCENTE',
+                                            'NM_GRAU_ACADEMICO'})
+        groups = dict()
+        for r in self.rows:
+            if r['NM_GRAU_ACADEMICO'] == 'DOUTORADO':
+                groups.setdefault(r['AN_BASE'], []).append(r)
+        got = q.to_list()
+        self.assertEqual([g['AN_BASE'] for g in got], list(groups.keys()))
+        for g in got:
+            rs = groups[g['AN_BASE']]
+            self.assertEqual(g['n'], len(rs))
+            self.assertEqual(g['obs'], len([r for r in rs if r['obs']]))
+            self.assertEqual(g['alunos'],
+                             len({r['NM_DISCENTE'] for r in rs}))
+            self.assertEqual(g['total'],
+                             sum(len(r['obs']) for r in rs))
+            self.assertEqual(g['first'], min(r['NM_DISCENTE'] for r in rs))
+        big = q.where(lambda n: n > 20, 'n').select('AN_BASE')
+        self.assertEqual(big.to_list(), [{'AN_BASE': g['AN_BASE']} \
+                                         for g in got if g['n'] > 20])
+        self.assertEqual(self.ds.query().group_by('AN_BASE').first(),
+                         {'AN_BASE': self.rows[0]['AN_BASE'],
+                          'count': len([r for r in self.rows if \
+                                        r['AN_BASE'] == \
+                                        self.rows[0]['AN_BASE']])})
+
+    def testGroupByFilters(self):
+        with open(os.path.join(self.tmp.name, 'g.csv'), 'w',
+                  encoding='utf-8', newline='') as f:
+            f.write('g\na\nb\nb\nb\n')
+        ds = datasets.Dataset('g.csv', None, directory=self.tmp.name)
+        q = ds.query().group_by('g')
+        self.assertEqual(q.where(count=lambda n: n >= 3, g='a').to_list(), [])
+        self.assertEqual(q.where(lambda n: n >= 3, 'count') \
+                          .where(g={'a', 'b'}).to_list(),
+                         [{'g': 'b', 'count': 3}])
+
+    def testLimitClosesScan(self):
+        instrument.reset()
+        rows = self.ds.query().select('AN_BASE').limit(3).to_list()
+        self.assertEqual(rows, [{'AN_BASE': r['AN_BASE']} \
+                                for r in self.rows[:3]])
+        self.assertEqual(instrument.report()['entries'][f'scan:{self.ds}']['calls'], 1)
+
+    def testCompressed(self):
+        path = os.path.join(self.tmp.name, 'q.csv')
+        compression.recompress(path, path + '.gz', 'gz')
+        os.remove(path)
+        ds = datasets.CompressedCSV('q.csv', directory=self.tmp.name)
+        q = ds.query().where(AN_BASE='2018').select('NM_DISCENTE')
+        self.assertEqual(q.to_list(), [{'NM_DISCENTE': r['NM_DISCENTE']} \
+                                       for r in self.rows \
+                                       if r['AN_BASE'] == '2018'])
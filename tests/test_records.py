@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from .context import records, datasets
+import unittest
+import csv
+import io
+import sys
+import tempfile
+from os.path import join
+
+class RecordTests(unittest.TestCase):
+    def setUp(self):
+        self.Work = records.record_type('Work', ['year', 'cited by',
+                                                 'Título', 'class', '1st'])
+
+    def testSameClassForSameSchema(self):
+        self.assertIs(records.record_type('Work', ['year', 'cited by', 'Título',
+                                                  'class', '1st']), self.Work)
+
+    def testDictLike(self):
+        w = self.Work({'year': '2017', 'cited by': '3'})
+        self.assertEqual(w['year'], '2017')
+        self.assertIn('cited by', w)
+        self.assertNotIn('Título', w)
+        self.assertEqual(w.get('Título', 'x'), 'x')
+        with self.assertRaises(KeyError):
+            w['Título']
+        w['Título'] = 'A'
+        w['class'] = 'B'
+        self.assertEqual(list(w.keys()), ['year', 'cited by', 'Título', 'class'])
+        self.assertEqual(w, {'year': '2017', 'cited by': '3',
+                             'Título': 'A', 'class': 'B'})
+        with self.assertRaises(KeyError):
+            w['venue'] = 'X'
+        del w['class']
+        self.assertEqual(len(w), 3)
+
+    def testFromLongDictReaderRow(self):
+        reader = csv.DictReader(io.StringIO('year,class\n2017,A,extra\n'))
+        row = next(reader)
+        self.assertEqual(row[None], ['extra'])
+        self.assertEqual(self.Work(row), {'year': '2017', 'class': 'A'})
+
+    def testNoDict(self):
+        w = self.Work(year='2017')
+        self.assertFalse(hasattr(w, '__dict__'))
+        self.assertLess(sys.getsizeof(w), sys.getsizeof(dict(w.items())))
+
+    def testWorksWithDictWriter(self):
+        out = io.StringIO()
+        w = csv.DictWriter(out, fieldnames=self.Work.FIELDS)
+        w.writerow(self.Work({'year': '2017', '1st': 'x'}))
+        self.assertEqual(out.getvalue(), '2017,,,,x\r\n')
+
+    def testReaderAndWriter(self):
+        text = 'year,cited by,extra,Título\r\n2017,3,e,"a,b"\r\n\r\n2018,,,\r\n'
+        reader = records.RecordReader(io.StringIO(text), self.Work)
+        rows = list(reader)
+        self.assertEqual(reader.fieldnames, ['year', 'cited by', 'extra', 'Título'])
+        self.assertEqual(rows, [{'year': '2017', 'cited by': '3', 'Título': 'a,b'},
+                                {'year': '2018', 'cited by': '', 'Título': ''}])
+        out = io.StringIO()
+        writer = records.RecordWriter(out, self.Work)
+        writer.writeheader()
+        writer.writerows(rows + [{'class': 'c'}])
+        self.assertEqual(out.getvalue(), 'year,cited by,Título,class,1st\r\n' + \
+                         '2017,3,"a,b",,\r\n2018,,,,\r\n,,,c,\r\n')
+        with self.assertRaises(ValueError):
+            writer.writerow({'extra': 1})
+
+    def testReaderFromHeader(self):
+        reader = records.RecordReader(io.StringIO('a;b\n1;2\n3\n'), delimiter=';')
+        self.assertEqual(list(reader), [{'a': '1', 'b': '2'},
+                                        {'a': '3', 'b': None}])
+
+    def testOpenRecords(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(join(d, 'w.csv'), 'w') as f:
+                f.write('year,citations,authors,title,venue\n2017,1,A,T,V\n')
+            ds = datasets.InputDataset('w.csv', directory=d)
+            ds.RECORD = datasets.Scholar.WORK_RECORD
+            with ds.open_records() as reader:
+                rows = list(reader)
+            self.assertIs(type(rows[0]), datasets.Scholar.WORK_RECORD)
+            self.assertEqual(rows[0]['venue'], 'V')
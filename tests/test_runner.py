@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from .context import datasets, runner
+import unittest
+import tempfile
+import threading
+import time
+import os
+from os.path import join, isfile
+
+class FakeDataset(datasets.Dataset):
+    def __init__(self, name, directory, *ups, fail=False, barrier=None):
+        super().__init__(name, None, directory=directory)
+        self.ups = list(ups)
+        self.fail = fail
+        self.barrier = barrier
+        self.builds = 0
+
+    def download(self, force=False, **kwargs):
+        filepath = self._get_filepath()
+        if force or not isfile(filepath):
+            for up in self.ups:
+                assert isfile(up._get_filepath()), f'{up} not built'
+            if self.barrier != None:
+                self.barrier.wait(timeout=5)
+            if self.fail:
+                raise RuntimeError(f'{self} failed')
+            self.builds += 1
+            with open(filepath, 'w') as f:
+                f.write('a\n1\n')
+        return filepath
+
+class RunnerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.d = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testUpstreams(self):
+        a = FakeDataset('a.csv', self.d)
+        b = FakeDataset('b.csv', self.d, a, a)
+        year2ds = {2017: a, 2018: b}
+        c = datasets.SucupiraProgram('c.csv', '123', year2ds, directory=self.d)
+        self.assertEqual(b.upstreams(), [a])
+        self.assertEqual(c.upstreams(), [a, b])
+        self.assertEqual(runner.plan([c, b]), [a, b, c])
+
+    def testRunsUpstreamsFirst(self):
+        a = FakeDataset('a.csv', self.d)
+        b = FakeDataset('b.csv', self.d, a)
+        c = FakeDataset('c.csv', self.d, a, b)
+        status = runner.run([c], jobs=4, log=lambda x: None)
+        self.assertEqual(status, {a: 'ok', b: 'ok', c: 'ok'})
+        self.assertEqual([a.builds, b.builds, c.builds], [1, 1, 1])
+
+    def testRunsInParallel(self):
+        barrier = threading.Barrier(2)
+        a = FakeDataset('a.csv', self.d, barrier=barrier)
+        b = FakeDataset('b.csv', self.d, barrier=barrier)
+        status = runner.run([a, b], jobs=2, log=lambda x: None)
+        self.assertEqual(status, {a: 'ok', b: 'ok'})
+
+    def testInterruptDoesNotWait(self):
+        release = threading.Event()
+        class Slow(FakeDataset):
+            def download(self, force=False, **kwargs):
+                release.wait(timeout=5)
+                return super().download(force=force, **kwargs)
+        a = Slow('a.csv', self.d)
+        b = FakeDataset('b.csv', self.d)
+        c = FakeDataset('c.csv', self.d, a)
+        def log(msg):
+            if msg.startswith('Downloading data for b'):
+                raise KeyboardInterrupt()
+        start = time.monotonic()
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                runner.run([a, b, c], jobs=2, log=log)
+            self.assertLess(time.monotonic() - start, 2)
+        finally:
+            release.set()
+        self.assertEqual(c.builds, 0)
+
+    def testSkipsDownstreamOfFailure(self):
+        a = FakeDataset('a.csv', self.d, fail=True)
+        b = FakeDataset('b.csv', self.d, a)
+        c = FakeDataset('c.csv', self.d)
+        status = runner.run([b, c], jobs=2, log=lambda x: None)
+        self.assertEqual(status, {a: 'failed', b: 'skipped', c: 'ok'})
+
+    def testForceOnlyTargets(self):
+        a = FakeDataset('a.csv', self.d)
+        b = FakeDataset('b.csv', self.d, a)
+        runner.run([b], log=lambda x: None)
+        runner.run([b], force=True, log=lambda x: None)
+        self.assertEqual([a.builds, b.builds], [1, 2])
+        runner.run([b], force_all=True, log=lambda x: None)
+        self.assertEqual([a.builds, b.builds], [2, 3])
+
+    def testDryRun(self):
+        a = FakeDataset('a.csv', self.d)
+        b = FakeDataset('b.csv', self.d, a)
+        lines = []
+        status = runner.run([b], dry_run=True, log=lines.append)
+        self.assertEqual(status, {a: 'dry-run', b: 'dry-run'})
+        self.assertEqual(len(lines), 2)
+        self.assertFalse(isfile(join(self.d, 'a.csv')))
+
+    def testResolve(self):
+        named = {'ds.CPC_CSV': FakeDataset('cpc.csv', self.d)}
+        for name in ['ds.CPC_CSV', 'CPC_CSV', 'cpc.csv']:
+            self.assertIs(runner.resolve(name, named), named['ds.CPC_CSV'])
+        with self.assertRaises(KeyError):
+            runner.resolve('de.CPC_CSV', named)
+
+class RemoteFakeDataset(FakeDataset):
+    HOST = 'example.org'
+
+class RefetchedFakeDataset(RemoteFakeDataset):
+    WATCH_REFETCH = True
+
+class WatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.d = self.tmp.name
+        self.input = datasets.InputDataset('in.csv', directory=self.d)
+        self._write('a\n1\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, contents):
+        with open(join(self.d, 'in.csv'), 'w') as f:
+            f.write(contents)
+
+    def testDownstream(self):
+        a = FakeDataset('a.csv', self.d)
+        b = FakeDataset('b.csv', self.d, a)
+        c = FakeDataset('c.csv', self.d)
+        d = FakeDataset('d.csv', self.d, c, b)
+        order = runner.plan([d])
+        self.assertEqual(runner.downstream([b], order), [b, d])
+        self.assertEqual(runner.downstream([a, c], order), [c, a, b, d])
+
+    def testRebuildsAffected(self):
+        b = FakeDataset('b.csv', self.d, self.input)
+        r = RefetchedFakeDataset('r.csv', self.d, self.input)
+        remote = RemoteFakeDataset('remote.csv', self.d, self.input)
+        c = FakeDataset('c.csv', self.d, b, r, remote)
+        other = FakeDataset('other.csv', self.d)
+        e = FakeDataset('e.csv', self.d, other)
+        runner.run([c, e], log=lambda x: None)
+        watcher = runner.Watcher([c, e], log=lambda x: None)
+        self.assertEqual(watcher.poll(), None)
+        self._write('a\n1\n2\n')
+        status = watcher.poll()
+        self.assertEqual({d for d, st in status.items() if st == 'ok'},
+                         {self.input, b, r, remote, c})
+        self.assertEqual([b.builds, r.builds, remote.builds, c.builds,
+                          e.builds], [2, 2, 1, 2, 1])
+        self.assertEqual(watcher.poll(), None)
+
+    def testDoesNotRefetchScholar(self):
+        scholar = datasets.Scholar(self.input, directory=self.d)
+        after = FakeDataset('after.csv', self.d, scholar)
+        log = []
+        watcher = runner.Watcher([after], log=log.append)
+        self._write('a\n1\n2\n')
+        self.assertEqual(watcher.poll(), dict())
+        self.assertTrue(any(str(scholar) in msg for msg in log))
+        self.assertEqual(after.builds, 0)
+
+    def testCAPGInputs(self):
+        socios = datasets.CompressedCSV('socio.csv', directory=self.d)
+        capg = datasets.DiscentesCAPGCNPJ('capg.csv', 'pdfs', socios,
+                                          directory=self.d)
+        pdfs = join(self.d, 'pdfs')
+        self.assertEqual(capg.inputs(), [pdfs])
+        watcher = runner.Watcher([capg], log=lambda x: None)
+        os.makedirs(pdfs)
+        with open(join(pdfs, 'x.pdf'), 'wb') as f:
+            f.write(b'%PDF')
+        self.assertEqual(capg.inputs(), [pdfs, join(pdfs, 'x.pdf')])
+        self.assertEqual(watcher.changed(), [capg])